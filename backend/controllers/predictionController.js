@@ -4,9 +4,42 @@ const axios = require('axios');
 const FormData = require('form-data');
 const streamifier = require('streamifier');
 const cloudinary = require('../config/cloudinary');
+const { jpegFromTensor } = require('../utils/imageProcessing');
 
 const PREDICT_SERVICE_URL = process.env.PREDICT_SERVICE_URL || 'http://127.0.0.1:7000/api/predict';
 const SAVE_TO_CLOUDINARY = (process.env.SAVE_TO_CLOUDINARY || 'false').toLowerCase() === 'true';
+const PREDICT_TIMEOUT_MS = 30000;
+// 'tensor': raw pixels to /api/predict/tensor (no JPEG encode here or decode in Python);
+// 'multipart': a JPEG upload to PREDICT_SERVICE_URL as before
+const PREDICT_INGEST = (process.env.PREDICT_INGEST || 'tensor').toLowerCase();
+const PREDICT_TENSOR_URL = process.env.PREDICT_TENSOR_URL || `${PREDICT_SERVICE_URL}/tensor`;
+let tensorEndpointMissing = false; // set once an older service answers 404
+// Symptoms travel in a URL-encoded header on the tensor path (never the query string, which
+// ends up in access logs); longer texts than fit comfortably in a header go multipart instead
+const SYMPTOMS_HEADER_MAX = 4096;
+
+// POST the preprocessed tensor (and gate thumbnail, if any) as one raw body; shapes and the
+// URL-encoded symptom text go in headers
+async function postTensor(tensor, params, headers, symptomsEncoded) {
+const tensorHeaders = {
+  ...headers,
+  'Content-Type': 'application/octet-stream',
+  'X-Tensor-Shape': tensor.shape.join(','),
+  'X-Tensor-Dtype': 'uint8',
+};
+if (symptomsEncoded) tensorHeaders['X-Symptoms'] = symptomsEncoded;
+const parts = [tensor.data];
+if (tensor.gate) {
+  tensorHeaders['X-Gate-Shape'] = tensor.gateShape.join(',');
+  parts.push(tensor.gate);
+}
+return axios.post(PREDICT_TENSOR_URL, Buffer.concat(parts), {
+  headers: tensorHeaders,
+  params,
+  timeout: PREDICT_TIMEOUT_MS,
+  maxBodyLength: Infinity,
+});
+}
 
 async function uploadToCloudinaryFromBuffer(buffer, filename) {
 return new Promise((resolve, reject) => {
@@ -51,9 +84,15 @@ return res.status(400).json({ success: false, error: 'Image file is required.' }
 }
 
 try {
-// Buffer for Python: use preprocessed 224x224 if present (from your middleware), else original
-const imageBuffer = req.file?.processed?.buffer || req.file.buffer;
+// Pixels for Python: the raw 224x224 tensor from the middleware; a JPEG of it (or the
+// original upload) is only encoded when needed (Cloudinary, multipart ingest)
+const tensor = req.file.tensor || null;
 const originalName = req.file.originalname || 'upload.jpg';
+let jpegBuffer = null;
+const imageJpeg = async () => {
+  if (!jpegBuffer) jpegBuffer = tensor ? await jpegFromTensor(tensor) : req.file.buffer;
+  return jpegBuffer;
+};
 
 const imageTypeRaw = (req.body.image_type || 'fundus').toLowerCase();
 const imageType = imageTypeRaw === 'outer_eye' ? 'outer' : imageTypeRaw; // Python expects 'fundus' or 'outer'
@@ -64,7 +103,7 @@ let cloudinaryUrl = null;
 let cloudinaryPublicId = null;
 if (SAVE_TO_CLOUDINARY) {
   try {
-    const uploaded = await uploadToCloudinaryFromBuffer(imageBuffer, originalName);
+    const uploaded = await uploadToCloudinaryFromBuffer(await imageJpeg(), originalName);
     cloudinaryUrl = uploaded.secure_url;
     cloudinaryPublicId = uploaded.public_id;
   } catch (err) {
@@ -72,23 +111,48 @@ if (SAVE_TO_CLOUDINARY) {
   }
 }
 
-// Send to Python microservice
-// Build form-data for Python microservice
-const form = new FormData();
-form.append('file', imageBuffer, { filename: originalName });
-form.append('image_type', imageType);
-form.append('symptoms', symptomsText);
-
 // NEW: forward relax flag if present in the multipart body
 const relaxRaw = (req.body.relax || '').toString().toLowerCase();
 const relax = relaxRaw === '1' || relaxRaw === 'true' || relaxRaw === 'yes';
-if (relax) form.append('relax', '1');
 
-const { data: svc } = await axios.post(PREDICT_SERVICE_URL, form, {
-headers: form.getHeaders(),
-timeout: 30000,
-maxBodyLength: Infinity,
-});
+// Tell the service when we stop waiting, so it can drop work nobody will read. Relative to its
+// arrival (like the axios timeout of each POST below): an absolute time would depend on the two
+// hosts' clocks agreeing
+const svcHeaders = {
+  'X-Request-Timeout-Ms': String(PREDICT_TIMEOUT_MS),
+  'X-Request-Priority': 'interactive',
+};
+
+// Send to Python microservice: raw tensor when possible
+let svc = null;
+const symptomsEncoded = encodeURIComponent(symptomsText);
+if (tensor && PREDICT_INGEST === 'tensor' && !tensorEndpointMissing
+    && symptomsEncoded.length <= SYMPTOMS_HEADER_MAX) {
+  const params = { image_type: imageType };
+  if (relax) params.relax = '1';
+  try {
+    ({ data: svc } = await postTensor(tensor, params, svcHeaders, symptomsEncoded));
+  } catch (err) {
+    if (err.response?.status !== 404) throw err;
+    tensorEndpointMissing = true;
+    console.warn('Predict service has no tensor endpoint; using multipart uploads');
+  }
+}
+
+if (!svc) {
+  // Build form-data for Python microservice
+  const form = new FormData();
+  form.append('file', await imageJpeg(), { filename: originalName });
+  form.append('image_type', imageType);
+  form.append('symptoms', symptomsText);
+  if (relax) form.append('relax', '1');
+
+  ({ data: svc } = await axios.post(PREDICT_SERVICE_URL, form, {
+    headers: { ...form.getHeaders(), ...svcHeaders },
+    timeout: PREDICT_TIMEOUT_MS,
+    maxBodyLength: Infinity,
+  }));
+}
 
 
 // Handle microservice rejection
@@ -137,7 +201,7 @@ const imageData = {
     format: req.file?.mimetype || 'image/jpeg',
     width: req.file?.imageMetadata?.width || 224,
     height: req.file?.imageMetadata?.height || 224,
-    size: req.file?.processed?.size || req.file?.size || null,
+    size: req.file?.size || null,
   },
 };
 
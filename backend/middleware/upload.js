@@ -1,4 +1,5 @@
 const { upload, handleMulterError } = require('../config/multer');
+const { prepareTensorForML } = require('../utils/imageProcessing');
 
 // Single image upload middleware
 const uploadSingleImage = (fieldName = 'image') => {
@@ -119,35 +120,24 @@ try {
 };
 };
 
-// Preprocess image for ML model (pad to square to preserve content)
+// Preprocess image for ML model: raw 224x224 RGB, padded to square to preserve content
+// (plus a gate thumbnail when PREDICT_GATE_THUMB_SIDE > 0). No JPEG re-encode: the
+// controller sends the pixels as-is to the Python service's tensor endpoint.
+const GATE_THUMB_SIDE = Number(process.env.PREDICT_GATE_THUMB_SIDE || 0);
+
 const preprocessImage = () => {
 return async (req, res, next) => {
 if (!req.file) {
 return next();
 }
 
-const sharp = require('sharp');
-
 try {
-  // Contain & pad to 224x224 instead of cropping; avoids losing content on extreme ratios
-  const processedBuffer = await sharp(req.file.buffer)
-    .resize(224, 224, {
-      fit: 'contain',
-      background: { r: 0, g: 0, b: 0, alpha: 1 } // black padding; you can switch to white
-    })
-    .jpeg({
-      quality: 90,
-      progressive: true
-    })
-    .toBuffer();
-
-  req.file.processed = {
-    buffer: processedBuffer,
-    mimetype: 'image/jpeg',
-    size: processedBuffer.length,
-  };
+  req.file.tensor = await prepareTensorForML(req.file.buffer, {
+    size: 224,
+    gateSide: GATE_THUMB_SIDE,
+  });
 
-  console.log('Image preprocessed for ML model (padded 224x224)');
+  console.log('Image preprocessed for ML model (raw padded 224x224)');
   next();
 } catch (error) {
   console.error('Image preprocessing error:', error);
@@ -30,7 +30,7 @@ maxWidth: 4000,
 maxHeight: 4000,
 aspectRatioRange: [0.5, 2.0],
 }),
-preprocessImage(), // sets req.file.processed.buffer (224x224)
+preprocessImage(), // sets req.file.tensor (raw 224x224 RGB)
 [
 body('symptoms').optional().isString().trim(),
 body('image_type')
@@ -22,6 +22,47 @@ const processImageForML = async (imageBuffer) => {
   }
 };
 
+// Raw RGB pixels for the Python /api/predict/tensor endpoint (no JPEG encode here, no
+// decode there): the size x size model input, padded to square like the JPEG path, plus an
+// optional gate thumbnail (longest side gateSide, never enlarged) for the eye gate.
+// Shapes are [height, width, channels].
+const prepareTensorForML = async (imageBuffer, { size = 224, gateSide = 0 } = {}) => {
+  const toRaw = async (pipeline) => {
+    const { data, info } = await pipeline
+      .toColourspace('srgb')
+      .removeAlpha()
+      .raw()
+      .toBuffer({ resolveWithObject: true });
+    return { data, shape: [info.height, info.width, info.channels] };
+  };
+
+  try {
+    const tensor = await toRaw(
+      sharp(imageBuffer).resize(size, size, {
+        fit: 'contain',
+        background: { r: 0, g: 0, b: 0, alpha: 1 },
+      })
+    );
+    if (gateSide > 0) {
+      const gate = await toRaw(
+        sharp(imageBuffer).resize(gateSide, gateSide, { fit: 'inside', withoutEnlargement: true })
+      );
+      tensor.gate = gate.data;
+      tensor.gateShape = gate.shape;
+    }
+    return tensor;
+  } catch (error) {
+    console.error('Tensor preparation error:', error);
+    throw new Error('Failed to prepare image tensor for ML model');
+  }
+};
+
+// JPEG of a raw tensor from prepareTensorForML (for consumers that need an image file)
+const jpegFromTensor = async ({ data, shape }, quality = 90) =>
+  sharp(data, { raw: { width: shape[1], height: shape[0], channels: shape[2] } })
+    .jpeg({ quality, progressive: true })
+    .toBuffer();
+
 // Extract image metadata
 const extractImageMetadata = async (imageBuffer) => {
   try {
@@ -263,6 +304,8 @@ const assessImageQuality = async (imageBuffer) => {
 
 module.exports = {
   processImageForML,
+  prepareTensorForML,
+  jpegFromTensor,
   extractImageMetadata,
   createThumbnail,
   enhanceImage,
@@ -0,0 +1,490 @@
+"""
+Asyncio serving mode with backpressure and load shedding.
+
+    python async_server.py            (PORT, default 5000)
+
+Same routes and JSON as server.py, as an ASGI application served by uvicorn
+(h11 protocol: request parsing, keep-alive, 100-continue and graceful shutdown
+are uvicorn's; malformed framing, such as a bad chunk size or a
+Transfer-Encoding other than chunked, is answered 400 before the app sees it).
+Admission control is an ASGI middleware in front of the routes; it also refuses
+Content-Length together with Transfer-Encoding, which h11 accepts. Connections
+live on the event loop; CPU-bound work runs on bounded thread pools:
+
+  gate       form parsing, cache lookup, decode and eye gate of /api/predict
+  inference  CNN + symptom model of /api/predict, and the whole handler of the
+             other heavy routes (/api/predict/batch, /api/predict/tensor,
+             /api/symptoms)
+  control    light routes (health, ready, metrics, stats), never shed
+
+At most gate + inference workers + PREDICT_ASYNC_QUEUE_DEPTH heavy requests are
+in the system at once. Beyond that the server answers 429 straight away with a
+Retry-After estimated from recent service times (with `Expect: 100-continue`
+the upload is not even requested). 503 + Retry-After is returned while the
+models are still loading (PREDICT_STARTUP=background), while shutting down,
+and for admitted requests that waited more than PREDICT_ASYNC_QUEUE_TIMEOUT_S
+for a worker: their caller has most likely given up already. Deadline and priority
+headers (deadlines.py) are honoured as in server.py.
+
+Environment: PREDICT_ASYNC_GATE_WORKERS, PREDICT_ASYNC_INFERENCE_WORKERS,
+PREDICT_ASYNC_QUEUE_DEPTH, PREDICT_ASYNC_QUEUE_TIMEOUT_S,
+PREDICT_ASYNC_MAX_BODY_BYTES, PREDICT_ASYNC_KEEPALIVE_S, PREDICT_ASYNC_DRAIN_S,
+plus the usual PREDICT_* settings.
+"""
+import asyncio
+import io
+import math
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from urllib.parse import unquote_to_bytes
+
+import uvicorn
+
+# load the models from main(), not as a side effect of the import below
+os.environ.setdefault("PREDICT_APP_FACTORY", "1")
+
+from werkzeug.wrappers import Request  # noqa: E402
+
+import server  # noqa: E402
+from deadlines import DeadlineExceeded  # noqa: E402
+from imaging import ImageTooLarge  # noqa: E402
+from metrics import Gauge, StageTimer  # noqa: E402
+
+GATE_WORKERS = int(os.environ.get("PREDICT_ASYNC_GATE_WORKERS", str(server.GATE_WORKERS)))
+INFERENCE_WORKERS = int(os.environ.get("PREDICT_ASYNC_INFERENCE_WORKERS", "4"))
+QUEUE_DEPTH = int(os.environ.get("PREDICT_ASYNC_QUEUE_DEPTH", "32"))
+QUEUE_TIMEOUT_S = float(os.environ.get("PREDICT_ASYNC_QUEUE_TIMEOUT_S", "10"))
+MAX_BODY_BYTES = int(os.environ.get("PREDICT_ASYNC_MAX_BODY_BYTES", str(64 * 1024 * 1024)))
+MAX_HEADER_BYTES = 64 * 1024
+KEEPALIVE_S = float(os.environ.get("PREDICT_ASYNC_KEEPALIVE_S", "75"))
+DRAIN_S = float(os.environ.get("PREDICT_ASYNC_DRAIN_S", "30"))
+NOT_READY_RETRY_S = 5
+
+HEAVY_ROUTES = {"/api/predict", "/api/predict/batch", "/api/predict/tensor", "/api/symptoms"}
+
+gate_executor = ThreadPoolExecutor(max_workers=max(1, GATE_WORKERS), thread_name_prefix="async-gate")
+inference_executor = ThreadPoolExecutor(max_workers=max(1, INFERENCE_WORKERS), thread_name_prefix="async-infer")
+control_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="async-control")
+
+
+# -----------------------------
+# Admission control
+# -----------------------------
+class Shed(Exception):
+    """Refuse a request without (further) work: status 429 or 503, with Retry-After."""
+
+    def __init__(self, status, reason, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Admission:
+    """
+    Counts heavy requests in the system (running or queued for a worker).
+    Only touched from the event loop, so no locking.
+    """
+
+    def __init__(self, capacity, queue_depth, queue_timeout_s):
+        self.capacity = max(1, capacity)
+        self.queue_depth = max(0, queue_depth)
+        self.queue_timeout_s = queue_timeout_s
+        self.in_system = 0
+        self.peak = 0
+        self.admitted = 0
+        self.service_s = None  # EWMA of the time admitted requests spend in the system
+        self.draining = False
+
+    @property
+    def limit(self):
+        return self.capacity + self.queue_depth
+
+    def retry_after(self):
+        # time for the current backlog to drain through the workers, in whole seconds
+        per_request = self.service_s if self.service_s is not None else 1.0
+        return max(1, math.ceil(self.in_system * per_request / self.capacity))
+
+    def admit(self):
+        """Raise Shed unless the request may enter."""
+        if self.draining:
+            raise Shed(503, "draining", "Server is shutting down; retry later", self.retry_after())
+        if not all(c.ready for c in server.active_models().components) and server.STARTUP_MODE == "background":
+            raise Shed(503, "not_ready", "Models are still loading; retry later", NOT_READY_RETRY_S)
+        if self.in_system >= self.limit:
+            raise Shed(429, "queue_full", "Server is busy; retry later", self.retry_after())
+        self.in_system += 1
+        self.admitted += 1
+        self.peak = max(self.peak, self.in_system)
+
+    def release(self, seconds):
+        self.in_system -= 1
+        self.service_s = seconds if self.service_s is None else 0.8 * self.service_s + 0.2 * seconds
+
+    def check_wait(self, admitted_at):
+        """Called by a worker as it picks a request up: shed it if it queued for too long."""
+        waited = time.perf_counter() - admitted_at
+        if self.queue_timeout_s and waited > self.queue_timeout_s:
+            raise Shed(503, "queue_timeout", f"Request waited {waited:.1f}s for a worker; retry later",
+                       self.retry_after())
+        return waited
+
+    def stats(self):
+        return {
+            "in_system": self.in_system,
+            "capacity": self.capacity,
+            "queue_depth": self.queue_depth,
+            "limit": self.limit,
+            "peak": self.peak,
+            "admitted": self.admitted,
+            "service_s": self.service_s,
+            "retry_after_s": self.retry_after(),
+            "draining": self.draining,
+            "gate_workers": GATE_WORKERS,
+            "inference_workers": INFERENCE_WORKERS,
+            "queue_timeout_s": self.queue_timeout_s,
+        }
+
+
+admission = Admission(GATE_WORKERS + INFERENCE_WORKERS, QUEUE_DEPTH, QUEUE_TIMEOUT_S)
+shed_total = server.metrics.counter("predict_shed_total", "Requests refused by admission control",
+                                    ("endpoint", "reason"))
+
+
+def _admission_gauges():
+    g = Gauge("predict_async_admission", "Async server admission control", ("field",))
+    for k, v in admission.stats().items():
+        if isinstance(v, (int, float)):
+            g.set(int(v) if isinstance(v, bool) else v, field=k)
+    return [g]
+
+
+server.metrics.add_collector(_admission_gauges)
+
+
+# -----------------------------
+# ASGI requests and responses
+# -----------------------------
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ClientDisconnected(ConnectionError):
+    """The client went away before its request body was complete."""
+
+
+class HTTPRequest:
+    """An http scope plus, once read_body() ran, its body; headers are lower-case name -> value."""
+
+    def __init__(self, scope):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.raw_path = scope.get("raw_path") or scope["path"].encode("utf-8")
+        self.query = scope.get("query_string", b"").decode("latin-1")
+        self.version = "HTTP/" + scope.get("http_version", "1.1")
+        self.headers = {}
+        for name, value in scope["headers"]:
+            name, value = name.decode("latin-1").lower(), value.decode("latin-1")
+            self.headers[name] = f"{self.headers[name]}, {value}" if name in self.headers else value
+        client = scope.get("client")
+        self.peer = client[0] if client else ""
+        self.body = b""
+
+    @property
+    def expects_continue(self):
+        return self.headers.get("expect", "").lower() == "100-continue"
+
+
+def check_framing(req):
+    """
+    Refuse Content-Length together with Transfer-Encoding. h11 frames such a
+    request by Transfer-Encoding and serves it (RFC 9112 6.3); a proxy in front
+    that went by Content-Length would see a different request boundary.
+    """
+    if "transfer-encoding" in req.headers and "content-length" in req.headers:
+        raise HTTPError(400, "Content-Length together with Transfer-Encoding")
+
+
+async def read_body(receive, discard=False):
+    """Read (or with discard=True, skip) the request body, at most MAX_BODY_BYTES."""
+    out, total = bytearray(), 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected("Client disconnected")
+        chunk = message.get("body", b"")
+        total += len(chunk)
+        if total > MAX_BODY_BYTES:
+            raise HTTPError(413, f"Request body over {MAX_BODY_BYTES} bytes")
+        if not discard:
+            out += chunk
+        if not message.get("more_body", False):
+            return b"" if discard else bytes(out)
+
+
+async def send_response(send, status, body, content_type="application/json", headers=()):
+    raw = [(b"content-type", content_type.encode("latin-1")), (b"content-length", str(len(body)).encode())]
+    raw.extend((k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers)
+    await send({"type": "http.response.start", "status": status, "headers": raw})
+    await send({"type": "http.response.body", "body": body})
+
+
+def json_body(payload):
+    # byte-for-byte what Flask's jsonify() produces for the same payload
+    return (server.app.json.dumps(payload, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def wsgi_environ(req):
+    environ = {
+        "REQUEST_METHOD": req.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote_to_bytes(req.raw_path).decode("latin-1"),
+        "QUERY_STRING": req.query,
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": os.environ.get("PORT", "5000"),
+        "SERVER_PROTOCOL": req.version,
+        "REMOTE_ADDR": req.peer,
+        "CONTENT_LENGTH": str(len(req.body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(req.body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in req.headers.items():
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name not in ("content-length", "transfer-encoding"):
+            environ["HTTP_" + name.upper().replace("-", "_")] = value
+    return environ
+
+
+def call_flask(req):
+    """Run the Flask route for req (in a worker thread) -> (status, headers, body)."""
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured["status"] = int(status.split(" ", 1)[0])
+        captured["headers"] = headers
+
+    result = server.app(wsgi_environ(req), start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return captured["status"], captured["headers"], body
+
+
+# -----------------------------
+# /api/predict: gate and inference on their own executors
+# -----------------------------
+def _profiled(profile):
+    return profile.attach() if profile is not None else nullcontext()
+
+
+def _predict_gate_job(req, timer, admitted_at, deadline, profile):
+    with _profiled(profile):
+        return _predict_gate(req, timer, admitted_at, deadline)
+
+
+def _predict_gate(req, timer, admitted_at, deadline):
+    timer.record("queue_wait", admission.check_wait(admitted_at))
+    deadline.check("upload_read")
+    form = Request(wsgi_environ(req))
+    if "file" not in form.files:
+        return 400, {"ok": False, "error": "No file uploaded"}, None, "unknown", ""
+    image_type = server.normalize_image_type(form.form.get("image_type", "fundus"))
+    server.requests_total.inc(endpoint="predict", image_type=server.image_type_label(image_type))
+    symptoms = (form.form.get("symptoms", "") or "").strip()
+    with timer.stage("upload_read"):
+        file_bytes = form.files["file"].read()
+    if not file_bytes:
+        return 400, {"ok": False, "error": "Empty upload"}, None, image_type, symptoms
+    payload, state = server.predict_gate_stage(file_bytes, image_type, symptoms, timer, deadline)
+    return 200, payload, state, image_type, symptoms
+
+
+def _predict_inference_job(state, symptoms, timer, admitted_at, deadline, priority, profile):
+    with _profiled(profile):
+        return _predict_inference(state, symptoms, timer, admitted_at, deadline, priority)
+
+
+def _predict_inference(state, symptoms, timer, admitted_at, deadline, priority):
+    try:
+        t0 = time.perf_counter()
+        admission.check_wait(admitted_at)
+    except Shed:
+        server.discard_inference_stage(state)
+        raise
+    timer.record("inference_queue_wait", time.perf_counter() - t0)
+    return server.predict_inference_stage(state, symptoms, timer, deadline, priority)
+
+
+async def handle_predict(req, admitted_at):
+    loop = asyncio.get_running_loop()
+    profile = None
+    if server.profiler is not None:
+        profile = server.profiler.start("predict", req.headers,
+                                        allow_header=server.debug_profile_allowed(req.headers))
+    try:
+        return await _handle_predict(loop, req, admitted_at, profile)
+    finally:
+        if profile is not None:
+            # stops the sampler and writes the report off the event loop
+            await loop.run_in_executor(control_executor, server.finish_profile, profile)
+
+
+async def _handle_predict(loop, req, admitted_at, profile):
+    timer = StageTimer(server.stage_seconds)
+    image_type = "unknown"
+    deadline, priority = server.request_deadline(req.headers)
+    try:
+        status, payload, state, image_type, symptoms = await loop.run_in_executor(
+            gate_executor, _predict_gate_job, req, timer, admitted_at, deadline, profile)
+        if payload is None:
+            payload = await loop.run_in_executor(
+                inference_executor, _predict_inference_job, state, symptoms, timer, admitted_at, deadline, priority,
+                profile)
+    except Shed:
+        raise
+    except ImageTooLarge as e:
+        status, payload = 413, {"ok": False, "error": str(e)}
+    except DeadlineExceeded as e:
+        server.deadline_expired_total.inc(endpoint="predict", stage=e.stage)
+        status, payload = 504, {"ok": False, "error": str(e)}
+    except Exception as e:
+        server.errors_total.inc(endpoint="predict", image_type=server.image_type_label(image_type))
+        tb = traceback.format_exc()
+        print(tb, file=sys.stderr)
+        sys.stderr.flush()
+        status, payload = 500, {"ok": False, "error": str(e)}
+    server.request_seconds.observe(timer.total(), endpoint="predict")
+    headers = [("X-Model-Version", payload.get("model_version") or server.active_models().name)]
+    if profile is not None:
+        profile.timer, profile.status = timer, status
+        headers.append(("X-Profile-Id", profile.id))
+    if server.SERVER_TIMING_ENABLED or req.headers.get("x-server-timing", "").lower() in ("1", "true", "yes"):
+        headers.append(("Server-Timing", timer.server_timing()))
+    return status, headers, json_body(payload)
+
+
+def _flask_heavy_job(req, admitted_at):
+    admission.check_wait(admitted_at)
+    return call_flask(req)
+
+
+# -----------------------------
+# Routes and admission middleware
+# -----------------------------
+def _endpoint(path):
+    return {"/api/predict": "predict", "/api/predict/batch": "predict_batch",
+            "/api/predict/tensor": "predict_tensor"}.get(path, path.rsplit("/", 1)[-1])
+
+
+def _flask_response(status, headers, body):
+    content_type = dict(headers).get("Content-Type", "application/json")
+    return status, [(k, v) for k, v in headers if k not in ("Content-Type", "Content-Length")], body, content_type
+
+
+async def routes(scope, receive, send):
+    """Every route; heavy ones arrive here admitted, with scope["admitted_at"] set by admission_middleware."""
+    loop = asyncio.get_running_loop()
+    req = HTTPRequest(scope)
+    req.body = await read_body(receive)
+    admitted_at = scope.get("admitted_at")
+    if admitted_at is not None and req.path == "/api/predict":
+        status, headers, body = await handle_predict(req, admitted_at)
+        content_type = "application/json"
+    elif admitted_at is not None:
+        status, headers, body, content_type = _flask_response(
+            *await loop.run_in_executor(inference_executor, _flask_heavy_job, req, admitted_at))
+    elif req.path == "/api/admission":
+        status, headers, body, content_type = 200, [], json_body(admission.stats()), "application/json"
+    else:
+        status, headers, body, content_type = _flask_response(
+            *await loop.run_in_executor(control_executor, call_flask, req))
+    await send_response(send, status, body, content_type, headers)
+
+
+def admission_middleware(inner):
+    """ASGI middleware: admit heavy POSTs (or shed them with 429 / 503 + Retry-After) around inner."""
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        heavy = scope["method"] == "POST" and scope["path"] in HEAVY_ROUTES
+        try:
+            check_framing(HTTPRequest(scope))
+            if not heavy:
+                await inner(scope, receive, send)
+                return
+            try:
+                admission.admit()
+            except Shed as e:
+                shed_total.inc(endpoint=_endpoint(scope["path"]), reason=e.reason)
+                # without 100-continue the client is already sending: skip its body to keep the
+                # connection usable (with it, uvicorn never asks for the body)
+                if not HTTPRequest(scope).expects_continue:
+                    await read_body(receive, discard=True)
+                await send_response(send, e.status, json_body({"ok": False, "error": str(e)}),
+                                    headers=[("Retry-After", e.retry_after)])
+                return
+            admitted_at = time.perf_counter()
+            try:
+                await inner({**scope, "admitted_at": admitted_at}, receive, send)
+            except Shed as e:
+                shed_total.inc(endpoint=_endpoint(scope["path"]), reason=e.reason)
+                await send_response(send, e.status, json_body({"ok": False, "error": str(e)}),
+                                    headers=[("Retry-After", e.retry_after)])
+            finally:
+                admission.release(time.perf_counter() - admitted_at)
+        except HTTPError as e:
+            await send_response(send, e.status, json_body({"ok": False, "error": str(e)}),
+                                headers=[("Connection", "close")])
+        except ClientDisconnected:
+            pass
+
+    return app
+
+
+app = admission_middleware(routes)
+
+
+# -----------------------------
+# Serving
+# -----------------------------
+class Server(uvicorn.Server):
+    def handle_exit(self, sig, frame):
+        # refuse new heavy work with 503 while uvicorn stops accepting and lets admitted requests finish
+        admission.draining = True
+        super().handle_exit(sig, frame)
+
+
+def serve(host="0.0.0.0", port=5000):
+    config = uvicorn.Config(app, host=host, port=port, http="h11", lifespan="off", backlog=1024,
+                            timeout_keep_alive=KEEPALIVE_S, timeout_graceful_shutdown=DRAIN_S,
+                            h11_max_incomplete_event_size=MAX_HEADER_BYTES, access_log=False,
+                            log_level="warning")
+    print(f"Async predict service on {host}:{port}: {admission.stats()}", file=sys.stderr)
+    sys.stderr.flush()
+    Server(config).run()
+    for pool in (gate_executor, inference_executor, control_executor):
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    server.start_components()
+    serve(port=int(os.environ.get("PORT", "5000")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Shared-backbone serving for the fundus and outer-eye models.
+
+Both models are input -> preprocessing -> backbone (a nested MobileNetV2
+functional model) -> a small head (pooling / dropout / dense). When the
+preprocessing and backbone weights are identical in both files (the usual case
+when the backbone was frozen during fine-tuning), they can be served as one
+feature extractor plus two heads: one copy of the backbone in memory, and mixed
+fundus/outer batches share a single backbone pass. share() verifies the split
+against the original models before it is used; if the backbones differ it
+reports where instead.
+
+    python backbone.py [models_dir]   -> JSON report, exit 1 if the models cannot share
+"""
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+from inference import KerasBackend, make_backend, parity_batch, parity_check
+
+
+def backbone_index(model):
+    """
+    Index in model.layers of the nested model holding most of the weights.
+    Raises ValueError unless the graph is a single chain of layers around it.
+    """
+    layers = model.layers
+    nested = [i for i, layer in enumerate(layers) if isinstance(layer, tf.keras.Model)]
+    if not nested:
+        raise ValueError("no nested backbone model")
+    config = {layer["name"]: layer for layer in model.get_config()["layers"]}
+    for prev, layer in zip(layers, layers[1:]):
+        inbound = json.dumps(config.get(layer.name, {}).get("inbound_nodes", []))
+        if inbound.count('"keras_history"') != 1 or f'"{prev.name}"' not in inbound:
+            raise ValueError(f"layer '{layer.name}' is not fed by '{prev.name}' alone (not a linear model)")
+    return max(nested, key=lambda i: layers[i].count_params())
+
+
+def _layer_key(layer):
+    if isinstance(layer, tf.keras.Model):
+        return {"class": "Model", "layers": [type(l).__name__ for l in layer.layers]}
+    config = {k: v for k, v in layer.get_config().items() if k not in ("name", "trainable")}
+    return {"class": type(layer).__name__, "config": json.dumps(config, sort_keys=True, default=str)}
+
+
+def fingerprint(model, idx):
+    """sha256 of the preprocessing layers' configs and the backbone's weights (layer names ignored)."""
+    h = hashlib.sha256()
+    for layer in model.layers[1:idx + 1]:
+        h.update(json.dumps(_layer_key(layer), sort_keys=True).encode())
+        for w in layer.get_weights():
+            h.update(f"{w.dtype}{w.shape}".encode())
+            h.update(np.ascontiguousarray(w).tobytes())
+    return h.hexdigest()
+
+
+def first_difference(a, idx_a, b, idx_b):
+    """Human-readable description of where two feature extractors differ."""
+    prefix_a, prefix_b = a.layers[1:idx_a + 1], b.layers[1:idx_b + 1]
+    if len(prefix_a) != len(prefix_b):
+        return f"{len(prefix_a)} vs {len(prefix_b)} layers up to the backbone"
+    for la, lb in zip(prefix_a, prefix_b):
+        if _layer_key(la) != _layer_key(lb):
+            return f"layer '{la.name}' vs '{lb.name}' differs in type or configuration"
+        wa, wb = la.get_weights(), lb.get_weights()
+        if [w.shape for w in wa] != [w.shape for w in wb]:
+            return f"layer '{la.name}' has different weight shapes"
+        differing = sum(not np.array_equal(x, y) for x, y in zip(wa, wb))
+        if differing:
+            max_diff = max(float(np.abs(x - y).max()) for x, y in zip(wa, wb))
+            return (f"layer '{la.name}': {differing} of {len(wa)} weight tensors differ "
+                    f"(max abs diff {max_diff:.3g}); the backbone was not frozen")
+    return None
+
+
+def _chain(layers, x):
+    for layer in layers:
+        x = layer(x)
+    return x
+
+
+def features_model(model, idx):
+    """Input -> backbone output, reusing model's layers (no weights are copied)."""
+    inp = tf.keras.Input(model.inputs[0].shape[1:])
+    return tf.keras.Model(inp, _chain(model.layers[1:idx + 1], inp))
+
+
+def head_model(model, idx):
+    """
+    Backbone output -> predictions, from copies of the head layers: reusing them
+    would keep the original graph, and with it the model's own backbone, alive.
+    """
+    x = inp = tf.keras.Input(model.layers[idx].outputs[0].shape[1:])
+    for layer in model.layers[idx + 1:]:
+        copy = type(layer).from_config(layer.get_config())
+        x = copy(x)
+        copy.set_weights(layer.get_weights())
+    return tf.keras.Model(inp, x)
+
+
+def _head_fn(head):
+    spec = tf.TensorSpec([None] + list(head.inputs[0].shape[1:]), tf.float32)
+    fn = tf.function(lambda x: head(x, training=False), input_signature=[spec], reduce_retracing=True)
+    return lambda feats: fn(tf.convert_to_tensor(feats, dtype=tf.float32)).numpy()
+
+
+class SharedBackbone:
+    """One feature extractor (any inference.py backend) and a head per model type."""
+
+    name = "shared_backbone"
+
+    def __init__(self, features_backend, heads):
+        self.features_backend = features_backend
+        self.heads = heads  # model type -> fn((N, F) features) -> (N, K)
+
+    def features(self, batch):
+        return np.asarray(self.features_backend.predict(batch))
+
+    def heads_for(self, model_types, feats):
+        """Row i of feats through the head of model_types[i] -> list of prediction rows."""
+        out = [None] * len(model_types)
+        for model_type in set(model_types):
+            rows = [i for i, t in enumerate(model_types) if t == model_type]
+            preds = np.asarray(self.heads[model_type](feats[rows]))
+            for j, i in enumerate(rows):
+                out[i] = preds[j]
+        return out
+
+    def predict(self, model_type, batch):
+        return np.asarray(self.heads[model_type](self.features(batch)))
+
+    def backend(self, model_type):
+        return _HeadBackend(self, model_type)
+
+
+class _HeadBackend:
+    """Looks like an inference.py backend for one model type."""
+
+    name = SharedBackbone.name
+
+    def __init__(self, shared, model_type):
+        self.shared = shared
+        self.model_type = model_type
+
+    def predict(self, batch):
+        return self.shared.predict(self.model_type, batch)
+
+
+def share(models, backend_kind="keras", num_threads=None, parity=True, atol=1e-3):
+    """
+    models: {model type: Keras model} -> (SharedBackbone or None, report).
+    None (with report["reason"]) when a model cannot be split, the backbones
+    differ, or the split models do not match the originals.
+    """
+    report = {"shared": False, "models": {}}
+    indices = {}
+    for name, model in models.items():
+        try:
+            idx = indices[name] = backbone_index(model)
+        except ValueError as e:
+            report["reason"] = f"{name}: {e}"
+            return None, report
+        report["models"][name] = {"backbone": model.layers[idx].name, "fingerprint": fingerprint(model, idx),
+                                  "params": int(model.count_params()),
+                                  "backbone_params": int(model.layers[idx].count_params()),
+                                  "backbone_trainable": bool(model.layers[idx].trainable)}
+    names = list(models)
+    first = names[0]
+    for name in names[1:]:
+        if report["models"][name]["fingerprint"] != report["models"][first]["fingerprint"]:
+            report["reason"] = (f"backbones differ ({first} vs {name}): "
+                                + (first_difference(models[first], indices[first], models[name], indices[name])
+                                   or "fingerprints differ"))
+            return None, report
+    features = features_model(models[first], indices[first])
+    heads = {name: head_model(models[name], indices[name]) for name in names}
+    shared = SharedBackbone(make_backend(backend_kind, features, num_threads=num_threads),
+                            {name: _head_fn(head) for name, head in heads.items()})
+    report["params"] = {
+        "separate": int(sum(m.count_params() for m in models.values())),
+        "shared": int(features.count_params() + sum(h.count_params() for h in heads.values())),
+    }
+    report["features_backend"] = shared.features_backend.name
+    if parity:
+        batch = parity_batch()
+        report["parity"] = {name: parity_check(KerasBackend(model), shared.backend(name), batch, atol=atol)
+                            for name, model in models.items()}
+        if not all(p["ok"] for p in report["parity"].values()):
+            report["reason"] = "parity check against the original models failed"
+            return None, report
+    report["shared"] = True
+    return shared, report
+
+
+if __name__ == "__main__":
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+    loaded = {t: tf.keras.models.load_model(os.path.join(model_dir, f"{t}_mnv2.keras"), compile=False)
+              for t in ("fundus", "outer")}
+    _, result = share(loaded)
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result["shared"] else 1)
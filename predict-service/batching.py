@@ -0,0 +1,170 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from deadlines import DeadlineExceeded
+
+# Queue wait buckets (milliseconds) used for the wait-time histogram
+WAIT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+
+class MicroBatcher:
+    """
+    Collect concurrent single-image requests for one model and run them as one
+    forward pass. A batch is dispatched when it reaches max_batch_size or when
+    the oldest queued item has waited max_wait_ms, whichever comes first.
+
+    Each item has a priority (0 = most urgent); a batch takes the most urgent
+    items first, in arrival order within a priority. Items queued ahead of them
+    and left behind are counted as preempted. Items whose deadline (a
+    time.perf_counter() value) has passed are dropped with DeadlineExceeded
+    instead of being run.
+
+    The dispatch thread starts with the first submit(), so building a batcher
+    (and the model set that owns it) starts no thread.
+    """
+
+    def __init__(self, name, predict_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.name = name
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._cond = threading.Condition()
+        self._pending = []  # [[priority, seq, x, future, enqueued_at, expires_at, preempted]]
+        self._seq = 0
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._wait_counts = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self._wait_sum_ms = 0.0
+        self._items = 0
+        self._batches = 0
+        self._errors = 0
+        self._expired = 0
+        self._preempted = 0
+        self._thread = threading.Thread(target=self._loop, name=f"batcher-{name}", daemon=True)
+        self._started = False
+
+    def submit(self, x, priority=0, expires_at=None):
+        """Queue one input of shape (1, H, W, C) or (H, W, C). Returns a Future of its output row."""
+        x = np.asarray(x)
+        if x.ndim == 3:
+            x = x[None, ...]
+        fut = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Batcher '{self.name}' is closed")
+            if not self._started:
+                self._thread.start()
+                self._started = True
+            self._seq += 1
+            self._pending.append([priority, self._seq, x, fut, time.perf_counter(), expires_at, False])
+            self._cond.notify()
+        return fut
+
+    @property
+    def thread_ident(self):
+        return self._thread.ident  # None until the first submit()
+
+    def predict(self, x, timeout=None, priority=0, expires_at=None):
+        return self.submit(x, priority, expires_at).result(timeout=timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            started = self._started
+        if started:
+            self._thread.join(timeout=5)
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            dispatch_at = min(item[4] for item in self._pending) + self.max_wait
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                remaining = dispatch_at - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            now = time.perf_counter()
+            expired = [item for item in self._pending if item[5] is not None and now > item[5]]
+            if expired:
+                self._pending = [item for item in self._pending if item[5] is None or now <= item[5]]
+            self._pending.sort(key=lambda item: (item[0], item[1]))
+            items = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            preempted = 0
+            if items and self._pending:
+                last_taken = max(item[1] for item in items)
+                for item in self._pending:
+                    if item[1] < last_taken and not item[6]:
+                        item[6] = True
+                        preempted += 1
+        with self._stats_lock:
+            self._expired += len(expired)
+            self._preempted += preempted
+        for item in expired:
+            item[3].set_exception(DeadlineExceeded("inference_queue", now - item[5]))
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._take_batch()
+            if items is None:
+                return
+            if not items:  # everything queued had expired
+                continue
+            started = time.perf_counter()
+            self._record(len(items), [(started - item[4]) * 1000.0 for item in items])
+            try:
+                batch = items[0][2] if len(items) == 1 else np.concatenate([item[2] for item in items], axis=0)
+                out = np.asarray(self.predict_fn(batch))
+                for i, item in enumerate(items):
+                    item[3].set_result(out[i])
+            except Exception as e:
+                with self._stats_lock:
+                    self._errors += 1
+                for item in items:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+
+    def _record(self, size, waits_ms):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            for w in waits_ms:
+                self._wait_sum_ms += w
+                for i, b in enumerate(WAIT_BUCKETS_MS):
+                    if w <= b:
+                        self._wait_counts[i] += 1
+                        break
+                else:
+                    self._wait_counts[-1] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            labels = [str(b) for b in WAIT_BUCKETS_MS] + ["+Inf"]
+            return {
+                "name": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "expired": self._expired,
+                "preempted": self._preempted,
+                "mean_batch_size": (self._items / self._batches) if self._batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "queue_wait_ms": {
+                    "count": self._items,
+                    "mean": (self._wait_sum_ms / self._items) if self._items else 0.0,
+                    "histogram": dict(zip(labels, self._wait_counts)),
+                },
+                "queued": len(self._pending),
+            }
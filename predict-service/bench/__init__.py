@@ -0,0 +1,12 @@
+"""
+Benchmarks for predict-service. Run from the predict-service directory:
+
+    python -m bench.synthetic OUT_DIR            # write the synthetic image set
+    python -m bench.micro [--out micro.json]     # per-function timings
+    python -m bench.load [--out load.json]       # p50/p95/p99 + req/s at several concurrency levels
+    python -m bench.compare OLD.json NEW.json    # flag regressions between two runs
+    python -m bench.gate_eval CORPUS_DIR         # eye-gate latency / confusion matrix / Pareto table per configuration
+
+Every run writes JSON with the same layout (environment + results) so two runs
+can be diffed.
+"""
@@ -0,0 +1,142 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+
+
+def summarize(samples_s):
+    """Latency samples in seconds -> summary in milliseconds."""
+    a = np.asarray(samples_s, dtype=np.float64) * 1000.0
+    if a.size == 0:
+        return {"n": 0}
+    p50, p95, p99 = np.percentile(a, [50, 95, 99])
+    return {
+        "n": int(a.size),
+        "mean_ms": round(float(a.mean()), 4),
+        "min_ms": round(float(a.min()), 4),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "max_ms": round(float(a.max()), 4),
+    }
+
+
+def _proc_status_kb(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_bytes():
+    """Current resident set size (Linux), or None."""
+    return _proc_status_kb("VmRSS")
+
+
+def peak_rss_bytes():
+    """Peak resident set size since start or the last reset_peak_rss() (Linux), or None."""
+    return _proc_status_kb("VmHWM")
+
+
+_malloc_pinned = False
+
+
+def pin_malloc_thresholds():
+    """
+    glibc raises its mmap/trim thresholds after large frees, so later big buffers
+    come from heap that is already resident and never show up as RSS growth.
+    Pin them (this process only) before measuring; call as early as possible.
+    """
+    global _malloc_pinned
+    if _malloc_pinned:
+        return
+    _malloc_pinned = True
+    try:
+        import ctypes
+
+        libc = ctypes.CDLL("libc.so.6")
+        M_TRIM_THRESHOLD, M_MMAP_THRESHOLD = -1, -3
+        libc.mallopt(M_MMAP_THRESHOLD, 128 * 1024)
+        libc.mallopt(M_TRIM_THRESHOLD, 256 * 1024)
+    except Exception:
+        pass
+
+
+def reset_peak_rss():
+    """Reset the kernel's RSS high-water mark so the next peak_rss_bytes() covers only what follows."""
+    pin_malloc_thresholds()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure_peak_rss(fn, *args):
+    """Peak RSS growth in bytes while fn(*args) runs, or None where the kernel can't tell us."""
+    if not reset_peak_rss():
+        return None
+    before = rss_bytes()
+    fn(*args)
+    peak = peak_rss_bytes()
+    return None if peak is None or before is None else max(0, peak - before)
+
+
+def summarize_bytes(samples):
+    a = np.asarray([s for s in samples if s is not None], dtype=np.float64) / (1024.0 * 1024.0)
+    if a.size == 0:
+        return {"n": 0}
+    return {"n": int(a.size), "median_mb": round(float(np.median(a)), 3), "max_mb": round(float(a.max()), 3)}
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR,
+                             capture_output=True, text=True, timeout=5)
+        rev = out.stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "."], cwd=SERVICE_DIR,
+                               capture_output=True, text=True, timeout=5).stdout.strip()
+        return rev + ("-dirty" if dirty else "") if rev else None
+    except Exception:
+        return None
+
+
+def environment():
+    env = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "predict_env": {k: v for k, v in sorted(os.environ.items()) if k.startswith("PREDICT_")},
+    }
+    for mod in ("tensorflow", "cv2", "PIL", "sklearn"):
+        m = sys.modules.get(mod)
+        if m is not None:
+            env[mod] = getattr(m, "__version__", None)
+    return env
+
+
+def write_results(kind, results, out_path=None, **extra):
+    doc = {"kind": kind, "environment": environment(), **extra, "results": results}
+    text = json.dumps(doc, indent=2, sort_keys=False)
+    if out_path:
+        with open(out_path, "w") as f:
+            f.write(text + "\n")
+        print(f"Results written to {out_path}", file=sys.stderr)
+    else:
+        print(text)
+    return doc
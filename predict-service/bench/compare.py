@@ -0,0 +1,68 @@
+"""
+Diff two benchmark result files and flag regressions.
+
+    python -m bench.compare OLD.json NEW.json [--threshold 0.10] [--metric p50_ms p95_ms rps]
+
+Exits with status 1 if any compared metric got worse by more than the threshold
+(latencies going up, rps going down).
+"""
+import argparse
+import json
+import sys
+
+HIGHER_IS_BETTER = {"rps"}
+
+
+def flatten(results, prefix=()):
+    """Nested results -> {path tuple: number}; lists of levels are keyed by concurrency."""
+    out = {}
+    if isinstance(results, dict):
+        for k, v in results.items():
+            out.update(flatten(v, prefix + (str(k),)))
+    elif isinstance(results, list):
+        for i, v in enumerate(results):
+            key = f"c{v['concurrency']}" if isinstance(v, dict) and "concurrency" in v else str(i)
+            out.update(flatten(v, prefix + (key,)))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        out[prefix] = float(results)
+    return out
+
+
+def compare(old, new, metrics, threshold):
+    a, b = flatten(old["results"]), flatten(new["results"])
+    rows = []
+    for path in sorted(set(a) & set(b)):
+        if path[-1] not in metrics:
+            continue
+        before, after = a[path], b[path]
+        change = (after - before) / before if before else 0.0
+        worse = -change if path[-1] in HIGHER_IS_BETTER else change
+        rows.append({"metric": "/".join(path), "old": before, "new": after,
+                     "change": change, "regression": worse > threshold})
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("old")
+    ap.add_argument("new")
+    ap.add_argument("--threshold", type=float, default=0.10, help="relative change treated as a regression")
+    ap.add_argument("--metric", nargs="+", default=["p50_ms", "p95_ms", "p99_ms", "rps", "max_mb"])
+    args = ap.parse_args(argv)
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if old.get("kind") != new.get("kind"):
+        print(f"warning: comparing {old.get('kind')} results with {new.get('kind')} results", file=sys.stderr)
+    rows = compare(old, new, set(args.metric), args.threshold)
+    for r in rows:
+        flag = "REGRESSION" if r["regression"] else ""
+        print(f"{r['metric']:<60} {r['old']:12.3f} -> {r['new']:12.3f}  {r['change']:+7.1%}  {flag}")
+    regressions = sum(r["regression"] for r in rows)
+    print(f"{len(rows)} metrics compared, {regressions} regression(s) over {args.threshold:.0%}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
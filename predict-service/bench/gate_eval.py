@@ -0,0 +1,260 @@
+"""
+Eye-gate cost/accuracy evaluation over a labelled image corpus.
+
+    python -m bench.gate_eval CORPUS_DIR [--variant relaxed strict] [--grid eye_scale_factor=1.1,1.2,1.3 ...]
+                              [--labels labels.csv] [--repeat 3] [--out gate_eval.json]
+    python -m bench.gate_eval --synthetic [--count 8] ...
+
+Labels: an image's label is its top-level folder under CORPUS_DIR (fundus/,
+outer/, non_eye/, ...) or the "label" column of --labels (CSV with path,label;
+paths relative to CORPUS_DIR). Labels in --accept should pass the gate, labels
+in --reject should not; anything else is skipped. --synthetic uses the
+bench.synthetic set instead (fundus, eye_closeup: accept; non_eye: reject).
+
+Every configuration is one eye_gate.EyeGate: each --variant crossed with every
+combination of the --grid values (any EyeGate keyword: fundus_dp,
+fundus_param2, eye_scale_factor, eye_min_size, face_scale_factor,
+face_min_size, min_total_eye_area_ratio, min_skin_ratio, require_pupil,
+pupil_param2, ...). Images are decoded once, exactly as the server does
+(imaging.DecodedImage, gate_bgr; --draft as with PREDICT_DECODE_DRAFT=1), and
+each gate call is timed --repeat times (median kept). Per configuration the
+results hold the confusion matrix (accept/reject vs label), false
+accept/reject rates per label, the gate latency summary, the mean cost of each
+sub-check, which sub-check decided the images (split by outcome) and one
+record per image. Configurations that no other one beats on all of mean
+latency, false accept rate and false reject rate form the Pareto table
+printed at the end.
+"""
+import argparse
+import csv
+import inspect
+import itertools
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+
+import cv2
+import numpy as np
+
+from bench.common import summarize, write_results
+from bench.synthetic import DEFAULT_COUNT, image_set
+from eye_gate import EyeGate
+from imaging import DecodedImage
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+ACCEPT_LABELS = ("fundus", "outer", "eye", "eye_closeup", "accept")
+REJECT_LABELS = ("non_eye", "not_eye", "other", "reject")
+SYNTHETIC_KINDS = ("fundus", "eye_closeup", "non_eye")
+GATE_PARAMS = {name: p.default for name, p in inspect.signature(EyeGate).parameters.items() if name != "strict"}
+
+
+# -----------------------------
+# Corpus: [(name, label, gate_bgr)]
+# -----------------------------
+def _decode(data, draft=False):
+    decoded = DecodedImage.from_bytes(data, draft=draft)
+    return decoded.gate_bgr() if decoded is not None else None
+
+
+def load_corpus(root, labels_csv=None, limit=None, draft=False):
+    if labels_csv:
+        with open(labels_csv, newline="") as f:
+            entries = [(row["path"], row["label"].strip()) for row in csv.DictReader(f)]
+    else:
+        entries = []
+        for dirpath, dirnames, files in os.walk(root):
+            dirnames.sort()
+            for name in sorted(files):
+                rel = os.path.relpath(os.path.join(dirpath, name), root)
+                if name.lower().endswith(IMAGE_EXTS) and os.sep in rel:
+                    entries.append((rel, rel.split(os.sep, 1)[0]))
+    corpus = []
+    for rel, label in entries[:limit]:
+        with open(os.path.join(root, rel), "rb") as f:
+            img = _decode(f.read(), draft)
+        if img is None:
+            print(f"[gate_eval] skipping {rel}: not decodable", file=sys.stderr)
+            continue
+        corpus.append((rel, label, img))
+    return corpus
+
+
+def synthetic_corpus(count, seed, draft=False):
+    return [(f"{kind}/{name}", kind, _decode(data, draft))
+            for kind, items in image_set(count, seed, SYNTHETIC_KINDS).items() for name, data in items]
+
+
+# -----------------------------
+# Configurations
+# -----------------------------
+def _parse_value(name, text):
+    default = GATE_PARAMS[name]
+    if isinstance(default, bool):
+        if text.lower() not in ("1", "0", "true", "false", "yes", "no"):
+            raise SystemExit(f"--grid {name}: expected true/false, got {text!r}")
+        return text.lower() in ("1", "true", "yes")
+    if isinstance(default, float):
+        return float(text)
+    return int(text)  # int parameters and eye_min_size (None: the variant's default)
+
+
+def parse_grid(specs):
+    """["name=v1,v2", ...] -> [(name, [values])]."""
+    grid = []
+    for spec in specs or []:
+        name, sep, values = spec.partition("=")
+        name = name.strip()
+        if not sep or not values:
+            raise SystemExit(f"--grid expects name=value[,value...], got {spec!r}")
+        if name not in GATE_PARAMS:
+            raise SystemExit(f"--grid: unknown EyeGate parameter {name!r} (one of {', '.join(GATE_PARAMS)})")
+        grid.append((name, [_parse_value(name, v.strip()) for v in values.split(",")]))
+    return grid
+
+
+def configurations(variants, grid):
+    """[(config name, EyeGate)] for every variant x grid combination."""
+    names = [name for name, _ in grid]
+    out = []
+    for variant in variants:
+        for values in itertools.product(*[v for _, v in grid]):
+            params = dict(zip(names, values))
+            label = variant + "".join(f" {k}={v}" for k, v in params.items())
+            out.append((label, EyeGate(strict=variant == "strict", **params)))
+    return out
+
+
+# -----------------------------
+# Evaluation
+# -----------------------------
+def evaluate(gate, corpus, accept_labels, repeat):
+    confusion = Counter()  # tp: accepted eye image, fn: rejected eye image, fp / tn likewise for the rest
+    per_label = defaultdict(lambda: {"images": 0, "accepted": 0})
+    decided_by = defaultdict(Counter)
+    check_ms = defaultdict(list)
+    latencies, records = [], []
+    for name, label, img in corpus:
+        runs = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            accepted, details = gate(img)
+            runs.append(time.perf_counter() - t0)
+        elapsed = float(np.median(runs))
+        expected = label in accept_labels
+        outcome = ("tp" if accepted else "fn") if expected else ("fp" if accepted else "tn")
+        confusion[outcome] += 1
+        per_label[label]["images"] += 1
+        per_label[label]["accepted"] += int(accepted)
+        decided_by[details["decided_by"]][outcome] += 1
+        for check, ms in details["timings_ms"].items():
+            check_ms[check].append(ms)
+        latencies.append(elapsed)
+        records.append({"image": name, "label": label, "accepted": bool(accepted), "outcome": outcome,
+                        "decided_by": details["decided_by"], "ms": round(elapsed * 1000.0, 3)})
+
+    positives = confusion["tp"] + confusion["fn"]
+    negatives = confusion["fp"] + confusion["tn"]
+    n = len(corpus)
+    return {
+        "params": gate.params(),
+        "confusion": {k: confusion[k] for k in ("tp", "fn", "fp", "tn")},
+        "false_reject_rate": round(confusion["fn"] / positives, 4) if positives else 0.0,
+        "false_accept_rate": round(confusion["fp"] / negatives, 4) if negatives else 0.0,
+        "accuracy": round((confusion["tp"] + confusion["tn"]) / n, 4) if n else 0.0,
+        "per_label": {label: {**c, "accept_rate": round(c["accepted"] / c["images"], 4)}
+                      for label, c in sorted(per_label.items())},
+        "latency": summarize(latencies),
+        # mean over all images (0 for images that exited before the check) and how often it ran
+        "checks_ms": {check: {"mean_ms": round(sum(v) / n, 3), "ran": len(v)} for check, v in check_ms.items()},
+        "decided_by": {check: dict(c) for check, c in sorted(decided_by.items())},
+        "images": records,
+    }
+
+
+def pareto_front(results):
+    """Names of the configurations not dominated on (mean latency, false accept rate, false reject rate)."""
+    def key(r):
+        return (r["latency"].get("mean_ms", 0.0), r["false_accept_rate"], r["false_reject_rate"])
+
+    front = []
+    for name, r in results.items():
+        k = key(r)
+        dominated = any(all(a <= b for a, b in zip(key(o), k)) and key(o) != k for o in results.values())
+        if not dominated:
+            front.append(name)
+    return sorted(front, key=lambda name: key(results[name]))
+
+
+def print_table(results, names, out=sys.stderr):
+    print(f"{'configuration':<60} {'mean_ms':>8} {'p95_ms':>8} {'FAR':>7} {'FRR':>7} {'tp/fn/fp/tn':>15}", file=out)
+    for name in names:
+        r = results[name]
+        c = "/".join(str(r["confusion"][k]) for k in ("tp", "fn", "fp", "tn"))
+        print(f"{name:<60} {r['latency'].get('mean_ms', 0.0):>8.2f} {r['latency'].get('p95_ms', 0.0):>8.2f} "
+              f"{r['false_accept_rate']:>7.3f} {r['false_reject_rate']:>7.3f} {c:>15}", file=out)
+    out.flush()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("corpus", nargs="?", help="directory of labelled images (label = top-level folder)")
+    ap.add_argument("--labels", help="CSV with path,label columns (paths relative to the corpus directory)")
+    ap.add_argument("--synthetic", action="store_true", help="use the bench.synthetic images instead of a corpus")
+    ap.add_argument("--count", type=int, default=DEFAULT_COUNT, help="synthetic images per kind")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--limit", type=int, default=None, help="use only the first N corpus images")
+    ap.add_argument("--variant", nargs="+", default=["relaxed", "strict"], choices=["relaxed", "strict"])
+    ap.add_argument("--grid", nargs="*", default=[], metavar="PARAM=V1,V2",
+                    help="EyeGate parameter values to sweep (all combinations)")
+    ap.add_argument("--accept", nargs="+", default=list(ACCEPT_LABELS), help="labels the gate should accept")
+    ap.add_argument("--reject", nargs="+", default=list(REJECT_LABELS), help="labels the gate should reject")
+    ap.add_argument("--repeat", type=int, default=3, help="timed gate calls per image (median kept)")
+    ap.add_argument("--draft", action="store_true", help="reduced-resolution JPEG decode (PREDICT_DECODE_DRAFT=1)")
+    ap.add_argument("--opencv-threads", type=int, default=1,
+                    help="cv2.setNumThreads for the run (1: per-call cost as in a gate worker)")
+    ap.add_argument("--no-images", action="store_true", help="leave the per-image records out of --out")
+    ap.add_argument("--out", help="write JSON here (default: stdout)")
+    args = ap.parse_args(argv)
+    if not args.synthetic and not args.corpus:
+        ap.error("give a corpus directory or --synthetic")
+
+    cv2.setNumThreads(args.opencv_threads)
+    grid = parse_grid(args.grid)
+    corpus = synthetic_corpus(args.count, args.seed, args.draft) if args.synthetic else \
+        load_corpus(args.corpus, args.labels, args.limit, args.draft)
+    known = set(args.accept) | set(args.reject)
+    skipped = Counter(label for _, label, _ in corpus if label not in known)
+    if skipped:
+        print(f"[gate_eval] skipping unlabelled images: {dict(skipped)}", file=sys.stderr)
+    corpus = [item for item in corpus if item[1] in known]
+    if not corpus:
+        raise SystemExit("No labelled images to evaluate (see --accept / --reject)")
+    print(f"[gate_eval] {len(corpus)} images: {dict(Counter(label for _, label, _ in corpus))}", file=sys.stderr)
+
+    configs = configurations(args.variant, grid)
+    results = {}
+    for i, (name, gate) in enumerate(configs, 1):
+        gate(corpus[0][2])  # warm-up (cascade buffers)
+        results[name] = evaluate(gate, corpus, set(args.accept), max(1, args.repeat))
+        r = results[name]
+        print(f"[gate_eval] {i}/{len(configs)} {name}: mean {r['latency']['mean_ms']:.2f}ms "
+              f"FAR {r['false_accept_rate']:.3f} FRR {r['false_reject_rate']:.3f}", file=sys.stderr)
+        sys.stderr.flush()
+        if args.no_images:
+            del r["images"]
+
+    front = pareto_front(results)
+    for name, r in results.items():
+        r["pareto"] = name in front
+    print("\nPareto front (mean latency vs false accept / false reject rate):", file=sys.stderr)
+    print_table(results, front)
+    write_results("gate_eval", results, args.out, pareto=front,
+                  corpus={"source": "synthetic" if args.synthetic else args.corpus, "images": len(corpus),
+                          "labels": dict(Counter(label for _, label, _ in corpus)),
+                          "accept": args.accept, "reject": args.reject},
+                  grid={name: values for name, values in grid}, repeat=args.repeat, draft=args.draft)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Load generator for the Flask app: latency percentiles and throughput at several
+concurrency levels.
+
+    python -m bench.load [--url http://127.0.0.1:5000] [--concurrency 1 2 4 8] [--duration 10] [--out load.json]
+
+Without --url the app is imported and served in-process on a free port by
+werkzeug's threaded server (the same server `python server.py` uses). Pass
+--url to measure an already running server (e.g. under gunicorn) instead.
+
+Each request uploads the next synthetic image (all kinds, round-robin). Unless
+--no-cache-bust is given a unique trailer is appended after the JPEG end
+marker so the result cache never answers; decoding is unaffected.
+
+In-process runs also report the server's peak RSS for each level (Linux).
+"""
+import argparse
+import itertools
+import logging
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from bench.common import peak_rss_bytes, pin_malloc_thresholds, reset_peak_rss, rss_bytes, summarize, write_results
+from bench.synthetic import DEFAULT_COUNT, KINDS, image_set
+
+
+def encode_multipart(fields, files):
+    """fields: {name: str}; files: [(field, filename, bytes)] -> (body, content_type)."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for field, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                     f"Content-Type: image/jpeg\r\n\r\n".encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def start_local_server():
+    """Serve server.app on 127.0.0.1:<free port> in a daemon thread; returns (base_url, shutdown)."""
+    from werkzeug.serving import make_server
+
+    import server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    t = threading.Thread(target=httpd.serve_forever, name="bench-server", daemon=True)
+    t.start()
+    return f"http://127.0.0.1:{httpd.server_port}", httpd.shutdown
+
+
+def _post(url, body, content_type, timeout):
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+
+
+def run_level(url, payloads, concurrency, duration_s, timeout_s, symptoms="", cache_bust=True, measure_rss=False):
+    """Closed-loop load: `concurrency` threads send back-to-back requests for duration_s."""
+    rss_before = rss_bytes() if measure_rss and reset_peak_rss() else None
+    counter = itertools.count()
+    run_id = uuid.uuid4().hex[:8].encode()
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + duration_s
+
+    def worker():
+        while time.perf_counter() < deadline:
+            i = next(counter)
+            name, data, kind = payloads[i % len(payloads)]
+            if cache_bust:
+                data = data + b"bench-%s-%d" % (run_id, i)
+            body, ctype = encode_multipart({"image_type": "fundus", "symptoms": symptoms}, [("file", name, data)])
+            t0 = time.perf_counter()
+            try:
+                status = _post(url, body, ctype, timeout_s)
+            except Exception as e:
+                status = type(e).__name__
+            dt = time.perf_counter() - t0
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 200:
+                    latencies.append(dt)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    total = sum(statuses.values())
+    memory = {}
+    if rss_before is not None:
+        peak = peak_rss_bytes()
+        memory = {"rss_before_mb": round(rss_before / 2 ** 20, 1), "peak_rss_mb": round(peak / 2 ** 20, 1),
+                  "peak_rss_growth_mb": round(max(0, peak - rss_before) / 2 ** 20, 1)}
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "requests": total,
+        "ok": len(latencies),
+        "statuses": statuses,
+        "rps": round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency": summarize(latencies),
+        **memory,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="base URL of a running server (default: serve server.app in-process)")
+    ap.add_argument("--endpoint", default="/api/predict")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    ap.add_argument("--warmup", type=int, default=4, help="sequential requests before measuring")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--count", type=int, default=DEFAULT_COUNT, help="images per kind")
+    ap.add_argument("--kinds", nargs="+", default=list(KINDS), choices=KINDS)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--symptoms", default="", help="symptom text sent with every request")
+    ap.add_argument("--no-cache-bust", action="store_true", help="send identical bytes for repeated images")
+    ap.add_argument("--out", help="write JSON results here (default: stdout)")
+    args = ap.parse_args(argv)
+    if args.url is None:
+        pin_malloc_thresholds()
+
+    images = image_set(args.count, args.seed, args.kinds)
+    # interleave kinds so every concurrency level sees the same mix
+    payloads = [(name, data, kind) for group in zip(*(images[k] for k in args.kinds))
+                for kind, (name, data) in zip(args.kinds, group)]
+
+    shutdown = None
+    base = args.url
+    if base is None:
+        base, shutdown = start_local_server()
+    url = base.rstrip("/") + args.endpoint
+    try:
+        for i in range(args.warmup):
+            name, data, _ = payloads[i % len(payloads)]
+            body, ctype = encode_multipart({"image_type": "fundus"}, [("file", name, data)])
+            _post(url, body, ctype, args.timeout)
+        levels = []
+        for c in args.concurrency:
+            r = run_level(url, payloads, c, args.duration, args.timeout, args.symptoms, not args.no_cache_bust,
+                          measure_rss=args.url is None)
+            lat = r["latency"]
+            print(f"concurrency {c:>3}: {r['rps']:8.2f} req/s  p50 {lat.get('p50_ms', 0):8.1f} ms  "
+                  f"p95 {lat.get('p95_ms', 0):8.1f} ms  p99 {lat.get('p99_ms', 0):8.1f} ms  {r['statuses']}",
+                  file=sys.stderr)
+            levels.append(r)
+    finally:
+        if shutdown is not None:
+            shutdown()
+    params = {k: getattr(args, k) for k in ("endpoint", "duration", "count", "kinds", "seed", "symptoms")}
+    params.update({"url": args.url or "in-process", "cache_bust": not args.no_cache_bust})
+    write_results("load", {"levels": levels}, args.out, params=params)
+
+
+if __name__ == "__main__":
+    main()
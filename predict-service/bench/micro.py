@@ -0,0 +1,119 @@
+"""
+Micro-benchmarks for the request pipeline functions in server.py.
+
+    python -m bench.micro [--count 4] [--repeat 5] [--functions decode_bgr_from_bytes ...] [--out micro.json]
+
+Imports server (so the models in models/ are loaded as configured by the
+PREDICT_* environment) and times each function on every synthetic image kind.
+For the functions that decode an upload it also records the peak RSS growth
+per call (Linux only: the kernel high-water mark is reset before each call).
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from bench.common import measure_peak_rss, pin_malloc_thresholds, summarize, summarize_bytes, write_results
+from bench.synthetic import DEFAULT_COUNT, KINDS, image_set
+
+SYMPTOM_PHRASES = (
+    "blurred vision",
+    "red itchy eyes with discharge",
+    "gritty dry eyes worse in the evening",
+    "gradual cloudy vision and glare at night",
+    "fleshy growth on the white of the eye",
+    "eye pain and halos around lights",
+)
+
+
+def _time_calls(fn, args_list, repeat, warmup=1):
+    for args in args_list[:warmup]:
+        fn(*args)
+    samples = []
+    for _ in range(repeat):
+        for args in args_list:
+            t0 = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def _peak_rss_per_call(fn, args_list):
+    return [measure_peak_rss(fn, *args) for args in args_list]
+
+
+# functions that take upload bytes, i.e. the whole cost of decoding one request
+DECODE_FUNCTIONS = ("decode_bgr_from_bytes", "is_probably_eye_image", "preprocess_image_bytes")
+
+
+def image_benchmarks(server):
+    """name -> (fn, prepare) where prepare(jpeg_bytes) returns the call's args."""
+    from eye_gate import detect_fundus_circle_relaxed
+
+    return {
+        "decode_bgr_from_bytes": (server.decode_bgr_from_bytes, lambda b: (b,)),
+        "detect_fundus_circle_relaxed": (detect_fundus_circle_relaxed, lambda b: (server.decode_bgr_from_bytes(b),)),
+        "is_probably_eye_image": (server.is_probably_eye_image, lambda b: (b,)),
+        "preprocess_image_bytes": (server.preprocess_image_bytes, lambda b: (b,)),
+        "run_model": (lambda x: server.run_model("fundus", x), lambda b: (server.preprocess_image_bytes(b),)),
+    }
+
+
+def run(count=DEFAULT_COUNT, repeat=5, seed=0, functions=None):
+    pin_malloc_thresholds()
+    import server
+
+    images = image_set(count, seed)
+    benches = image_benchmarks(server)
+    results = {}
+    for name, (fn, prepare) in benches.items():
+        if functions and name not in functions:
+            continue
+        results[name] = {}
+        for kind in KINDS:
+            args_list = [prepare(data) for _, data in images[kind]]
+            results[name][kind] = summarize(_time_calls(fn, args_list, repeat))
+            line = f"{name:<30} {kind:<12} p50 {results[name][kind]['p50_ms']:9.3f} ms"
+            if name in DECODE_FUNCTIONS:
+                mem = summarize_bytes(_peak_rss_per_call(fn, args_list))
+                results[name][kind]["peak_rss"] = mem
+                if mem["n"]:
+                    line += f"  peak RSS +{mem['max_mb']:.1f} MB"
+            print(line, file=sys.stderr)
+
+    if not functions or "softmax_scores" in functions:
+        rng = np.random.default_rng(seed)
+        k = len(server.class_names("fundus"))
+        preds = [(rng.dirichlet(np.ones(k)),) for _ in range(256)]
+        results["softmax_scores"] = {"random": summarize(_time_calls(server.softmax_scores, preds, repeat))}
+        print(f"{'softmax_scores':<30} {'random':<12} p50 {results['softmax_scores']['random']['p50_ms']:9.3f} ms", file=sys.stderr)
+
+    if not functions or "predict_symptoms" in functions:
+        # "repeated" hits the symptom cache after the first pass; "unique" never does
+        repeated = [(p,) for p in SYMPTOM_PHRASES]
+        unique = [(f"{p} since {i} days",) for i in range(repeat) for p in SYMPTOM_PHRASES]
+        results["predict_symptoms"] = {
+            "repeated": summarize(_time_calls(server.predict_symptoms, repeated, repeat)),
+            "unique": summarize(_time_calls(server.predict_symptoms, unique, 1, warmup=0)),
+        }
+        for variant, s in results["predict_symptoms"].items():
+            print(f"{'predict_symptoms':<30} {variant:<12} p50 {s['p50_ms']:9.3f} ms", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--count", type=int, default=DEFAULT_COUNT, help="images per kind")
+    ap.add_argument("--repeat", type=int, default=5, help="passes over each image set")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--functions", nargs="+", help="only run these benchmarks")
+    ap.add_argument("--out", help="write JSON results here (default: stdout)")
+    args = ap.parse_args(argv)
+    results = run(args.count, args.repeat, args.seed, args.functions)
+    write_results("micro", results, args.out,
+                  params={"count": args.count, "repeat": args.repeat, "seed": args.seed})
+
+
+if __name__ == "__main__":
+    main()
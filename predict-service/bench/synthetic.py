@@ -0,0 +1,143 @@
+"""
+Deterministic synthetic images for benchmarking (same seed -> same bytes).
+
+    python -m bench.synthetic OUT_DIR [--count 8] [--seed 0]
+
+Kinds:
+  fundus       red/orange disc on black with an optic disc and vessels (~1024px)
+  eye_closeup  sclera, iris and pupil on a skin-tone background (~640x480)
+  non_eye      gradients, blocks and noise; nothing round and red (~800x600)
+  phone        phone-sized 4032x3024 JPEGs alternating fundus-like / non-eye content
+"""
+import argparse
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+KINDS = ("fundus", "eye_closeup", "non_eye", "phone")
+DEFAULT_COUNT = 8
+
+
+def _rng(seed, kind, i):
+    return np.random.default_rng([seed, KINDS.index(kind), i])
+
+
+def _jpeg(img_bgr, quality=90):
+    buf = io.BytesIO()
+    Image.fromarray(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def draw_fundus(rng, w, h):
+    img = np.zeros((h, w, 3), np.uint8)
+    cx = int(w / 2 + rng.uniform(-0.03, 0.03) * w)
+    cy = int(h / 2 + rng.uniform(-0.03, 0.03) * h)
+    r = int(min(w, h) * rng.uniform(0.40, 0.46))
+    # radial falloff from an orange centre to a darker red rim
+    yy, xx = np.mgrid[0:h, 0:w]
+    d = np.sqrt((xx - cx) ** 2 + (yy - cy) ** 2) / r
+    inside = d <= 1.0
+    base = np.array([30 + rng.integers(0, 20), 80 + rng.integers(0, 40), 200 + rng.integers(0, 40)], np.float32)
+    shade = np.clip(1.0 - 0.45 * d ** 2, 0, 1)[..., None]
+    img[inside] = np.clip(base * shade, 0, 255).astype(np.uint8)[inside]
+    # optic disc
+    ang = rng.uniform(0, 2 * np.pi)
+    ox, oy = int(cx + 0.45 * r * np.cos(ang)), int(cy + 0.45 * r * np.sin(ang))
+    cv2.circle(img, (ox, oy), int(r * 0.14), (150, 210, 250), -1)
+    # vessels fanning out of the optic disc
+    for _ in range(int(rng.integers(6, 11))):
+        a = rng.uniform(0, 2 * np.pi)
+        length = r * rng.uniform(0.6, 1.2)
+        pts = [(ox, oy)]
+        for step in range(1, 6):
+            a += rng.uniform(-0.3, 0.3)
+            pts.append((int(ox + length * step / 5 * np.cos(a)), int(oy + length * step / 5 * np.sin(a))))
+        cv2.polylines(img, [np.array(pts, np.int32)], False, (20, 30, 120), int(max(2, r * 0.012)))
+    img[~inside] = 0
+    noise = rng.normal(0, 3, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def draw_eye_closeup(rng, w, h):
+    skin = np.array([120 + rng.integers(0, 40), 150 + rng.integers(0, 40), 200 + rng.integers(0, 40)], np.uint8)
+    img = np.empty((h, w, 3), np.uint8)
+    img[:] = skin
+    cx, cy = w // 2 + int(rng.integers(-20, 20)), h // 2 + int(rng.integers(-15, 15))
+    ax, ay = int(w * 0.36), int(h * 0.22)
+    cv2.ellipse(img, (cx, cy), (ax + 10, ay + 10), 0, 0, 360, (70, 90, 130), -1)  # lid crease
+    cv2.ellipse(img, (cx, cy), (ax, ay), 0, 0, 360, (235, 240, 245), -1)  # sclera
+    ir = int(ay * 0.95)
+    iris = tuple(int(c) for c in rng.integers(30, 140, size=3))
+    cv2.circle(img, (cx, cy), ir, iris, -1)
+    cv2.circle(img, (cx, cy), int(ir * rng.uniform(0.35, 0.5)), (10, 10, 10), -1)
+    cv2.circle(img, (cx - ir // 3, cy - ir // 3), max(3, ir // 8), (255, 255, 255), -1)
+    # lashes
+    for x in range(cx - ax, cx + ax, 12):
+        t = (x - cx) / ax
+        y = int(cy - ay * np.sqrt(max(0.0, 1 - t * t)))
+        cv2.line(img, (x, y), (x + int(rng.integers(-4, 5)), y - int(rng.integers(10, 22))), (30, 30, 40), 2)
+    img = cv2.GaussianBlur(img, (5, 5), 0)
+    return np.clip(img + rng.normal(0, 4, img.shape), 0, 255).astype(np.uint8)
+
+
+def draw_non_eye(rng, w, h):
+    x = np.linspace(0, 1, w, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 1, h, dtype=np.float32)[:, None, None]
+    c0, c1, c2 = (rng.uniform(0, 255, size=3) for _ in range(3))
+    img = c0 * (1 - x) * (1 - y) + c1 * x + c2 * y * (1 - x)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    for _ in range(int(rng.integers(5, 15))):
+        p0 = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+        p1 = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+        color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        cv2.rectangle(img, p0, p1, color, -1 if rng.random() < 0.6 else 3)
+    return cv2.GaussianBlur(img, (3, 3), 0)
+
+
+def generate(kind, count=DEFAULT_COUNT, seed=0):
+    """[(name, jpeg_bytes)] for one kind."""
+    out = []
+    for i in range(count):
+        rng = _rng(seed, kind, i)
+        if kind == "fundus":
+            s = int(rng.integers(900, 1200))
+            img, q = draw_fundus(rng, s, s), 90
+        elif kind == "eye_closeup":
+            img, q = draw_eye_closeup(rng, 640, 480), 90
+        elif kind == "non_eye":
+            img, q = draw_non_eye(rng, 800, 600), 90
+        elif kind == "phone":
+            img = draw_fundus(rng, 4032, 3024) if i % 2 == 0 else draw_non_eye(rng, 4032, 3024)
+            q = 92
+        else:
+            raise ValueError(f"unknown kind {kind!r} (expected one of {KINDS})")
+        out.append((f"{kind}_{i:03d}.jpg", _jpeg(img, q)))
+    return out
+
+
+def image_set(count=DEFAULT_COUNT, seed=0, kinds=KINDS):
+    """{kind: [(name, jpeg_bytes)]}."""
+    return {k: generate(k, count, seed) for k in kinds}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("out_dir")
+    ap.add_argument("--count", type=int, default=DEFAULT_COUNT)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--kinds", nargs="+", default=list(KINDS), choices=KINDS)
+    args = ap.parse_args(argv)
+    for kind, items in image_set(args.count, args.seed, args.kinds).items():
+        d = os.path.join(args.out_dir, kind)
+        os.makedirs(d, exist_ok=True)
+        for name, data in items:
+            with open(os.path.join(d, name), "wb") as f:
+                f.write(data)
+        print(f"{kind}: {len(items)} images -> {d}")
+
+
+if __name__ == "__main__":
+    main()
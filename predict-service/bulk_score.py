@@ -0,0 +1,319 @@
+"""
+Offline bulk scoring of stored images (retrospective screening audits).
+
+    python bulk_score.py IMAGES_DIR_OR_TAR --out results.jsonl [--image-type fundus] [--workers N]
+    python bulk_score.py archive.tar.gz --out results.csv --resume
+
+Same decode, eye gate, preprocessing and models as server.py (and the same
+PREDICT_* settings): images are streamed from a directory tree or a tar archive
+(read sequentially, compressed or not), decoded and gated in a process pool,
+and the accepted ones are run through the model in batches of --batch-size.
+
+One record per image, keyed by "path" (relative to the directory, or the tar
+member name), with the same fields as the /api/predict response; an image that
+cannot be scored gets {"ok": false, "error": ...} and the run goes on. JSONL
+by default, CSV if --out ends in .csv (nested values JSON-encoded). With
+--resume, images already in the output file are skipped and new records are
+appended, so an interrupted run can be restarted with the same command.
+Progress and throughput go to stderr every --report-every seconds.
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tarfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+CSV_FIELDS = ("path", "ok", "rejected", "type", "prediction", "confidence", "top3", "symptom_pred",
+              "symptom_agrees", "ood_scores", "heuristics", "reason", "error", "model_version")
+
+
+# -----------------------------
+# Input: (key, path or bytes) from a directory tree or a tar stream
+# -----------------------------
+def iter_directory(root):
+    for dirpath, dirnames, files in os.walk(root):
+        dirnames.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTS):
+                path = os.path.join(dirpath, name)
+                yield os.path.relpath(path, root), path, None
+
+
+def iter_tar(path, skip=frozenset()):
+    # "r|*": sequential stream, any compression; member data must be read before moving on
+    with tarfile.open(path, "r|*") as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTS) or member.name in skip:
+                continue
+            f = tar.extractfile(member)
+            yield member.name, None, f.read() if f is not None else b""
+
+
+# -----------------------------
+# Worker processes: decode + gate (+ model preprocessing) without TensorFlow
+# -----------------------------
+_decode_options = None
+_gate = None
+
+
+def _init_worker(decode_options, gate_variant, gate_engine):
+    global _decode_options, _gate
+    import cv2
+    from eye_gate import make_gate
+
+    cv2.setNumThreads(1)  # parallelism comes from the processes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled by the parent
+    _decode_options = decode_options
+    _gate = make_gate(gate_variant, gate_engine)
+
+
+def _gate_one(key, path, data, img_size):
+    """-> (key, status, heuristics_or_error, model_input) with status ok | rejected | error."""
+    try:
+        return _gate_checked(key, path, data, img_size)
+    except Exception as e:  # one bad file (e.g. a cv2.error from the gate) must not end the run
+        return key, "error", f"{type(e).__name__}: {e}", None
+
+
+def _gate_checked(key, path, data, img_size):
+    from imaging import DecodedImage, ImageTooLarge
+
+    try:
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        if not data:
+            return key, "error", "Empty file", None
+        decoded = DecodedImage.from_bytes(data, **_decode_options)
+    except (ImageTooLarge, OSError) as e:
+        return key, "error", str(e), None
+    if decoded is None:
+        return key, "rejected", {"decoded": False}, None
+    eye_like, heuristics = _gate(decoded.gate_bgr())
+    if not eye_like:
+        return key, "rejected", heuristics, None
+    return key, "ok", heuristics, decoded.model_input(img_size)[0]
+
+
+# -----------------------------
+# Output
+# -----------------------------
+def _truncate_partial_line(path):
+    # an interrupted write can leave half a record at the end: drop it before appending
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+        return data[:end].decode("utf-8")
+
+
+class ResultWriter:
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.csv = path.lower().endswith(".csv")
+        self.done = set()
+        existing = os.path.exists(path) and os.path.getsize(path) > 0
+        if existing and not resume:
+            raise SystemExit(f"{path} exists; pass --resume to continue it or choose another --out")
+        if existing:
+            text = _truncate_partial_line(path)
+            if self.csv:
+                self.done = {row["path"] for row in csv.DictReader(text.splitlines())}
+            else:
+                self.done = {json.loads(line)["path"] for line in text.splitlines() if line.strip()}
+        self._f = open(path, "a", newline="" if self.csv else None, encoding="utf-8")
+        if self.csv:
+            self._csv = csv.DictWriter(self._f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            if not existing:
+                self._csv.writeheader()
+
+    def encode(self, key, payload):
+        """The output line(s) for one record, without writing them."""
+        record = {"path": key, **payload}
+        if self.csv:
+            buf = io.StringIO()
+            csv.DictWriter(buf, fieldnames=CSV_FIELDS, extrasaction="ignore").writerow(
+                {k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in record.items()})
+            return buf.getvalue()
+        return json.dumps(record) + "\n"
+
+    def write(self, key, payload):
+        self._f.write(self.encode(key, payload))
+
+    def write_encoded(self, lines):
+        self._f.write("".join(lines))
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+class Progress:
+    def __init__(self, every_s, skipped):
+        self.every_s = every_s
+        self.started = self.last = time.perf_counter()
+        self.last_done = 0
+        self.counts = {"ok": 0, "rejected": 0, "error": 0}
+        self.skipped = skipped
+
+    @property
+    def done(self):
+        return sum(self.counts.values())
+
+    def add(self, status):
+        self.counts[status] += 1
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {"scored": self.done, **self.counts, "skipped_resumed": self.skipped,
+                "elapsed_s": round(elapsed, 1), "images_per_s": round(self.done / elapsed, 2) if elapsed else 0.0}
+
+    def maybe_report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last < self.every_s:
+            return
+        window = (self.done - self.last_done) / max(now - self.last, 1e-9)
+        s = self.summary()
+        print(f"[bulk_score] {s['scored']} scored ({s['ok']} predicted, {s['rejected']} rejected, "
+              f"{s['error']} errors), {window:.1f} img/s now, {s['images_per_s']:.1f} img/s overall, "
+              f"{s['elapsed_s']:.0f}s", file=sys.stderr)
+        sys.stderr.flush()
+        self.last, self.last_done = now, self.done
+
+
+# -----------------------------
+# Main loop
+# -----------------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("source", help="directory of images or a tar archive (.tar, .tar.gz, .tgz, ...)")
+    ap.add_argument("--out", required=True, help="results file: .jsonl (default) or .csv")
+    ap.add_argument("--image-type", default="fundus", help="fundus | outer (as the API's image_type field)")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                    help="decode + gate processes")
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--resume", action="store_true", help="skip images already in --out and append")
+    ap.add_argument("--report-every", type=float, default=10.0, help="seconds between progress lines")
+    args = ap.parse_args(argv)
+
+    writer = ResultWriter(args.out, resume=args.resume)
+
+    # the parent only runs the models: no batcher threads, no result cache, load now
+    os.environ.setdefault("PREDICT_APP_FACTORY", "1")
+    os.environ.setdefault("PREDICT_BATCHING", "0")
+    os.environ.setdefault("PREDICT_CACHE", "0")
+    os.environ.setdefault("PREDICT_MODEL_WATCH_S", "0")  # one model version for the whole run
+    os.environ.setdefault("PREDICT_KEEPWARM_S", "0")  # never idle
+    import server
+    from imaging import IMG_SIZE
+
+    server.start_components("eager")
+    image_type = server.normalize_image_type(args.image_type)
+    decided_type = image_type if image_type in ("fundus", "outer") else "fundus"
+
+    if os.path.isdir(args.source):
+        items = ((k, p, d) for k, p, d in iter_directory(args.source) if k not in writer.done)
+    else:
+        items = iter_tar(args.source, skip=writer.done)
+    progress = Progress(args.report_every, len(writer.done))
+    accepted = []  # [(key, heuristics, model_input)]
+
+    def score(items):
+        stacked = np.stack([x for _, _, x in items])
+        preds = np.stack(server.run_models([decided_type] * len(items), stacked, priority="background"))
+        top1, margin, entropy, order = server.softmax_scores_batch(preds)
+        lines = [writer.encode(key, server.prediction_payload(
+                     decided_type, preds[j], (top1[j], margin[j], entropy[j], order[j]), None, heuristics))
+                 for j, (key, heuristics, _) in enumerate(items)]
+        # written only once the whole batch succeeded: the one-by-one fallback never repeats a key
+        writer.write_encoded(lines)
+        for _ in items:
+            progress.add("ok")
+
+    def run_batch():
+        try:
+            score(accepted)
+        except Exception:
+            # find the image that broke the batch: score one by one, recording errors per file
+            for item in accepted:
+                try:
+                    score([item])
+                except Exception as e:
+                    write_error(item[0], e)
+        accepted.clear()
+        writer.flush()
+
+    def write_error(key, e):
+        print(f"[bulk_score] {key}: {type(e).__name__}: {e}", file=sys.stderr)
+        writer.write(key, {"ok": False, "error": f"{type(e).__name__}: {e}"})
+        progress.add("error")
+
+    # spawn: the parent has started TensorFlow, which is not fork-safe
+    ctx = multiprocessing.get_context("spawn")
+    initargs = (server.DECODE_OPTIONS, server.GATE_VARIANT, server.GATE_ENGINE)
+    max_pending = args.workers * 4  # bounded read-ahead: a tar is never loaded into memory whole
+    interrupted = False
+    pool = ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=_init_worker, initargs=initargs)
+    try:
+        pending = {}  # future -> key
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                else:
+                    pending[pool.submit(_gate_one, *item, IMG_SIZE)] = item[0]
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                key = pending.pop(fut)
+                try:
+                    key, status, info, x = fut.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:  # e.g. a result that could not be sent back from the worker
+                    write_error(key, e)
+                    continue
+                if status == "ok":
+                    accepted.append((key, info, x))
+                    continue
+                payload = (server.rejection_payload(info) if status == "rejected"
+                           else {"ok": False, "error": info})
+                writer.write(key, payload)
+                progress.add(status)
+            if len(accepted) >= args.batch_size:
+                run_batch()
+            else:
+                writer.flush()
+            progress.maybe_report()
+        if accepted:
+            run_batch()
+    except KeyboardInterrupt:
+        interrupted = True
+    finally:
+        pool.shutdown(wait=not interrupted, cancel_futures=interrupted)
+        writer.close()
+    progress.maybe_report(force=True)
+    print(json.dumps(progress.summary()), file=sys.stderr)
+    if interrupted:
+        print(f"Interrupted; rerun with --resume to continue {args.out}", file=sys.stderr)
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Request deadlines and priority classes.
+
+Callers may send:
+
+  X-Request-Deadline: <unix epoch ms>   absolute; only meaningful if the caller's clock is in sync
+  X-Request-Timeout-Ms: <ms>            relative to when the request was received (the Node
+                                        backend sends its axios timeout)
+  X-Request-Priority: interactive | batch | background
+
+The deadline is converted to the monotonic clock on arrival and checked at every
+stage boundary; work whose caller has already given up is dropped with
+DeadlineExceeded instead of being computed. In the micro-batcher queue, higher
+priority items are taken first (interactive single-image diagnoses ahead of bulk
+or background re-scoring).
+"""
+import time
+
+PRIORITIES = ("interactive", "batch", "background")  # most urgent first
+
+
+def _header_float(headers, name):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class DeadlineExceeded(Exception):
+    """The caller's deadline passed before `stage` could start."""
+
+    def __init__(self, stage, late_s=0.0):
+        super().__init__(f"Deadline exceeded before {stage} ({late_s * 1000.0:.0f} ms late)")
+        self.stage = stage
+        self.late_s = late_s
+
+
+class Deadline:
+    """A point on the time.perf_counter() clock, or None for no deadline."""
+
+    def __init__(self, expires_at=None):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds):
+        return cls(time.perf_counter() + seconds)
+
+    @classmethod
+    def from_headers(cls, headers):
+        """From X-Request-Deadline / X-Request-Timeout-Ms (the earlier wins); unparsable values are ignored."""
+        now = time.perf_counter()
+        candidates = []
+        absolute_ms = _header_float(headers, "x-request-deadline")
+        if absolute_ms is not None:
+            candidates.append(now + absolute_ms / 1000.0 - time.time())
+        timeout_ms = _header_float(headers, "x-request-timeout-ms")
+        if timeout_ms is not None:
+            candidates.append(now + timeout_ms / 1000.0)
+        return cls(min(candidates) if candidates else None)
+
+    def remaining(self):
+        """Seconds left (negative once expired), or None without a deadline."""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.perf_counter()
+
+    def expired(self):
+        return self.expires_at is not None and time.perf_counter() > self.expires_at
+
+    def check(self, stage):
+        """Stage boundary: raise DeadlineExceeded if the deadline has passed."""
+        if self.expires_at is not None:
+            late = time.perf_counter() - self.expires_at
+            if late > 0:
+                raise DeadlineExceeded(stage, late)
+
+
+NO_DEADLINE = Deadline(None)
+
+
+def parse_priority(value, default="interactive"):
+    value = (value or "").strip().lower()
+    return value if value in PRIORITIES else default
+
+
+def priority_rank(name):
+    """0 for the most urgent class; unknown names rank with the default (interactive)."""
+    return PRIORITIES.index(name) if name in PRIORITIES else 0
@@ -0,0 +1,379 @@
+"""
+Eye gate engine: decides whether an image is a fundus photo or an outer-eye close-up.
+
+EyeGate runs the sub-checks cheapest first (fundus Hough ~6ms, face cascade
+~55ms, eye cascade ~165ms on a 640px image) and stops as soon as the decision
+is fixed. Colour / skin statistics are computed on cropped bounding boxes only.
+Its accept/reject decisions match the original gates, which are kept below as
+legacy_relaxed_gate (server.py) and legacy_strict_gate (test.py):
+
+    python eye_gate.py path/to/images [--strict]   # regression check vs the legacy gate
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import cv2
+
+haar_base = cv2.data.haarcascades
+face_cascade = cv2.CascadeClassifier(os.path.join(haar_base, "haarcascade_frontalface_default.xml"))
+eye_cascade = cv2.CascadeClassifier(os.path.join(haar_base, "haarcascade_eye_tree_eyeglasses.xml"))
+if eye_cascade.empty():
+    eye_cascade = cv2.CascadeClassifier(os.path.join(haar_base, "haarcascade_eye.xml"))
+
+
+def detect_fundus_circle_relaxed(img_bgr, gray=None, dp=1.2, param1=100, param2=25):
+    """Relaxed fundus check: circle allowed 20%-75% of min side and center within ~1.2 radii."""
+    if gray is None:
+        gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    gray = cv2.medianBlur(gray, 5)
+    h, w = gray.shape[:2]
+    min_r = max(8, int(min(h, w) * 0.20))
+    max_r = int(min(h, w) * 0.75)
+    circles = cv2.HoughCircles(
+        gray,
+        cv2.HOUGH_GRADIENT,
+        dp=dp,
+        minDist=min(h, w) // 2,
+        param1=param1,
+        param2=param2,
+        minRadius=min_r,
+        maxRadius=max_r,
+    )
+    if circles is None:
+        return None
+    circles = np.round(circles[0, :]).astype("int")
+    circles = sorted(circles, key=lambda c: c[2], reverse=True)
+    x, y, r = circles[0]
+    cx, cy = w // 2, h // 2
+    center_dist = np.sqrt((x - cx) ** 2 + (y - cy) ** 2) / (r + 1e-6)
+    r_ratio = r / float(min(h, w))
+    return dict(x=int(x), y=int(y), r=int(r), r_ratio=float(r_ratio), center_dist=float(center_dist))
+
+
+def fundus_geometry_ok(info):
+    return bool(info) and (0.20 <= info["r_ratio"] <= 0.75) and (info["center_dist"] <= 1.2)
+
+
+def fundus_circle_color_is_valid(img_bgr, circle):
+    """
+    Validate that the circle region looks like fundus: red/orange dominance.
+    Mean BGR and HSV stats are taken inside the circle mask, computed on the
+    circle's bounding box only (same values as masking the full image).
+    """
+    if circle is None:
+        return False, {"reason": "no_circle"}
+    h, w = img_bgr.shape[:2]
+    x, y, r = int(circle["x"]), int(circle["y"]), int(circle["r"])
+    x0, y0 = max(0, x - r), max(0, y - r)
+    x1, y1 = min(w, x + r + 1), min(h, y + r + 1)
+    if x1 <= x0 or y1 <= y0:
+        # circle entirely outside the image: the legacy full-image mask would be empty (means of 0)
+        crop = img_bgr[:1, :1]
+        mask = np.zeros((1, 1), dtype=np.uint8)
+    else:
+        crop = img_bgr[y0:y1, x0:x1]
+        mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+        cv2.circle(mask, (x - x0, y - y0), r, 255, -1)
+
+    B, G, R = cv2.mean(crop, mask=mask)[:3]
+    hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+    mean_h = cv2.mean(hsv[:, :, 0], mask=mask)[0]  # 0..180
+    mean_s = cv2.mean(hsv[:, :, 1], mask=mask)[0]  # 0..255
+
+    red_dominant = (R > G + 15) and (R > B + 15)
+    hue_warm = 5 <= mean_h <= 35         # warm tones
+    sat_ok = mean_s >= 40                # moderate saturation
+
+    ok = bool(red_dominant and hue_warm and sat_ok)
+    info = {
+        "mean_bgr": {"B": float(B), "G": float(G), "R": float(R)},
+        "mean_h": float(mean_h),
+        "mean_s": float(mean_s),
+        "red_dominant": bool(red_dominant),
+        "hue_warm": bool(hue_warm),
+        "sat_ok": bool(sat_ok)
+    }
+    return ok, info
+
+
+def skin_ratio_in_roi(roi_bgr):
+    """Estimate human skin proportion in ROI using YCrCb thresholds. Returns ratio in [0,1]."""
+    if roi_bgr.size == 0:
+        return 0.0
+    ycrcb = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2YCrCb)
+    skin_mask = cv2.inRange(ycrcb, (0, 133, 77), (255, 173, 127))
+    return float(np.count_nonzero(skin_mask)) / float(roi_bgr.shape[0] * roi_bgr.shape[1] + 1e-6)
+
+
+def pupil_in_roi(roi_bgr, dp=1.2, param2=12):
+    gray_roi = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2GRAY)
+    gray_roi = cv2.GaussianBlur(gray_roi, (5, 5), 0)
+    rh, rw = gray_roi.shape[:2]
+    min_r = max(3, int(min(rh, rw) * 0.04))
+    max_r = max(5, int(min(rh, rw) * 0.18))
+    circles = cv2.HoughCircles(
+        gray_roi, cv2.HOUGH_GRADIENT, dp=dp, minDist=min(rh, rw) // 2,
+        param1=80, param2=param2, minRadius=min_r, maxRadius=max_r
+    )
+    return circles is not None
+
+
+class EyeGate:
+    """
+    Cost-ordered, early-exit eye gate.
+
+    strict=False reproduces the relaxed server gate (fundus circle OR eye OR face);
+    strict=True reproduces the test.py gate (fundus circle with fundus colour OR
+    eyes with enough area, skin and a pupil). With early_exit=False every check
+    runs, which is what the legacy gates did. details["decided_by"] names the
+    sub-check that fixed the decision; details["timings_ms"] has per-check cost.
+    """
+
+    def __init__(self, strict=False, early_exit=True,
+                 fundus_dp=1.2, fundus_param2=25,
+                 eye_scale_factor=1.1, eye_min_neighbors=4, eye_min_size=None,
+                 face_scale_factor=1.1, face_min_neighbors=3, face_min_size=80,
+                 min_total_eye_area_ratio=0.03, min_skin_ratio=0.08, require_pupil=True,
+                 pupil_dp=1.2, pupil_param2=12):
+        self.strict = strict
+        self.early_exit = early_exit
+        self.fundus_dp = fundus_dp
+        self.fundus_param2 = fundus_param2
+        self.eye_scale_factor = eye_scale_factor
+        self.eye_min_neighbors = eye_min_neighbors
+        self.eye_min_size = eye_min_size or (18 if strict else 20)
+        self.face_scale_factor = face_scale_factor
+        self.face_min_neighbors = face_min_neighbors
+        self.face_min_size = face_min_size
+        self.min_total_eye_area_ratio = min_total_eye_area_ratio
+        self.min_skin_ratio = min_skin_ratio
+        self.require_pupil = require_pupil
+        self.pupil_dp = pupil_dp
+        self.pupil_param2 = pupil_param2
+
+    def params(self):
+        return dict(self.__dict__)
+
+    def __call__(self, img_bgr):
+        timings = {}
+
+        def timed(name, fn, *args, **kwargs):
+            t0 = time.perf_counter()
+            out = fn(*args, **kwargs)
+            timings[name] = (time.perf_counter() - t0) * 1000.0
+            return out
+
+        gray = timed("gray", cv2.cvtColor, img_bgr, cv2.COLOR_BGR2GRAY)
+        details = {"decoded": True, "fundus": None, "outer": None, "timings_ms": timings}
+        if self.strict:
+            eye_like, decided_by = self._strict(img_bgr, gray, details, timed)
+        else:
+            eye_like, decided_by = self._relaxed(img_bgr, gray, details, timed)
+        details["decided_by"] = decided_by
+        return eye_like, details
+
+    # --- relaxed: fundus circle OR any eye OR any face ---
+    def _relaxed(self, img_bgr, gray, details, timed):
+        info = timed("fundus_hough", detect_fundus_circle_relaxed, img_bgr, gray=gray,
+                     dp=self.fundus_dp, param2=self.fundus_param2)
+        fundus_ok = fundus_geometry_ok(info)
+        details["fundus"] = {"ok": fundus_ok, "info": info}
+        outer = {"eyes": None, "faces": None, "ok": False}
+        details["outer"] = outer
+        if fundus_ok and self.early_exit:
+            outer["ok"] = None
+            outer["skipped"] = True
+            return True, "fundus"
+        eq = timed("equalize", cv2.equalizeHist, gray)
+        faces = timed("face_cascade", face_cascade.detectMultiScale, eq, scaleFactor=self.face_scale_factor,
+                      minNeighbors=self.face_min_neighbors, minSize=(self.face_min_size, self.face_min_size))
+        outer["faces"] = int(len(faces))
+        if len(faces) > 0 and self.early_exit:
+            outer["ok"] = True
+            return True, "face_cascade"
+        eyes = timed("eye_cascade", eye_cascade.detectMultiScale, eq, scaleFactor=self.eye_scale_factor,
+                     minNeighbors=self.eye_min_neighbors, minSize=(self.eye_min_size, self.eye_min_size))
+        outer["eyes"] = int(len(eyes))
+        outer["ok"] = (len(eyes) > 0) or (len(faces) > 0)
+        if fundus_ok:
+            return True, "fundus"
+        if len(faces) > 0:
+            return True, "face_cascade"
+        return bool(outer["ok"]), "eye_cascade"
+
+    # --- strict: fundus circle + colour OR (eyes, area, skin, pupil) ---
+    def _strict(self, img_bgr, gray, details, timed):
+        H, W = img_bgr.shape[:2]
+        info = timed("fundus_hough", detect_fundus_circle_relaxed, img_bgr, gray=gray,
+                     dp=self.fundus_dp, param2=self.fundus_param2)
+        color_ok = False
+        if fundus_geometry_ok(info):
+            color_ok, _ = timed("fundus_color", fundus_circle_color_is_valid, img_bgr, info)
+        fundus_ok = bool(color_ok)
+        details["fundus"] = {"geom_ok": bool(info is not None), "info": info,
+                             "color_ok": bool(color_ok), "ok": fundus_ok}
+        outer = {"eyes": None, "total_eye_area_ratio": None, "max_skin_ratio": None,
+                 "pupil_ok": None, "ok": False}
+        details["outer"] = outer
+        if fundus_ok and self.early_exit:
+            outer["ok"] = None
+            outer["skipped"] = True
+            return True, "fundus"
+
+        eq = timed("equalize", cv2.equalizeHist, gray)
+        eyes = timed("eye_cascade", eye_cascade.detectMultiScale, eq, scaleFactor=self.eye_scale_factor,
+                     minNeighbors=self.eye_min_neighbors, minSize=(self.eye_min_size, self.eye_min_size))
+        outer["eyes"] = int(len(eyes))
+        area = sum((w * h) / float(W * H) for (x, y, w, h) in eyes)
+        outer["total_eye_area_ratio"] = float(area)
+        rois = [img_bgr[max(0, y):min(H, y + h), max(0, x):min(W, x + w)] for (x, y, w, h) in eyes]
+        rois = [r for r in rois if r.size > 0]
+
+        def finish(ok, decided_by):
+            outer["ok"] = bool(ok)
+            return bool(fundus_ok or ok), ("fundus" if fundus_ok else decided_by)
+
+        if len(eyes) == 0:
+            return finish(False, "eye_cascade")
+        if area < self.min_total_eye_area_ratio and self.early_exit:
+            return finish(False, "eye_area")
+
+        # skin: any ROI reaching the threshold is enough (max >= threshold)
+        t0 = time.perf_counter()
+        max_skin = 0.0
+        for roi in rois:
+            max_skin = max(max_skin, skin_ratio_in_roi(roi))
+            if max_skin >= self.min_skin_ratio and self.early_exit:
+                break
+        details["timings_ms"]["skin"] = (time.perf_counter() - t0) * 1000.0
+        outer["max_skin_ratio"] = float(max_skin)
+        if max_skin < self.min_skin_ratio and self.early_exit:
+            return finish(False, "skin")
+
+        pupil_ok = False
+        if self.require_pupil or not self.early_exit:
+            t0 = time.perf_counter()
+            for roi in rois:
+                if pupil_in_roi(roi, dp=self.pupil_dp, param2=self.pupil_param2):
+                    pupil_ok = True
+                    if self.early_exit:
+                        break
+            details["timings_ms"]["pupil_hough"] = (time.perf_counter() - t0) * 1000.0
+        outer["pupil_ok"] = bool(pupil_ok)
+
+        ok = (area >= self.min_total_eye_area_ratio) and (max_skin >= self.min_skin_ratio) and \
+             (pupil_ok if self.require_pupil else True)
+        if ok:
+            return finish(True, "pupil_hough" if self.require_pupil else "skin")
+        if area < self.min_total_eye_area_ratio:
+            return finish(False, "eye_area")
+        if max_skin < self.min_skin_ratio:
+            return finish(False, "skin")
+        return finish(False, "pupil_hough")
+
+
+# -----------------------------
+# Legacy gates (reference for regression checks; same logic as the original code)
+# -----------------------------
+def legacy_relaxed_gate(img_bgr):
+    details = {"decoded": True, "fundus": None, "outer": None}
+    fundus_info = detect_fundus_circle_relaxed(img_bgr)
+    fundus_ok = False
+    if fundus_info:
+        fundus_ok = (0.20 <= fundus_info["r_ratio"] <= 0.75) and (fundus_info["center_dist"] <= 1.2)
+    details["fundus"] = {"ok": fundus_ok, "info": fundus_info}
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    gray = cv2.equalizeHist(gray)
+    eyes = eye_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(20, 20))
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=3, minSize=(80, 80))
+    outer_ok = (len(eyes) > 0) or (len(faces) > 0)
+    details["outer"] = {"eyes": int(len(eyes)), "faces": int(len(faces)), "ok": outer_ok}
+    return bool(fundus_ok or outer_ok), details
+
+
+def _legacy_fundus_color(img_bgr, circle):
+    h, w = img_bgr.shape[:2]
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.circle(mask, (int(circle["x"]), int(circle["y"])), int(circle["r"]), 255, -1)
+    B, G, R = cv2.mean(img_bgr, mask=mask)[:3]
+    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
+    mean_h = cv2.mean(hsv[:, :, 0], mask=mask)[0]
+    mean_s = cv2.mean(hsv[:, :, 1], mask=mask)[0]
+    return bool((R > G + 15) and (R > B + 15) and (5 <= mean_h <= 35) and (mean_s >= 40))
+
+
+def legacy_strict_gate(img_bgr):
+    H, W = img_bgr.shape[:2]
+    details = {"decoded": True, "fundus": None, "outer": None}
+    fundus_info = detect_fundus_circle_relaxed(img_bgr)
+    fundus_ok = False
+    if fundus_info and fundus_geometry_ok(fundus_info):
+        fundus_ok = _legacy_fundus_color(img_bgr, fundus_info)
+    details["fundus"] = {"info": fundus_info, "ok": bool(fundus_ok)}
+    gray = cv2.equalizeHist(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY))
+    eyes = eye_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(18, 18))
+    total_eye_area_ratio = 0.0
+    pupil_ok = False
+    max_skin_ratio = 0.0
+    for (x, y, w, h) in eyes:
+        total_eye_area_ratio += (w * h) / float(W * H)
+        roi = img_bgr[max(0, y):min(H, y + h), max(0, x):min(W, x + w)]
+        if roi.size > 0:
+            max_skin_ratio = max(max_skin_ratio, skin_ratio_in_roi(roi))
+            if pupil_in_roi(roi):
+                pupil_ok = True
+    outer_ok = (len(eyes) > 0) and (total_eye_area_ratio >= 0.03) and (max_skin_ratio >= 0.08) and pupil_ok
+    details["outer"] = {"eyes": int(len(eyes)), "total_eye_area_ratio": float(total_eye_area_ratio),
+                        "max_skin_ratio": float(max_skin_ratio), "pupil_ok": bool(pupil_ok), "ok": bool(outer_ok)}
+    return bool(fundus_ok or outer_ok), details
+
+
+def make_gate(variant="relaxed", engine="fast"):
+    """The gate callable for PREDICT_GATE (relaxed | strict) and PREDICT_GATE_ENGINE (fast | legacy)."""
+    strict = variant == "strict"
+    if engine == "legacy":
+        return legacy_strict_gate if strict else legacy_relaxed_gate
+    return EyeGate(strict=strict)
+
+
+def regression_check(images, strict=False):
+    """images: iterable of (name, img_bgr). Returns mismatches between EyeGate and the legacy gate + timings."""
+    gate = EyeGate(strict=strict)
+    legacy = legacy_strict_gate if strict else legacy_relaxed_gate
+    mismatches, t_new, t_old, n = [], 0.0, 0.0, 0
+    for name, img in images:
+        t0 = time.perf_counter()
+        old, _ = legacy(img)
+        t1 = time.perf_counter()
+        new, details = gate(img)
+        t2 = time.perf_counter()
+        t_old += t1 - t0
+        t_new += t2 - t1
+        n += 1
+        if old != new:
+            mismatches.append({"image": name, "legacy": old, "engine": new, "decided_by": details["decided_by"]})
+    return {"images": n, "mismatches": mismatches,
+            "legacy_ms_mean": (t_old / n * 1000.0) if n else 0.0,
+            "engine_ms_mean": (t_new / n * 1000.0) if n else 0.0}
+
+
+if __name__ == "__main__":
+    from imaging import DecodedImage
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if not args:
+        raise SystemExit(__doc__)
+
+    def iter_images(root):
+        for dirpath, _, files in os.walk(root):
+            for name in sorted(files):
+                with open(os.path.join(dirpath, name), "rb") as f:
+                    decoded = DecodedImage.from_bytes(f.read())
+                if decoded is not None:
+                    yield os.path.join(dirpath, name), decoded.gate_bgr()
+
+    result = regression_check(iter_images(args[0]), strict="--strict" in sys.argv)
+    print(result)
+    sys.exit(1 if result["mismatches"] else 0)
@@ -0,0 +1,75 @@
+"""
+Multi-worker deployment:
+
+    gunicorn -c gunicorn.conf.py
+
+The master never imports server.py or TensorFlow (TF is not fork-safe once
+started, and server.py starts batcher threads at import). Before forking it:
+
+  - runs `inference.py --export` in a subprocess so every worker memory-maps the
+    same verified <model>.tflite files (PREDICT_BACKEND=tflite by default here;
+    set PREDICT_BACKEND=keras to give each worker its own Keras models instead);
+  - unpickles symptom_model.pkl and components.pkl once (vectorizer vocabulary,
+    label encoder) and freezes them, so workers share them copy-on-write
+    (skipped when a fresh models/symptom_export exists: workers memory-map it).
+
+Each worker then calls server:create_app(). GET /api/memory on any worker shows
+RSS/PSS per worker and in total.
+
+New model versions (registry.py) are rolled out without restarting: point
+models/CURRENT at the version (or POST /api/models/reload with its name to any
+worker, which does that), and each worker's watcher loads, warms and swaps it
+within PREDICT_MODEL_WATCH_S seconds.
+
+Environment: PORT, WEB_CONCURRENCY (workers), PREDICT_GUNICORN_THREADS,
+PREDICT_GUNICORN_TIMEOUT, PREDICT_MODEL_DIR, plus the usual PREDICT_* settings.
+"""
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+import prefork  # noqa: E402  (light: no TensorFlow)
+import registry  # noqa: E402
+import symptom_export  # noqa: E402
+
+MODEL_DIR = os.environ.get("PREDICT_MODEL_DIR") or os.path.join(BASE_DIR, "models")
+
+os.environ.setdefault("PREDICT_APP_FACTORY", "1")
+os.environ.setdefault("PREDICT_BACKEND", "tflite")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+wsgi_app = "server:create_app()"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+# threads let the micro-batcher group concurrent requests inside a worker
+worker_class = "gthread"
+threads = int(os.environ.get("PREDICT_GUNICORN_THREADS", "4"))
+timeout = int(os.environ.get("PREDICT_GUNICORN_TIMEOUT", "120"))
+# never preload server.py: the shared state is prepared in on_starting instead
+preload_app = False
+
+
+def on_starting(server):
+    # the thread budget (thread_budget.py) splits the usable CPUs between the workers
+    os.environ.setdefault("PREDICT_WORKERS", str(server.cfg.workers))
+    backend = os.environ.get("PREDICT_BACKEND", "keras").lower()
+    variant = os.environ.get("PREDICT_MODEL_VARIANT", "float32").lower()
+    # the version being served now; later reloads load (and verify) their own files in each worker
+    version = registry.current_version(MODEL_DIR)
+    if backend == "tflite" and variant == "float32":
+        if prefork.export_tflite_models(version.directory):
+            os.environ["PREDICT_TFLITE_VERIFIED"] = "1"
+        else:
+            server.log.warning("TFLite export/parity failed; workers fall back to per-worker Keras models")
+            os.environ["PREDICT_BACKEND"] = "keras"
+    pickles = [version.path("symptom_model.pkl"), version.path("components.pkl")]
+    if (os.environ.get("PREDICT_SYMPTOM_FORMAT", "auto").lower() != "pickle"
+            and symptom_export.is_fresh(version.path("symptom_export"), pickles)):
+        pickles = []  # workers memory-map models/symptom_export instead
+    info = prefork.preload_pickles(pickles)
+    server.log.info("Preloaded before fork: %s", info)
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s memory after init: %s", worker.pid, prefork.process_memory())
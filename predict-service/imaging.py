@@ -0,0 +1,240 @@
+import io
+import math
+
+import numpy as np
+from PIL import Image
+import cv2
+
+IMG_SIZE = 224
+GATE_MAX_SIDE = 640
+EXIF_ORIENTATION = 0x0112
+
+# Checked against the header before any pixels are decoded (a 12MP phone photo is ~12e6)
+MAX_IMAGE_PIXELS = 50_000_000
+MAX_IMAGE_SIDE = 16384
+
+
+class ImageTooLarge(ValueError):
+    """The header declares dimensions beyond the configured limits (oversized or decompression bomb)."""
+
+
+def check_dimensions(width, height, max_pixels=MAX_IMAGE_PIXELS, max_side=MAX_IMAGE_SIDE):
+    if max_side and max(width, height) > max_side:
+        raise ImageTooLarge(f"Image is {width}x{height}; the longest side may be at most {max_side}px")
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"Image is {width}x{height} ({width * height} pixels); at most {max_pixels} allowed")
+
+
+def draft_size(width, height, gate_max_side=GATE_MAX_SIDE, img_size=IMG_SIZE):
+    """
+    Smallest size the decoded image must keep so that both derived images
+    (gate: longest side gate_max_side, model: img_size x img_size) are still
+    produced by downscaling. None if no reduction is possible.
+    """
+    scale = max(gate_max_side / max(width, height), img_size / min(width, height))
+    if scale >= 0.5:  # JPEG DCT scaling only goes down by 1/2, 1/4, 1/8
+        return None
+    return max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))
+
+
+def _apply_orientation(img, orientation):
+    # Same result as cv2.imdecode's EXIF handling; applied before the gate resize, as cv2 does
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(img), -1)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+
+# 16-bit (and 32-bit integer) grayscale; convert("RGB") would clip these at 255 instead of scaling
+HIGH_BIT_DEPTH_MODES = ("I;16", "I;16L", "I;16B", "I")
+
+
+def _to_8bit(im):
+    # keep the high byte, as cv2.imdecode does for 16-bit images
+    pixels = np.clip(np.asarray(im), 0, 65535).astype(np.uint16)
+    return Image.fromarray((pixels >> 8).astype(np.uint8), "L")
+
+
+class DecodedImage:
+    """
+    An upload decoded exactly once. The eye gate (BGR, max 640px) and the model
+    input (1, 224, 224, 3) float32 are both derived from the same decoded pixels
+    and cached, so later stages can reuse them without touching the bytes again.
+
+    from_bytes() reads the dimensions from the header first and refuses
+    oversized images before allocating pixels. With draft=True, JPEGs are
+    decoded in the DCT domain at 1/2, 1/4 or 1/8 scale, just above what the
+    gate and the model need, instead of at full resolution; the pixels then
+    differ slightly from a full decode, which can change gate decisions.
+    """
+
+    def __init__(self, im, orientation=1, size=None):
+        self.im = im  # PIL RGB image, native resolution or a JPEG draft reduction of it
+        self.orientation = orientation
+        self.width, self.height = size or im.size  # native (header) size
+        self.draft_scale = im.size[0] / float(self.width)
+        self._gate = {}
+        self._model = {}
+
+    @classmethod
+    def from_bytes(cls, file_bytes, draft=False, max_pixels=MAX_IMAGE_PIXELS, max_side=MAX_IMAGE_SIDE,
+                   gate_max_side=GATE_MAX_SIDE, img_size=IMG_SIZE):
+        """
+        Decode bytes -> DecodedImage, or None if the data is not a decodable image.
+        Raises ImageTooLarge if the header declares dimensions over the limits.
+        """
+        try:
+            im = Image.open(io.BytesIO(file_bytes))
+        except Image.DecompressionBombError as e:
+            raise ImageTooLarge(str(e)) from e
+        except Exception:
+            return None
+        size = im.size
+        check_dimensions(size[0], size[1], max_pixels, max_side)
+        try:
+            try:
+                orientation = int(im.getexif().get(EXIF_ORIENTATION, 1))
+            except Exception:
+                orientation = 1
+            if draft and im.format == "JPEG":
+                target = draft_size(size[0], size[1], gate_max_side, img_size)
+                if target is not None:
+                    im.draft(im.mode, target)
+            im.load()
+            if im.mode in HIGH_BIT_DEPTH_MODES:
+                im = _to_8bit(im)
+            if im.mode != "RGB":
+                im = im.convert("RGB")
+        except Exception:
+            return None
+        return cls(im, orientation, size)
+
+    def gate_bgr(self, max_side=GATE_MAX_SIDE):
+        """BGR uint8, EXIF-oriented, downscaled with INTER_AREA (matches cv2.imdecode + resize)."""
+        img = self._gate.get(max_side)
+        if img is None:
+            # orient first: INTER_AREA rounds differently on a flipped grid, and the
+            # gate must see exactly what cv2.imdecode + resize gave it
+            rgb = _apply_orientation(np.asarray(self.im), self.orientation)
+            # output size always follows the native dimensions, whatever the draft reduction was
+            h, w = (self.width, self.height) if self.orientation in (5, 6, 7, 8) else (self.height, self.width)
+            scale = min(1.0, float(max_side) / max(h, w))
+            size = (int(w * scale), int(h * scale))
+            if size != (rgb.shape[1], rgb.shape[0]):
+                rgb = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+            img = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+            self._gate[max_side] = img
+        return img
+
+    def model_input(self, img_size=IMG_SIZE):
+        """(1, img_size, img_size, 3) float32 in [0, 1]; resized straight from the decoded image."""
+        x = self._model.get(img_size)
+        if x is None:
+            small = self.im.resize((img_size, img_size), Image.BILINEAR)
+            x = np.empty((1, img_size, img_size, 3), dtype=np.float32)
+            np.divide(np.asarray(small), np.float32(255.0), out=x[0])
+            self._model[img_size] = x
+        return x
+
+
+class TensorFormatError(ValueError):
+    """A raw tensor upload whose shape / dtype headers do not match what is accepted or the body length."""
+
+
+def parse_shape(text, what="X-Tensor-Shape"):
+    """Header value "224,224,3" -> (224, 224, 3); raises TensorFormatError."""
+    try:
+        shape = tuple(int(p) for p in (text or "").replace("x", ",").split(","))
+    except ValueError:
+        shape = ()
+    if len(shape) != 3 or min(shape) < 1:
+        raise TensorFormatError(f"{what} must be height,width,channels (got {text!r})")
+    return shape
+
+
+class RawImage:
+    """
+    Pixels uploaded as raw uint8 RGB arrays (row-major height x width x 3), no
+    image codec involved: the model-size image and optionally a larger gate
+    thumbnail (without one the gate runs on the model image). Same interface as
+    DecodedImage (gate_bgr, model_input, width / height); the arrays are views
+    of the request body, nothing is copied until the gate / model inputs are built.
+    """
+
+    def __init__(self, model_rgb, gate_rgb=None):
+        self.model_rgb = model_rgb
+        self.gate_rgb = gate_rgb if gate_rgb is not None else model_rgb
+        self.height, self.width = self.gate_rgb.shape[:2]
+        self._gate = {}
+        self._model = {}
+
+    @staticmethod
+    def expected_bytes(shape, dtype="uint8", gate_shape=None, img_size=IMG_SIZE, gate_max_side=GATE_MAX_SIDE):
+        """
+        Body length for these headers (checked before the body is read). Raises
+        TensorFormatError unless shape is (img_size, img_size, 3) uint8 and the
+        thumbnail is RGB with its longest side at most gate_max_side.
+        """
+        if (dtype or "uint8").lower() != "uint8":
+            raise TensorFormatError(f"Only uint8 tensors are accepted (got {dtype!r})")
+        if tuple(shape) != (img_size, img_size, 3):
+            raise TensorFormatError(f"Expected a {img_size},{img_size},3 RGB tensor (got {shape})")
+        if gate_shape is not None and (gate_shape[2] != 3 or max(gate_shape[:2]) > gate_max_side):
+            raise TensorFormatError(f"The gate thumbnail must be RGB with its longest side at most "
+                                    f"{gate_max_side}px (got {gate_shape})")
+        return int(np.prod(shape)) + (int(np.prod(gate_shape)) if gate_shape is not None else 0)
+
+    @classmethod
+    def from_buffer(cls, body, shape, dtype="uint8", gate_shape=None, img_size=IMG_SIZE,
+                    gate_max_side=GATE_MAX_SIDE):
+        """body holds the model image, then the gate thumbnail if gate_shape is given."""
+        expected = cls.expected_bytes(shape, dtype, gate_shape, img_size, gate_max_side)
+        if len(body) != expected:
+            raise TensorFormatError(f"Body is {len(body)} bytes; the shape headers describe {expected}")
+        pixels = np.frombuffer(body, dtype=np.uint8)
+        n_model = int(np.prod(shape))
+        gate = pixels[n_model:].reshape(gate_shape) if gate_shape is not None else None
+        return cls(pixels[:n_model].reshape(shape), gate)
+
+    def gate_bgr(self, max_side=GATE_MAX_SIDE):
+        """BGR uint8, downscaled with INTER_AREA if the gate image is larger than max_side."""
+        img = self._gate.get(max_side)
+        if img is None:
+            rgb = self.gate_rgb
+            h, w = rgb.shape[:2]
+            scale = min(1.0, float(max_side) / max(h, w))
+            if scale < 1.0:
+                rgb = cv2.resize(rgb, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+            img = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+            self._gate[max_side] = img
+        return img
+
+    def model_input(self, img_size=IMG_SIZE):
+        """(1, img_size, img_size, 3) float32 in [0, 1]."""
+        x = self._model.get(img_size)
+        if x is None:
+            rgb = self.model_rgb
+            if rgb.shape[:2] != (img_size, img_size):
+                rgb = cv2.resize(rgb, (img_size, img_size), interpolation=cv2.INTER_LINEAR)
+            x = np.empty((1, img_size, img_size, 3), dtype=np.float32)
+            np.divide(rgb, np.float32(255.0), out=x[0])
+            self._model[img_size] = x
+        return x
+
+
+def as_decoded(image, **decode_options):
+    """Accept raw bytes, a DecodedImage or a RawImage; returns it decoded or None (options go to from_bytes)."""
+    if image is None or isinstance(image, (DecodedImage, RawImage)):
+        return image
+    return DecodedImage.from_bytes(image, **decode_options)
@@ -0,0 +1,222 @@
+import os
+import sys
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+IMG_SIZE = 224
+BACKENDS = ("keras", "tf_function", "xla", "tflite")
+
+
+class KerasBackend:
+    """Current behaviour: tf.keras.Model.predict (batching loop, callbacks, per-call overhead)."""
+
+    name = "keras"
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, batch):
+        return self.model.predict(batch, verbose=0)
+
+
+class TFFunctionBackend:
+    """Model call traced once as a tf.function with a fixed (None, 224, 224, 3) signature, optionally XLA-compiled."""
+
+    def __init__(self, model, img_size=IMG_SIZE, jit_compile=False):
+        self.model = model
+        self.name = "xla" if jit_compile else "tf_function"
+        spec = tf.TensorSpec([None, img_size, img_size, 3], tf.float32)
+        self._fn = tf.function(lambda x: model(x, training=False), input_signature=[spec],
+                               jit_compile=jit_compile, reduce_retracing=True)
+
+    def predict(self, batch):
+        return self._fn(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+
+
+def export_tflite(model, out_path=None, optimizations=None, representative_dataset=None,
+                  supported_types=None, int8_io=False):
+    """Convert a Keras model to a TFLite flatbuffer; writes out_path if given. Returns the bytes."""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if optimizations:
+        converter.optimizations = optimizations
+    if representative_dataset is not None:
+        converter.representative_dataset = representative_dataset
+    if supported_types:
+        converter.target_spec.supported_types = supported_types
+    if int8_io:
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+    data = converter.convert()
+    if out_path:
+        tmp = out_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, out_path)
+    return data
+
+
+class TFLiteBackend:
+    """
+    TFLite interpreter over a flatbuffer exported from the Keras model.
+    The interpreter is not thread-safe, so calls are serialised; the input tensor
+    is only resized (and re-allocated) when the batch size changes.
+    Given model_path instead of model_content, the flatbuffer is memory-mapped,
+    so processes serving the same file share one copy of the weights.
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_content=None, num_threads=None, model_path=None):
+        if model_path is not None:
+            self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        else:
+            self.interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._in = self.interpreter.get_input_details()[0]
+        self._out = self.interpreter.get_output_details()[0]
+        self._batch = int(self._in["shape"][0])
+        self._lock = threading.Lock()
+
+    def _quantize_in(self, batch):
+        if self._in["dtype"] == np.float32:
+            return batch.astype(np.float32, copy=False)
+        scale, zero = self._in["quantization"]
+        info = np.iinfo(self._in["dtype"])
+        q = np.round(batch / scale + zero)
+        return np.clip(q, info.min, info.max).astype(self._in["dtype"])
+
+    def _dequantize_out(self, out):
+        if self._out["dtype"] == np.float32:
+            return out
+        scale, zero = self._out["quantization"]
+        return (out.astype(np.float32) - zero) * scale
+
+    def predict(self, batch):
+        batch = np.asarray(batch)
+        with self._lock:
+            if batch.shape[0] != self._batch:
+                self.interpreter.resize_tensor_input(self._in["index"], list(batch.shape))
+                self.interpreter.allocate_tensors()
+                self._in = self.interpreter.get_input_details()[0]
+                self._out = self.interpreter.get_output_details()[0]
+                self._batch = batch.shape[0]
+            self.interpreter.set_tensor(self._in["index"], self._quantize_in(batch))
+            self.interpreter.invoke()
+            return self._dequantize_out(self.interpreter.get_tensor(self._out["index"]).copy())
+
+
+def tflite_path_for(model_path, suffix=""):
+    return os.path.splitext(model_path)[0] + suffix + ".tflite"
+
+
+def fresh_tflite_path(model_path, suffix=""):
+    """<model><suffix>.tflite if it exists and is not older than the .keras file, else None."""
+    path = tflite_path_for(model_path, suffix)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(model_path):
+        return path
+    return None
+
+
+def load_tflite_content(model, model_path):
+    """Reuse <model>.tflite next to the .keras file if it is newer; otherwise export (and try to save) it."""
+    path = fresh_tflite_path(model_path)
+    if path is not None:
+        with open(path, "rb") as f:
+            return f.read()
+    try:
+        return export_tflite(model, tflite_path_for(model_path))
+    except OSError:
+        return export_tflite(model)
+
+
+def variant_path(model_path, variant):
+    """Path of a quantized <model>_<variant>.tflite produced by quantize.py."""
+    path = tflite_path_for(model_path, "_" + variant)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run quantize.py to create it")
+    return path
+
+
+def make_backend(kind, model, model_path=None, num_threads=None, variant="float32"):
+    kind = (kind or "keras").lower()
+    if variant and variant != "float32":
+        # quantized variants only exist as TFLite flatbuffers
+        backend = TFLiteBackend(model_path=variant_path(model_path, variant), num_threads=num_threads)
+        backend.name = f"tflite_{variant}"
+        return backend
+    if kind == "keras":
+        return KerasBackend(model)
+    if kind == "tf_function":
+        return TFFunctionBackend(model)
+    if kind == "xla":
+        return TFFunctionBackend(model, jit_compile=True)
+    if kind == "tflite":
+        if not model_path:
+            return TFLiteBackend(export_tflite(model), num_threads=num_threads)
+        content = None
+        if fresh_tflite_path(model_path) is None:
+            content = load_tflite_content(model, model_path)
+        path = fresh_tflite_path(model_path)
+        if path is not None:  # saved next to the .keras file: memory-map it
+            return TFLiteBackend(model_path=path, num_threads=num_threads)
+        return TFLiteBackend(content, num_threads=num_threads)
+    raise ValueError(f"Unknown inference backend '{kind}' (choose from {', '.join(BACKENDS)})")
+
+
+def parity_check(reference, candidate, batch, k=3, atol=1e-3):
+    """
+    Compare candidate.predict against reference.predict on the same batch.
+    ok means every row has the same top-k labels in the same order (a swap is
+    tolerated only between classes whose reference scores tie within atol)
+    and all top-k scores agree within atol.
+    """
+    ref = np.asarray(reference.predict(batch), dtype=np.float64)
+    out = np.asarray(candidate.predict(batch), dtype=np.float64)
+    ref_top = np.argsort(ref, axis=1)[:, ::-1][:, :k]
+    out_top = np.argsort(out, axis=1)[:, ::-1][:, :k]
+    rows = np.arange(len(ref))[:, None]
+    tied = np.abs(ref[rows, ref_top] - ref[rows, out_top]) <= atol
+    order_match = np.all((ref_top == out_top) | tied, axis=1)
+    score_diff = np.abs(ref[rows, ref_top] - out[rows, ref_top]).max(axis=1)
+    return {
+        "backend": candidate.name,
+        "images": int(len(ref)),
+        "topk": k,
+        "topk_order_match": int(order_match.sum()),
+        "max_topk_abs_diff": float(score_diff.max()) if len(ref) else 0.0,
+        "ok": bool(order_match.all() and (score_diff <= atol).all()),
+    }
+
+
+def parity_batch(n=8, img_size=IMG_SIZE, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((n, img_size, img_size, 3), dtype=np.float32)
+
+
+if __name__ == "__main__":
+    # python inference.py [backend ...]  -> parity of each backend vs keras predict for both models
+    # python inference.py --export       -> write fresh <model>.tflite files and check their parity
+    # --models-dir DIR: another directory than models/ (a models/versions/<version>)
+    base = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+    args = sys.argv[1:]
+    if "--models-dir" in args:
+        i = args.index("--models-dir")
+        base = args[i + 1]
+        del args[i:i + 2]
+    if "--export" in args:
+        args = ["tflite"]
+    kinds = args or [b for b in BACKENDS if b != "keras"]
+    batch = parity_batch()
+    failed = False
+    for name in ("fundus_mnv2", "outer_mnv2"):
+        path = os.path.join(base, name + ".keras")
+        model = tf.keras.models.load_model(path, compile=False)
+        ref = KerasBackend(model)
+        for kind in kinds:
+            result = parity_check(ref, make_backend(kind, model, path), batch)
+            failed = failed or not result["ok"]
+            print(name, result)
+    sys.exit(1 if failed else 0)
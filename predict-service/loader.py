@@ -0,0 +1,80 @@
+import threading
+import time
+import traceback
+
+
+class Component:
+    """
+    A lazily loaded, optionally warmed-up piece of server state (a model, a vectorizer...).
+
+    load() is idempotent and thread-safe: the first caller runs load_fn (then
+    warmup_fn), concurrent callers block until it finishes, and later callers get
+    the cached value. start() does the same on a background thread.
+    """
+
+    def __init__(self, name, load_fn, warmup_fn=None):
+        self.name = name
+        self.load_fn = load_fn
+        self.warmup_fn = warmup_fn
+        self.state = "pending"  # pending | loading | warming | ready | failed
+        self.value = None
+        self.error = None
+        self.load_s = None
+        self.warmup_s = None
+        self.info = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def load(self):
+        if self.state == "ready":
+            return self.value
+        with self._lock:
+            if self.state == "ready":
+                return self.value
+            if self.state == "failed":
+                raise RuntimeError(f"{self.name} failed to load: {self.error}")
+            try:
+                self.state = "loading"
+                t0 = time.perf_counter()
+                value = self.load_fn()
+                self.load_s = time.perf_counter() - t0
+                if self.warmup_fn is not None:
+                    self.state = "warming"
+                    t0 = time.perf_counter()
+                    self.warmup_fn(value)
+                    self.warmup_s = time.perf_counter() - t0
+                self.value = value
+                self.state = "ready"
+            except Exception as e:
+                self.state = "failed"
+                self.error = f"{type(e).__name__}: {e}"
+                self.info["traceback"] = traceback.format_exc()
+                raise RuntimeError(f"{self.name} failed to load: {self.error}") from e
+        return self.value
+
+    get = load
+
+    def start(self):
+        """Load in a background thread (no-op if already started or loaded)."""
+        with self._lock:
+            if self._thread is not None or self.state != "pending":
+                return
+            self._thread = threading.Thread(target=self._load_quietly, name=f"load-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _load_quietly(self):
+        try:
+            self.load()
+        except RuntimeError:
+            pass  # recorded in state / error
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def status(self):
+        out = {"state": self.state, "load_s": self.load_s, "warmup_s": self.warmup_s}
+        if self.error:
+            out["error"] = self.error
+        out.update({k: v for k, v in self.info.items() if k != "traceback"})
+        return out
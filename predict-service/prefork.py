@@ -0,0 +1,147 @@
+"""
+Pre-fork sharing for multi-worker (gunicorn) deployments.
+
+TensorFlow is not fork-safe once its runtime has started, so the gunicorn
+master never imports server.py or TensorFlow. Instead, before the workers
+are forked it:
+
+  - exports / verifies the .tflite flatbuffers in a subprocess, so workers can
+    memory-map the same weight files (one copy in the page cache for all of them);
+  - unpickles the symptom model and components.pkl (vectorizer vocabulary,
+    label encoder, class lists) and freezes them out of the garbage collector,
+    so workers inherit them copy-on-write instead of loading their own copies.
+
+memory_report() reads /proc to show what each process really costs (PSS
+splits shared pages between the processes that map them).
+"""
+import gc
+import os
+import pickle
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SHARED = {}  # absolute path -> object unpickled in the master
+MASTER_PID = None
+PRELOAD_INFO = {}
+
+
+def preload_pickles(paths):
+    """Unpickle read-only state in the master, then gc.freeze() it so collections in workers don't dirty its pages."""
+    global MASTER_PID
+    t0 = time.perf_counter()
+    for path in paths:
+        with open(path, "rb") as f:
+            SHARED[os.path.abspath(path)] = pickle.load(f)
+    gc.collect()
+    gc.freeze()
+    MASTER_PID = os.getpid()
+    PRELOAD_INFO.update({"pickles": [os.path.basename(p) for p in paths],
+                         "preload_s": round(time.perf_counter() - t0, 3), "master_pid": MASTER_PID})
+    return PRELOAD_INFO
+
+
+def load_pickle(path):
+    """The object preloaded by the master if there is one, else unpickle it now."""
+    obj = SHARED.get(os.path.abspath(path))
+    if obj is not None:
+        return obj
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def export_tflite_models(model_dir=None, timeout_s=900):
+    """
+    Run `python inference.py --export` in a subprocess (TensorFlow never starts in the
+    master). Returns True if every model's .tflite is fresh and passed the parity check.
+    """
+    t0 = time.perf_counter()
+    cmd = [sys.executable, os.path.join(BASE_DIR, "inference.py"), "--export"]
+    if model_dir:
+        cmd += ["--models-dir", model_dir]
+    proc = subprocess.run(cmd, cwd=BASE_DIR, capture_output=True, text=True, timeout=timeout_s)
+    if proc.stdout:
+        print(proc.stdout, end="", file=sys.stderr)
+    if proc.returncode != 0:
+        print(proc.stderr[-4000:], file=sys.stderr)
+    sys.stderr.flush()
+    PRELOAD_INFO.update({"tflite_export_s": round(time.perf_counter() - t0, 3),
+                         "tflite_verified": proc.returncode == 0})
+    return proc.returncode == 0
+
+
+# -----------------------------
+# Memory reporting (Linux /proc)
+# -----------------------------
+_SMAPS_FIELDS = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared_clean", "Shared_Dirty": "shared_dirty",
+                 "Private_Clean": "private_clean", "Private_Dirty": "private_dirty", "Swap": "swap"}
+
+
+def process_memory(pid=None):
+    """{rss_mb, pss_mb, shared_*_mb, private_*_mb, swap_mb} for one process, or None if unavailable."""
+    pid = pid or os.getpid()
+    out = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                key = _SMAPS_FIELDS.get(parts[0].rstrip(":"))
+                if key and len(parts) >= 2:
+                    out[key + "_mb"] = round(int(parts[1]) / 1024.0, 1)
+    except OSError:
+        # older kernels: RSS only
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        out["rss_mb"] = round(int(line.split()[1]) / 1024.0, 1)
+        except OSError:
+            return None
+    return out or None
+
+
+def child_pids(parent_pid):
+    pids = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return pids
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # "pid (comm) state ppid ..." -- comm may contain spaces
+        fields = stat[stat.rfind(")") + 2:].split()
+        if len(fields) > 1 and int(fields[1]) == parent_pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def memory_report():
+    """
+    This process, and when running under a preloading master, the master and
+    every sibling worker. total_pss_mb is the real footprint of the deployment
+    (RSS double-counts pages shared between workers).
+    """
+    me = os.getpid()
+    report = {"pid": me, "self": process_memory(me)}
+    if MASTER_PID and MASTER_PID != me:
+        workers = {str(pid): process_memory(pid) for pid in child_pids(MASTER_PID)}
+        workers = {pid: m for pid, m in workers.items() if m}
+        master = process_memory(MASTER_PID)
+        procs = list(workers.values()) + ([master] if master else [])
+        report.update({
+            "master_pid": MASTER_PID,
+            "master": master,
+            "workers": workers,
+            "total_rss_mb": round(sum(m.get("rss_mb", 0.0) for m in procs), 1),
+            "total_pss_mb": round(sum(m.get("pss_mb", 0.0) for m in procs), 1),
+        })
+    report["preload"] = dict(PRELOAD_INFO)
+    return report
@@ -0,0 +1,240 @@
+"""
+Opt-in sampling profiler for production requests (PREDICT_PROFILE=1).
+
+A profiled request gets a sampler thread that records the stacks of the threads
+working on it (sys._current_frames() every PREDICT_PROFILE_INTERVAL_MS) until it
+finishes. OpenCV and TensorFlow release the GIL, so time inside a native call
+(HoughCircles, detectMultiScale, a forward pass) shows up as samples on the
+Python line that made the call; the leaf label includes that line's source.
+
+Which requests: a fraction of them (PREDICT_PROFILE_RATE, 0..1), plus any request
+sent with "X-Debug-Profile: 1" when the caller is allowed to ask (server.py: only
+with PREDICT_ADMIN_TOKEN set and sent as X-Admin-Token). Each profile is a JSON file in PREDICT_PROFILE_DIR
+(oldest removed beyond PREDICT_PROFILE_MAX_FILES / _MAX_BYTES) holding the
+folded stacks (flamegraph.pl / speedscope format), the hottest leaf frames, the
+request's stage timings and image dimensions. Never the image or symptom text.
+"""
+import json
+import linecache
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+_local = threading.local()
+MAX_DEPTH = 64
+
+
+def current():
+    """The profile the calling thread is attached to, or None."""
+    return getattr(_local, "profile", None)
+
+
+def annotate(**fields):
+    """Add request metadata (image size, type...) to the current profile, if any."""
+    profile = current()
+    if profile is not None:
+        profile.meta.update(fields)
+
+
+def _label(frame, leaf=False):
+    code = frame.f_code
+    label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+    if leaf:
+        line = linecache.getline(code.co_filename, frame.f_lineno).strip()
+        if line:
+            label += " " + line[:80]
+    return label.replace(";", ",")
+
+
+def fold(frame):
+    """root;...;leaf for one stack (innermost MAX_DEPTH frames)."""
+    labels = [_label(frame, leaf=True)]
+    frame = frame.f_back
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class RequestProfile:
+    def __init__(self, endpoint, reason, interval_s):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{endpoint}-{uuid.uuid4().hex[:8]}"
+        self.endpoint = endpoint
+        self.reason = reason
+        self.interval_s = interval_s
+        self.meta = {}
+        self.timer = None  # the request's StageTimer and response status, set by the handler
+        self.status = None
+        self.samples = Counter()
+        self.sample_count = 0
+        self._threads = {}  # thread id -> attach count
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name=f"profile-{self.id}", daemon=True)
+        self._sampler.start()
+
+    @contextmanager
+    def attach(self):
+        """Sample the calling thread (and make it current()) for the duration of the block."""
+        previous = current()
+        _local.profile = self
+        try:
+            with self.include(threading.get_ident()):
+                yield self
+        finally:
+            _local.profile = previous
+
+    @contextmanager
+    def include(self, tid):
+        """Also sample another thread (e.g. the batcher running this request's forward pass) meanwhile."""
+        if tid is None:
+            yield self
+            return
+        with self._lock:
+            self._threads[tid] = self._threads.get(tid, 0) + 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._threads[tid] -= 1
+                if not self._threads[tid]:
+                    del self._threads[tid]
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            with self._lock:
+                tids = [t for t in self._threads if t != own]
+            frames = sys._current_frames()
+            for tid in tids:
+                frame = frames.get(tid)
+                if frame is not None:
+                    self.samples[fold(frame)] += 1
+                    self.sample_count += 1
+            del frames
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        return time.perf_counter() - self.started
+
+    def report(self, wall_s):
+        leaves = Counter()
+        for stack, n in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += n
+        total = max(1, self.sample_count)
+        return {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "reason": self.reason,
+            "status": self.status,
+            "created_at": time.time(),
+            "wall_ms": round(wall_s * 1000.0, 2),
+            "interval_ms": self.interval_s * 1000.0,
+            "samples": self.sample_count,
+            "stages_ms": [[name, round(s * 1000.0, 3)] for name, s in (self.timer.stages if self.timer else [])],
+            "request": self.meta,
+            "top_leaf_frames": [{"frame": f, "samples": n, "pct": round(100.0 * n / total, 1)}
+                                for f, n in leaves.most_common(20)],
+            "folded": dict(self.samples.most_common()),
+        }
+
+
+class Profiler:
+    """Decides which requests to profile and keeps their reports in a bounded directory."""
+
+    header = "x-debug-profile"
+
+    def __init__(self, directory, rate=0.0, interval_ms=5.0, max_files=200, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.rate = max(0.0, min(1.0, float(rate)))
+        self.interval_s = max(0.0005, float(interval_ms) / 1000.0)
+        self.max_files = max(1, int(max_files))
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self.started = 0
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self, endpoint, headers, allow_header=True):
+        """A RequestProfile if this request is to be profiled, else None."""
+        if allow_header and (headers.get(self.header) or "").lower() in ("1", "true", "yes"):
+            reason = "header"
+        elif self.rate and random.random() < self.rate:
+            reason = "sampled"
+        else:
+            return None
+        with self._lock:
+            self.started += 1
+        return RequestProfile(endpoint, reason, self.interval_s)
+
+    def finish(self, profile):
+        """Stop sampling and write the report; returns its id."""
+        report = profile.report(profile.stop())
+        path = os.path.join(self.directory, profile.id + ".json")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(report, f)
+        os.replace(tmp, path)
+        with self._lock:
+            self.written += 1
+            self._trim()
+        return profile.id
+
+    def _entries(self):
+        out = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                out.append((st.st_mtime, name[:-5], st.st_size))
+        return sorted(out, reverse=True)
+
+    def _trim(self):
+        total = 0
+        for i, (_, pid, size) in enumerate(self._entries()):
+            total += size
+            if i >= self.max_files or total > self.max_bytes:
+                try:
+                    os.remove(os.path.join(self.directory, pid + ".json"))
+                except OSError:
+                    pass
+
+    def list(self, limit=100):
+        """Newest first: id, size and a summary of each stored profile."""
+        out = []
+        for mtime, pid, size in self._entries()[:limit]:
+            item = {"id": pid, "bytes": size, "created_at": mtime}
+            try:
+                with open(os.path.join(self.directory, pid + ".json")) as f:
+                    report = json.load(f)
+                item.update({k: report.get(k) for k in ("endpoint", "reason", "status", "wall_ms", "samples")})
+                top = report.get("top_leaf_frames") or []
+                item["top_frame"] = top[0]["frame"] if top else None
+            except (OSError, ValueError):
+                pass
+            out.append(item)
+        return out
+
+    def load(self, profile_id):
+        """The stored report, or None (also for ids that are not plain profile names)."""
+        if not profile_id or os.path.basename(profile_id) != profile_id or profile_id.startswith("."):
+            return None
+        try:
+            with open(os.path.join(self.directory, profile_id + ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def stats(self):
+        return {"directory": self.directory, "rate": self.rate, "interval_ms": self.interval_s * 1000.0,
+                "max_files": self.max_files, "max_bytes": self.max_bytes, "started": self.started,
+                "written": self.written, "stored": len(self._entries())}
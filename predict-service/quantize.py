@@ -0,0 +1,168 @@
+"""
+Post-training quantization for the fundus / outer-eye models.
+
+    python quantize.py --calib path/to/images --eval path/to/other/images [--variants dynamic float16 int8]
+
+Writes models/<name>_<variant>.tflite for each variant and a comparison report
+(models/quantization_report.json) against the float32 Keras models: top-1
+agreement, confidence drift, per-image latency and file size. Agreement is
+measured on --eval, held-out images the int8 calibration has not seen. The
+server only serves a variant (PREDICT_MODEL_VARIANT) whose report entry meets
+its top-1 agreement guardrail. Variants not in --variants keep their entries
+from earlier runs.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from imaging import IMG_SIZE, DecodedImage
+from inference import KerasBackend, TFLiteBackend, export_tflite, tflite_path_for
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, "models")
+MODEL_NAMES = ("fundus_mnv2", "outer_mnv2")
+VARIANTS = ("dynamic", "float16", "int8")
+REPORT_PATH = os.path.join(MODEL_DIR, "quantization_report.json")
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+
+def load_image_dir(path, limit=None, img_size=IMG_SIZE):
+    """Decode every image under path into one (N, H, W, 3) float32 array (model preprocessing)."""
+    xs = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if not name.lower().endswith(IMAGE_EXTS):
+                continue
+            with open(os.path.join(root, name), "rb") as f:
+                decoded = DecodedImage.from_bytes(f.read())
+            if decoded is not None:
+                xs.append(decoded.model_input(img_size))
+            if limit and len(xs) >= limit:
+                return np.concatenate(xs, axis=0)
+    if not xs:
+        raise SystemExit(f"No decodable images found under {path}")
+    return np.concatenate(xs, axis=0)
+
+
+def convert(model, variant, calib):
+    if variant == "dynamic":
+        return export_tflite(model, optimizations=[tf.lite.Optimize.DEFAULT])
+    if variant == "float16":
+        return export_tflite(model, optimizations=[tf.lite.Optimize.DEFAULT], supported_types=[tf.float16])
+    if variant == "int8":
+        def representative_dataset():
+            for i in range(len(calib)):
+                yield [calib[i:i + 1]]
+        return export_tflite(model, optimizations=[tf.lite.Optimize.DEFAULT],
+                             representative_dataset=representative_dataset, int8_io=True)
+    raise ValueError(f"Unknown variant '{variant}'")
+
+
+def latency_ms(backend, x, repeats=3):
+    # per-image latency at batch size 1 (the /api/predict hot path); median over images x repeats
+    backend.predict(x[:1])
+    times = []
+    for _ in range(repeats):
+        for i in range(len(x)):
+            t0 = time.perf_counter()
+            backend.predict(x[i:i + 1])
+            times.append((time.perf_counter() - t0) * 1000.0)
+    return float(np.median(times)), float(np.percentile(times, 95))
+
+
+def compare(ref_probs, probs):
+    ref_top = ref_probs.argmax(axis=1)
+    top = probs.argmax(axis=1)
+    rows = np.arange(len(ref_probs))
+    drift = np.abs(probs[rows, ref_top] - ref_probs[rows, ref_top])
+    return {
+        "images": int(len(ref_probs)),
+        "top1_agreement": float((ref_top == top).mean()),
+        "confidence_drift_mean": float(drift.mean()),
+        "confidence_drift_max": float(drift.max()),
+        "prob_abs_diff_mean": float(np.abs(probs - ref_probs).mean()),
+    }
+
+
+def check_variant(name, variant, keras_path, min_agreement=0.98, max_drift=0.05, report_path=REPORT_PATH):
+    """Guardrail used by the server: (ok, reason) for serving <name>_<variant> instead of float32."""
+    try:
+        with open(report_path) as f:
+            entry = json.load(f)["models"][name][variant]
+    except (OSError, ValueError, KeyError):
+        return False, f"no quantization report entry for {name}/{variant}"
+    if abs(entry.get("keras_mtime", 0) - os.path.getmtime(keras_path)) > 1e-3:
+        return False, f"report for {name}/{variant} is stale (model changed since quantization)"
+    if entry["top1_agreement"] < min_agreement:
+        return False, f"top-1 agreement {entry['top1_agreement']:.4f} < {min_agreement}"
+    if entry["confidence_drift_mean"] > max_drift:
+        return False, f"mean confidence drift {entry['confidence_drift_mean']:.4f} > {max_drift}"
+    return True, "ok"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--calib", required=True, help="directory of representative images (int8 calibration)")
+    ap.add_argument("--eval", required=True,
+                    help="directory of held-out evaluation images (not the --calib ones)")
+    ap.add_argument("--calib-limit", type=int, default=200)
+    ap.add_argument("--eval-limit", type=int, default=500)
+    ap.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=VARIANTS)
+    ap.add_argument("--models", nargs="+", default=list(MODEL_NAMES), choices=MODEL_NAMES)
+    ap.add_argument("--model-dir", default=MODEL_DIR)
+    ap.add_argument("--report", default=None, help="report path (default: <model-dir>/quantization_report.json)")
+    args = ap.parse_args(argv)
+
+    if os.path.realpath(args.eval) == os.path.realpath(args.calib):
+        # agreement on the calibration images themselves overstates how well int8 holds up
+        ap.error("--eval must be a held-out directory, not the --calib one")
+    calib = load_image_dir(args.calib, args.calib_limit)
+    evalset = load_image_dir(args.eval, args.eval_limit)
+    report_path = args.report or os.path.join(args.model_dir, "quantization_report.json")
+    report = {}
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            report = json.load(f)
+    report.setdefault("models", {})
+
+    for name in args.models:
+        keras_path = os.path.join(args.model_dir, name + ".keras")
+        model = tf.keras.models.load_model(keras_path, compile=False)
+        ref = KerasBackend(model)
+        ref_probs = np.asarray(ref.predict(evalset), dtype=np.float64)
+        p50, p95 = latency_ms(ref, evalset[:20])
+        entry = {"float32": {"file_bytes": os.path.getsize(keras_path), "latency_ms_p50": p50, "latency_ms_p95": p95}}
+        for variant in args.variants:
+            t0 = time.perf_counter()
+            content = convert(model, variant, calib)
+            out_path = tflite_path_for(keras_path, "_" + variant)
+            with open(out_path, "wb") as f:
+                f.write(content)
+            backend = TFLiteBackend(content)
+            probs = np.asarray(backend.predict(evalset), dtype=np.float64)
+            p50, p95 = latency_ms(backend, evalset[:20])
+            entry[variant] = {
+                "path": os.path.basename(out_path),
+                "file_bytes": len(content),
+                "convert_s": round(time.perf_counter() - t0, 2),
+                "latency_ms_p50": p50,
+                "latency_ms_p95": p95,
+                "keras_mtime": os.path.getmtime(keras_path),
+                **compare(ref_probs, probs),
+            }
+            print(name, variant, json.dumps(entry[variant]))
+        # merge: a run with a subset of --variants keeps the other variants' entries
+        report["models"].setdefault(name, {}).update(entry)
+    report["generated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {report_path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
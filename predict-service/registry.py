@@ -0,0 +1,304 @@
+"""
+Versioned model registry with zero-downtime reload.
+
+    models/
+      versions/
+        2026-10-01/   fundus_mnv2.keras  outer_mnv2.keras  symptom_model.pkl  components.pkl
+        2026-10-17/   ... (plus optional .tflite exports, symptom_export/, quantization_report.json)
+      CURRENT         name of the version to serve (no CURRENT: the last version by name)
+
+Without a versions/ directory the flat models/ layout is served as version "base".
+
+A reload builds the new version's model set next to the active one (load +
+warm-up), swaps the single reference requests read, and retires the old set
+once the requests that started on it have finished (leases), so nothing is
+dropped and no request mixes two versions. The reload report records load time
+and the process memory before, with both versions resident, and after release.
+No TensorFlow here: gunicorn.conf.py uses this module in the master.
+"""
+import ctypes
+import gc
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import prefork
+from result_cache import files_fingerprint
+
+MODEL_FILES = ("fundus_mnv2.keras", "outer_mnv2.keras", "symptom_model.pkl", "components.pkl")
+BASE_VERSION = "base"
+_VERSION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+
+class ReloadError(Exception):
+    """A reload was refused or the new version failed to load (the active version keeps serving)."""
+
+
+class ModelVersion:
+    """A version name and the directory holding its model files."""
+
+    def __init__(self, name, directory):
+        self.name = name
+        self.directory = directory
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def missing(self):
+        return [f for f in MODEL_FILES if not os.path.exists(self.path(f))]
+
+    def fingerprint(self):
+        return files_fingerprint([self.path(f) for f in MODEL_FILES])
+
+    def __repr__(self):
+        return f"ModelVersion({self.name!r}, {self.directory!r})"
+
+
+def list_versions(model_dir):
+    root = os.path.join(model_dir, "versions")
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    return sorted(n for n in names if _VERSION_NAME.match(n) and os.path.isdir(os.path.join(root, n)))
+
+
+def read_current(model_dir):
+    try:
+        with open(os.path.join(model_dir, "CURRENT")) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def get_version(model_dir, name):
+    if name == BASE_VERSION and not list_versions(model_dir):
+        return ModelVersion(BASE_VERSION, model_dir)
+    if not name or not _VERSION_NAME.match(name):
+        raise ReloadError(f"Invalid model version name {name!r}")
+    return ModelVersion(name, os.path.join(model_dir, "versions", name))
+
+
+def current_version(model_dir):
+    """The version to serve: models/CURRENT, else the last one in versions/, else the flat layout."""
+    names = list_versions(model_dir)
+    if not names:
+        return ModelVersion(BASE_VERSION, model_dir)
+    return get_version(model_dir, read_current(model_dir) or names[-1])
+
+
+def set_current(model_dir, name):
+    """Point models/CURRENT at a version (atomic rename: watchers never see a partial name)."""
+    tmp = os.path.join(model_dir, f".CURRENT.{os.getpid()}")
+    with open(tmp, "w") as f:
+        f.write(name + "\n")
+    os.replace(tmp, os.path.join(model_dir, "CURRENT"))
+
+
+def _rss_mb():
+    return (prefork.process_memory() or {}).get("rss_mb")
+
+
+def _malloc_trim():
+    # glibc keeps freed weight buffers in its arenas; hand them back to the OS
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class ModelRegistry:
+    """
+    Holds the active model set. build_fn(ModelVersion) must return a set with
+    .version, .leases (int), .load() (load and warm; raises on failure) and
+    .close(); a set that fails to load is closed, so its threads do not outlive
+    the reload. install() takes an initial set loaded elsewhere (PREDICT_STARTUP). Requests call acquire() and
+    release() around everything they do with a set. on_swap(new set) runs after
+    each successful reload.
+    """
+
+    def __init__(self, model_dir, build_fn, on_swap=None, history=20):
+        self.model_dir = model_dir
+        self.build_fn = build_fn
+        self.on_swap = on_swap
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._active = None
+        self._active_fingerprint = None
+        self._retiring = []  # [[set, report]] swapped out, waiting for their last lease
+        self.loading = None  # version name being loaded
+        self.reloads = 0
+        self.failures = 0
+        self.last_report = None
+        self.history = deque(maxlen=history)
+        self._failed_key = None
+        self._watcher = None
+
+    # --- the active set ---
+    def install(self, models, fingerprint=None):
+        with self._lock:
+            self._active = models
+            self._active_fingerprint = fingerprint or models.version.fingerprint()
+
+    def active(self):
+        return self._active
+
+    def acquire(self):
+        with self._lock:
+            models = self._active
+            models.leases += 1
+            return models
+
+    def release(self, models):
+        with self._lock:
+            models.leases -= 1
+            entry = next((e for e in self._retiring if e[0] is models), None)
+            if entry is None or models.leases > 0:
+                return
+            self._retiring.remove(entry)
+        threading.Thread(target=self._retire, args=(entry,), name="retire-models", daemon=True).start()
+
+    def _retire(self, entry):
+        # runs once the last request on the old version is done; entry is [set, report] and is
+        # emptied so that the collection below really frees the set
+        models, report = entry
+        entry.clear()
+        try:
+            models.close()
+        except Exception:
+            report["close_error"] = traceback.format_exc()
+        del models
+        gc.collect()
+        _malloc_trim()
+        report["released_after_s"] = round(time.perf_counter() - report.pop("_swapped_at"), 3)
+        report["rss_after_release_mb"] = _rss_mb()
+
+    # --- reload ---
+    def reload(self, name=None, trigger="api"):
+        """
+        Load a version (default: the one models/CURRENT points at), warm it and
+        swap it in; a named version then becomes models/CURRENT, so that watchers
+        (other workers, restarts) follow. Returns the reload report; raises
+        ReloadError if another reload is running or the version fails to load (the
+        old one keeps serving).
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            raise ReloadError(f"A reload of '{self.loading}' is already in progress")
+        try:
+            version = get_version(self.model_dir, name) if name else current_version(self.model_dir)
+            report = self._reload(version, trigger)
+            if name and list_versions(self.model_dir) and read_current(self.model_dir) != name:
+                set_current(self.model_dir, name)
+            return _public(report)
+        finally:
+            self.loading = None
+            self._reload_lock.release()
+
+    def _reload(self, version, trigger):
+        self.loading = version.name
+        old = self._active
+        report = {"version": version.name, "previous": old.version.name if old else None,
+                  "trigger": trigger, "started_at": time.time(), "ok": False,
+                  "rss_before_mb": _rss_mb()}
+        self.last_report = report
+        self.history.append(report)
+        fingerprint = version.fingerprint()
+        t0 = time.perf_counter()
+        new = None
+        try:
+            missing = version.missing()
+            if missing:
+                raise FileNotFoundError(f"{version.directory} is missing {', '.join(missing)}")
+            new = self.build_fn(version)
+            new.load()
+        except Exception as e:
+            if new is not None:
+                try:
+                    new.close()  # the half-loaded set's batcher threads would otherwise keep it alive
+                except Exception:
+                    report["close_error"] = traceback.format_exc()
+                new = None
+            self.failures += 1
+            self._failed_key = (version.name, fingerprint)
+            report.update({"error": f"{type(e).__name__}: {e}", "load_s": round(time.perf_counter() - t0, 3)})
+            print(f"Model reload to '{version.name}' failed; still serving "
+                  f"'{report['previous']}':\n{traceback.format_exc()}", file=sys.stderr)
+            sys.stderr.flush()
+            raise ReloadError(report["error"]) from e
+        report["load_s"] = round(time.perf_counter() - t0, 3)
+        report["components"] = new.status()
+        report["rss_both_loaded_mb"] = _rss_mb()
+        if report["rss_before_mb"] is not None and report["rss_both_loaded_mb"] is not None:
+            report["overlap_mb"] = round(report["rss_both_loaded_mb"] - report["rss_before_mb"], 1)
+        with self._lock:
+            self._active = new
+            self._active_fingerprint = fingerprint
+            report["_swapped_at"] = time.perf_counter()
+            report["in_flight_on_previous"] = old.leases if old is not None else 0
+            entry = [old, report] if old is not None else None
+            if entry is not None and old.leases > 0:
+                self._retiring.append(entry)
+                entry = None
+        if self.on_swap is not None:
+            self.on_swap(new)
+        del old, new
+        self.reloads += 1
+        self._failed_key = None
+        report["ok"] = True
+        if entry is not None:
+            self._retire(entry)
+        return report
+
+    # --- watcher ---
+    def watch(self, interval_s):
+        """Poll models/CURRENT and the active version's files; reload when either changes and has settled."""
+        if interval_s <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch_loop, args=(interval_s,), name="model-watcher",
+                                         daemon=True)
+        self._watcher.start()
+
+    def _watch_loop(self, interval_s):
+        seen = None
+        while True:
+            time.sleep(interval_s)
+            try:
+                version = current_version(self.model_dir)
+                key = (version.name, version.fingerprint())
+            except Exception:
+                continue
+            changed = key != (self._active.version.name, self._active_fingerprint)
+            # act only on a state seen twice in a row (files still being copied are skipped),
+            # and do not retry a version that failed until its files change
+            if changed and key == seen and key != self._failed_key:
+                try:
+                    self.reload(version.name, trigger="watcher")
+                except ReloadError:
+                    pass
+            seen = key
+
+    def status(self):
+        with self._lock:
+            active = self._active
+            retiring = [{"version": m.version.name, "in_flight": m.leases} for m, _ in self._retiring]
+        return {
+            "active": {"version": active.version.name, "directory": active.version.directory,
+                       "fingerprint": self._active_fingerprint, "in_flight": active.leases},
+            "current_pointer": read_current(self.model_dir),
+            "available": list_versions(self.model_dir) or [BASE_VERSION],
+            "loading": self.loading,
+            "retiring": retiring,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "watching": self._watcher is not None,
+            "last_reload": _public(self.last_report),
+            "history": [_public(r) for r in self.history],
+        }
+
+
+def _public(report):
+    return {k: v for k, v in report.items() if not k.startswith("_")} if report else None
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+# disk_dir/<fingerprint>/: the only entries of disk_dir this cache ever removes
+_FINGERPRINT_DIR = re.compile(r"^[0-9a-f]{16}$")
+
+
+def files_fingerprint(paths):
+    """Short hash over (path, size, mtime) of the given files; changes whenever a model file is replaced."""
+    h = hashlib.sha256()
+    for p in paths:
+        try:
+            st = os.stat(p)
+            h.update(f"{p}:{st.st_size}:{st.st_mtime_ns}".encode())
+        except OSError:
+            h.update(f"{p}:missing".encode())
+    return h.hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Content-addressed cache of /api/predict payloads (predictions and gate rejections).
+
+    Entries are stored as JSON bytes in an in-process LRU bounded by total bytes,
+    each with a TTL. An optional on-disk layer (disk_dir) survives restarts and is
+    shared by workers on the same host. All keys are scoped to a fingerprint of
+    the model files, so replacing a model invalidates everything cached before it.
+    On disk each fingerprint has its own directory; another fingerprint's is
+    removed once nothing has been written to it for ttl_s (its entries have all
+    expired), so workers still serving the previous version during a reload
+    keep theirs, and nothing else under disk_dir is touched.
+    """
+
+    def __init__(self, model_paths, max_bytes=64 * 1024 * 1024, ttl_s=3600.0,
+                 disk_dir=None, disk_max_bytes=512 * 1024 * 1024, check_interval_s=2.0):
+        self.model_paths = list(model_paths)
+        self.max_bytes = int(max_bytes)
+        self.ttl_s = float(ttl_s)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_bytes)
+        self.check_interval_s = float(check_interval_s)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, data bytes)
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._last_check = 0.0
+        self.fingerprint = files_fingerprint(self.model_paths)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        if self.disk_dir:
+            os.makedirs(self._disk_root(), exist_ok=True)
+            self._drop_stale_disk_versions()
+            disk_bytes = self._scan_disk_bytes()
+            with self._lock:
+                self._disk_bytes = disk_bytes
+
+    @staticmethod
+    def key(file_bytes, image_type, symptoms):
+        h = hashlib.sha256(file_bytes)
+        h.update(b"\0" + (image_type or "").encode("utf-8"))
+        h.update(b"\0" + " ".join((symptoms or "").lower().split()).encode("utf-8"))
+        return h.hexdigest()
+
+    # --- invalidation ---
+    def rescope(self, model_paths):
+        """Scope the cache to another set of model files (a model reload); entries go if they differ."""
+        self.model_paths = list(model_paths)
+        self._last_check = 0.0
+        self._check_models()
+
+    def _check_models(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval_s:
+            return
+        self._last_check = now
+        fp = files_fingerprint(self.model_paths)
+        if fp != self.fingerprint:
+            with self._lock:
+                self.fingerprint = fp
+                self._entries.clear()
+                self._bytes = 0
+                self.invalidations += 1
+            if self.disk_dir:
+                os.makedirs(self._disk_root(), exist_ok=True)
+                self._drop_stale_disk_versions()
+                disk_bytes = self._scan_disk_bytes()
+                with self._lock:
+                    self._disk_bytes = disk_bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk_dir:
+            shutil.rmtree(self._disk_root(), ignore_errors=True)
+            os.makedirs(self._disk_root(), exist_ok=True)
+            with self._lock:
+                self._disk_bytes = 0
+
+    # --- lookups ---
+    def get(self, key):
+        self._check_models()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, data = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(data)
+                self._remove(key)
+        data = self._disk_get(key, now)
+        if data is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._store(key, data, now)
+            return json.loads(data)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, payload):
+        self._check_models()
+        data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        now = time.time()
+        self._store(key, data, now)
+        self._disk_put(key, data)
+
+    def _store(self, key, data, now):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (now + self.ttl_s, data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._entries:
+                old_key = next(iter(self._entries))
+                self._remove(old_key)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, data = self._entries.pop(key)
+        self._bytes -= len(data)
+
+    # --- disk layer ---
+    def _disk_root(self):
+        return os.path.join(self.disk_dir, self.fingerprint)
+
+    def _disk_path(self, key):
+        return os.path.join(self._disk_root(), key[:2], key + ".json")
+
+    def _drop_stale_disk_versions(self):
+        cutoff = time.time() - self.ttl_s
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name == self.fingerprint or not _FINGERPRINT_DIR.match(name) or not os.path.isdir(path):
+                continue
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue  # still written to: a worker on that version
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _scan_disk_bytes(self):
+        total = 0
+        for root, _, files in os.walk(self._disk_root()):
+            for f in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, f))
+                except OSError:
+                    pass
+        return total
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl_s <= now:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _disk_put(self, key, data):
+        if not self.disk_dir or len(data) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)  # atomic, safe with several workers
+            os.utime(self._disk_root())  # marks this version's directory as in use
+            with self._lock:
+                self._disk_bytes += len(data)
+                over = self._disk_bytes > self.disk_max_bytes
+            if over:
+                self._prune_disk()
+        except OSError:
+            pass
+
+    def _prune_disk(self):
+        # drop the oldest files until the disk layer is back under ~90% of its bound
+        files = []
+        for root, _, names in os.walk(self._disk_root()):
+            for n in names:
+                p = os.path.join(root, n)
+                try:
+                    st = os.stat(p)
+                    files.append((st.st_mtime, st.st_size, p))
+                except OSError:
+                    pass
+        files.sort()
+        total = sum(f[1] for f in files)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, p in files:
+            if total <= target:
+                break
+            try:
+                os.remove(p)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": ((self.hits + self.disk_hits) / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "model_fingerprint": self.fingerprint,
+                "disk": {"dir": self.disk_dir, "bytes": self._disk_bytes, "max_bytes": self.disk_max_bytes}
+                if self.disk_dir else None,
+            }
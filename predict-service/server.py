@@ -1,27 +1,51 @@
+import functools
+import hmac
 import os
-import io
+import tempfile
 import sys
+import threading
+import time
 import traceback
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
 import numpy as np
-import pickle
-import tensorflow as tf
-from flask import Flask, request, jsonify
-from PIL import Image
 import cv2
+import tensorflow as tf
+from flask import Flask, Response, request, jsonify
+
+import backbone
+from batching import MicroBatcher
+from deadlines import NO_DEADLINE, Deadline, DeadlineExceeded, parse_priority, priority_rank
+from eye_gate import make_gate
+from imaging import IMG_SIZE, DecodedImage, ImageTooLarge, RawImage, TensorFormatError, as_decoded, parse_shape
+from loader import Component
+from metrics import Gauge, Registry, StageTimer
+from inference import KerasBackend, TFLiteBackend, fresh_tflite_path, make_backend, parity_check, parity_batch, variant_path
+import prefork
+import profiling
+import registry
+import symptom_export
+import thread_budget
+import warmpath
+from quantize import check_variant
+from result_cache import ResultCache
+from speculation import SpeculativeExecutor
+from symptoms import SymptomClassifier
 
 # Flask app
 app = Flask(__name__)
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
 
 # -----------------------------
-# Limit TensorFlow threads (important on small hosts)
+# Thread budget: TF intra/inter-op, TFLite and OpenCV threads from the usable CPUs
+# (affinity + cgroup quota), the worker count and PREDICT_THREAD_PROFILE (latency | throughput)
 # -----------------------------
-try:
-    # reduce TF parallelism to lower memory / CPU pressure on small instances
-    tf.config.threading.set_inter_op_parallelism_threads(1)
-    tf.config.threading.set_intra_op_parallelism_threads(1)
-except Exception:
-    pass
+THREAD_BUDGET = thread_budget.budget_from_env()
+THREADS_EFFECTIVE = thread_budget.apply(THREAD_BUDGET)
+print(f"Thread budget ({THREAD_BUDGET['profile']}, {THREAD_BUDGET['cpus']} cpus / "
+      f"{THREAD_BUDGET['workers']} workers): {THREADS_EFFECTIVE}, tflite={THREAD_BUDGET['tflite']}", file=sys.stderr)
+sys.stderr.flush()
 
 # -----------------------------
 # Optional: GPU memory growth
@@ -37,16 +61,12 @@ except Exception:
     pass
 
 # -----------------------------
-# Load models and components (load once at import)
-# Wrap in try/except to log errors cleanly
+# Model and component paths: models/versions/<version>/ with models/CURRENT naming the
+# one to serve (registry.py), or the flat models/ layout as version "base".
+# PREDICT_MODEL_DIR points at another models directory
 # -----------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_DIR = os.path.join(BASE_DIR, "models")
-
-FUNDUS_MODEL_PATH = os.path.join(MODEL_DIR, "fundus_mnv2.keras")
-OUTER_MODEL_PATH = os.path.join(MODEL_DIR, "outer_mnv2.keras")
-SYMPTOM_MODEL_PATH = os.path.join(MODEL_DIR, "symptom_model.pkl")
-COMPONENTS_PATH = os.path.join(MODEL_DIR, "components.pkl")
+MODEL_DIR = os.environ.get("PREDICT_MODEL_DIR") or os.path.join(BASE_DIR, "models")
 
 # helper to log and exit if models missing / broken (so you see clear logs)
 def fatal(msg):
@@ -56,35 +76,14 @@ def fatal(msg):
     # do not exit in Render production workers; raise so gunicorn logs show it
     raise RuntimeError(msg)
 
+# quick existence checks (cheap, so always done at import)
 try:
-    # quick existence checks
-    if not os.path.exists(FUNDUS_MODEL_PATH):
-        fatal(f"Missing model file: {FUNDUS_MODEL_PATH}")
-    if not os.path.exists(OUTER_MODEL_PATH):
-        fatal(f"Missing model file: {OUTER_MODEL_PATH}")
-    if not os.path.exists(SYMPTOM_MODEL_PATH):
-        fatal(f"Missing model file: {SYMPTOM_MODEL_PATH}")
-    if not os.path.exists(COMPONENTS_PATH):
-        fatal(f"Missing model file: {COMPONENTS_PATH}")
-
-    # load keras models (compile=False reduces overhead)
-    fundus_model = tf.keras.models.load_model(FUNDUS_MODEL_PATH, compile=False)
-    outer_model = tf.keras.models.load_model(OUTER_MODEL_PATH, compile=False)
-
-    # load pickled sklearn models/components
-    with open(SYMPTOM_MODEL_PATH, "rb") as f:
-        symptom_model = pickle.load(f)
-
-    with open(COMPONENTS_PATH, "rb") as f:
-        components = pickle.load(f)
-
-except Exception as e:
-    tb = traceback.format_exc()
-    print("Error loading models:\n", tb, file=sys.stderr)
-    sys.stderr.flush()
-    fatal("Model load failed; see logs for traceback.")
+    INITIAL_VERSION = registry.current_version(MODEL_DIR)
+except registry.ReloadError as _e:
+    fatal(str(_e))
+for _name in INITIAL_VERSION.missing():
+    fatal(f"Missing model file: {INITIAL_VERSION.path(_name)}")
 
-# rest of your code unchanged...
 def resolve_classes(components, list_key, dict_key):
     if list_key in components:
         return list(components[list_key])
@@ -97,103 +96,892 @@ def resolve_classes(components, list_key, dict_key):
         return [d[k] for k in keys]
     raise KeyError(f"Missing {list_key} or {dict_key} in components.pkl")
 
-fundus_classes = resolve_classes(components, "fundus_classes", "fundus_class_dict")
-outer_classes = resolve_classes(components, "outer_eye_classes", "outer_eye_class_dict")
+# -----------------------------
+# Dynamic micro-batching (concurrent requests share one forward pass per model)
+# -----------------------------
+BATCHING_ENABLED = os.environ.get("PREDICT_BATCHING", "1").lower() in ("1", "true", "yes")
+BATCH_MAX_SIZE = int(os.environ.get("PREDICT_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("PREDICT_BATCH_MAX_WAIT_MS", "5"))
+
+# -----------------------------
+# Inference backend: keras | tf_function | xla | tflite
+# -----------------------------
+INFERENCE_BACKEND = os.environ.get("PREDICT_BACKEND", "keras").lower()
+BACKEND_PARITY_CHECK = os.environ.get("PREDICT_BACKEND_PARITY", "1").lower() in ("1", "true", "yes")
+# float32 | dynamic | float16 | int8 (quantized variants come from quantize.py)
+MODEL_VARIANT = os.environ.get("PREDICT_MODEL_VARIANT", "float32").lower()
+VARIANT_MIN_AGREEMENT = float(os.environ.get("PREDICT_VARIANT_MIN_AGREEMENT", "0.98"))
+VARIANT_MAX_DRIFT = float(os.environ.get("PREDICT_VARIANT_MAX_DRIFT", "0.05"))
+
+def _quantization_report(model_path):
+    return os.path.join(os.path.dirname(model_path), "quantization_report.json")
+
+def build_backend(kind, model, model_path):
+    # a quantized variant is used only if its quantization report passes the accuracy guardrail
+    if MODEL_VARIANT != "float32":
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        ok, reason = check_variant(name, MODEL_VARIANT, model_path,
+                                   min_agreement=VARIANT_MIN_AGREEMENT, max_drift=VARIANT_MAX_DRIFT,
+                                   report_path=_quantization_report(model_path))
+        if ok:
+            backend = make_backend("tflite", model, model_path, num_threads=THREAD_BUDGET["tflite"], variant=MODEL_VARIANT)
+            return backend, {"variant_check": reason}
+        print(f"Variant '{MODEL_VARIANT}' rejected for {name}: {reason}; using float32", file=sys.stderr)
+        sys.stderr.flush()
+    # non-keras backends must reproduce the keras top-3 before they are used
+    backend = make_backend(kind, model, model_path, num_threads=THREAD_BUDGET["tflite"])
+    parity = None
+    if backend.name != "keras" and BACKEND_PARITY_CHECK:
+        parity = parity_check(KerasBackend(model), backend, parity_batch(img_size=IMG_SIZE))
+        if not parity["ok"]:
+            print(f"Backend '{kind}' failed parity for {model_path}: {parity}; using keras", file=sys.stderr)
+            sys.stderr.flush()
+            backend = KerasBackend(model)
+    return backend, parity
+
+# -----------------------------
+# Model components: loaded eagerly (default), in the background, or lazily on first use
+# PREDICT_STARTUP = eager | background | lazy
+# -----------------------------
+STARTUP_MODE = os.environ.get("PREDICT_STARTUP", "eager").lower()
+WARMUP_RUNS = int(os.environ.get("PREDICT_WARMUP_RUNS", "1"))
+# batch sizes traced / allocated at load ("all": 1..PREDICT_BATCH_MAX_SIZE, every size the batchers emit)
+WARMUP_BATCH_SIZES = warmpath.parse_batch_sizes(os.environ.get("PREDICT_WARMUP_BATCH_SIZES"), BATCH_MAX_SIZE)
+# no model call for this long: keep-warm inference (0 = off); also the "after idle" threshold of the stats
+KEEPWARM_S = float(os.environ.get("PREDICT_KEEPWARM_S", "30"))
+WARMUP_SYMPTOM_TEXT = os.environ.get("PREDICT_WARMUP_SYMPTOMS", "blurred vision and eye pain")
+
+# set by the gunicorn master (gunicorn.conf.py) once the .tflite exports passed their parity check
+TFLITE_VERIFIED = os.environ.get("PREDICT_TFLITE_VERIFIED", "0").lower() in ("1", "true", "yes")
+
+def _mapped_tflite_backend(model_path, tflite_verified):
+    # TFLite straight from the (memory-mapped) file, without loading the Keras model at all:
+    # workers then share the weight pages instead of each holding its own copy
+    if MODEL_VARIANT != "float32":
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        ok, reason = check_variant(name, MODEL_VARIANT, model_path,
+                                   min_agreement=VARIANT_MIN_AGREEMENT, max_drift=VARIANT_MAX_DRIFT,
+                                   report_path=_quantization_report(model_path))
+        if not ok:
+            return None, None
+        backend = TFLiteBackend(model_path=variant_path(model_path, MODEL_VARIANT), num_threads=THREAD_BUDGET["tflite"])
+        backend.name = f"tflite_{MODEL_VARIANT}"
+        return backend, {"variant_check": reason, "weights": "mmap"}
+    path = fresh_tflite_path(model_path)
+    if INFERENCE_BACKEND == "tflite" and tflite_verified and path is not None:
+        backend = TFLiteBackend(model_path=path, num_threads=THREAD_BUDGET["tflite"])
+        return backend, {"parity": "verified before fork", "weights": "mmap"}
+    return None, None
+
+def _load_image_model(models, model_type):
+    def load():
+        component = models.models[model_type]
+        shared = models.shared_backbone()
+        if shared is not None:
+            component.info.update({"backend": shared.name, "features_backend": shared.features_backend.name})
+            return shared.backend(model_type)
+        model_path = models.paths[model_type]
+        backend, info = _mapped_tflite_backend(model_path, models.tflite_verified)
+        if backend is None:
+            # compile=False reduces overhead
+            model = tf.keras.models.load_model(model_path, compile=False)
+            backend, parity = build_backend(INFERENCE_BACKEND, model, model_path)
+            info = {"parity": parity}
+        component.info.update({"backend": backend.name, **info})
+        return backend
+    return load
+
+# -----------------------------
+# Shared backbone (PREDICT_SHARED_BACKBONE=1): when both model files hold the same frozen
+# backbone, serve one feature extractor + two heads (backbone.py); otherwise the
+# shared_backbone component reports why and the models are served separately
+# -----------------------------
+SHARED_BACKBONE = os.environ.get("PREDICT_SHARED_BACKBONE", "0").lower() in ("1", "true", "yes")
+
+def _load_shared_backbone(models):
+    info = models.shared.info
+    if MODEL_VARIANT != "float32":
+        info["report"] = {"shared": False, "reason": "quantized variants are served per model"}
+        return None
+    loaded = {t: tf.keras.models.load_model(models.paths[t], compile=False) for t in ("fundus", "outer")}
+    shared, report = backbone.share(loaded, backend_kind=INFERENCE_BACKEND, num_threads=THREAD_BUDGET["tflite"])
+    info["report"] = report
+    if shared is None:
+        print(f"Shared backbone not used: {report['reason']}", file=sys.stderr)
+        sys.stderr.flush()
+    return shared
+
+def _warm(predict_fn, calls):
+    # first calls build graphs / allocate buffers, and Keras retraces for new batch sizes;
+    # pay that here, for every size the batchers can emit, instead of on a user request
+    for n in WARMUP_BATCH_SIZES if WARMUP_RUNS > 0 else ():
+        x = np.zeros((n, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        for _ in range(WARMUP_RUNS):
+            t0 = time.perf_counter()
+            predict_fn(x)
+            calls.record(n, time.perf_counter() - t0, "warmup")
+
+def _warm_image_model(models, model_type, backend):
+    if backend.name == backbone.SharedBackbone.name:
+        return  # live traffic runs the shared feature extractor, warmed (and tracked) by its component
+    _warm(backend.predict, models.calls[model_type])
+
+def _warm_shared_backbone(models, shared):
+    if shared is None:
+        return
+    _warm(shared.features, models.calls["backbone"])
+    feats = shared.features(np.zeros((1, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32))
+    shared.heads_for(list(shared.heads), np.repeat(feats, len(shared.heads), axis=0))  # traces every head
+
+def _load_pickle(path):
+    # reuses the copy unpickled by the gunicorn master before fork, if any
+    def load():
+        return prefork.load_pickle(path)
+    return load
+
+# auto: use <version>/symptom_export (symptom_export.py) when it matches the pickles | export | pickle
+SYMPTOM_FORMAT = os.environ.get("PREDICT_SYMPTOM_FORMAT", "auto").lower()
+
+def _use_symptom_export(models):
+    if SYMPTOM_FORMAT == "pickle":
+        return False
+    export_dir = models.paths["symptom_export"]
+    fresh = symptom_export.is_fresh(export_dir, (models.paths["symptom_model"], models.paths["components"]))
+    if SYMPTOM_FORMAT == "export" and not fresh:
+        raise FileNotFoundError(f"{export_dir} is missing or stale; run symptom_export.py")
+    return fresh
+
+def _load_exported_text_components(export_dir):
+    vec, model, le, meta = symptom_export.load_exported(export_dir)
+    for key in ("fundus_classes", "outer_classes"):
+        if not meta.get(key):
+            raise KeyError(f"Missing {key} in {export_dir}/meta.json")
+    return {"fundus_classes": meta["fundus_classes"], "outer_classes": meta["outer_classes"],
+            "vec": vec, "le": le, "model": model}
+
+def _load_text_components(models):
+    if _use_symptom_export(models):
+        models.text.info["format"] = "export"
+        return _load_exported_text_components(models.paths["symptom_export"])
+    models.text.info["format"] = "pickle"
+    components = _load_pickle(models.paths["components"])()
+    vec = components.get("vectorizer", components.get("tfidf_vectorizer"))
+    le = components.get("label_encoder", components.get("le_text"))
+    if vec is None or le is None:
+        raise KeyError("Missing vectorizer or label encoder in components.pkl")
+    return {
+        "fundus_classes": resolve_classes(components, "fundus_classes", "fundus_class_dict"),
+        "outer_classes": resolve_classes(components, "outer_eye_classes", "outer_eye_class_dict"),
+        "vec": vec,
+        "le": le,
+    }
+
+SYMPTOM_CACHE_SIZE = int(os.environ.get("PREDICT_SYMPTOM_CACHE_SIZE", "4096"))
+
+def _load_symptom_classifier(models):
+    labels = models.text.get()
+    model = labels.get("model") or _load_pickle(models.paths["symptom_model"])()
+    return SymptomClassifier(labels["vec"], model, labels["le"], cache_size=SYMPTOM_CACHE_SIZE)
+
+def _warm_symptom_model(clf):
+    if WARMUP_RUNS > 0:
+        clf.predict(WARMUP_SYMPTOM_TEXT)
+
+def _make_batchers(models):
+    batchers = {}
+    for name in ("fundus", "outer"):
+        batchers[name] = MicroBatcher(
+            name, lambda b, t=name: models.predict(t, b),
+            max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+        )
+    if SHARED_BACKBONE:
+        # fundus and outer requests queue together for one backbone pass; heads run per request
+        batchers["backbone"] = MicroBatcher(
+            "backbone", lambda b: models.features(b),
+            max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+        )
+    return batchers
+
+class ModelSet:
+    """
+    Everything loaded from one model version: its components and the micro-batchers
+    feeding its models. model_registry serves one at a time; a reload builds another.
+    """
+
+    def __init__(self, version, tflite_verified=False):
+        self.version = version
+        self.name = version.name
+        # the gunicorn master verifies the .tflite exports of the version it saw at startup only
+        self.tflite_verified = tflite_verified
+        self.leases = 0
+        self.paths = {
+            "fundus": version.path("fundus_mnv2.keras"),
+            "outer": version.path("outer_mnv2.keras"),
+            "symptom_model": version.path("symptom_model.pkl"),
+            "components": version.path("components.pkl"),
+            "symptom_export": version.path("symptom_export"),
+        }
+        self.text = Component("components", lambda: _load_text_components(self))
+        self.symptom = Component("symptom_model", lambda: _load_symptom_classifier(self), _warm_symptom_model)
+        self.shared = (Component("shared_backbone", lambda: _load_shared_backbone(self),
+                                 lambda shared: _warm_shared_backbone(self, shared)) if SHARED_BACKBONE else None)
+        self.models = {t: Component(f"{t}_model", _load_image_model(self, t),
+                                    lambda backend, t=t: _warm_image_model(self, t, backend))
+                       for t in ("fundus", "outer")}
+        # first-call / after-idle vs steady-state latency of every forward pass (warmpath.py)
+        self.calls = {name: warmpath.CallStats(name, idle_s=KEEPWARM_S or 30.0)
+                      for name in ("fundus", "outer") + (("backbone",) if SHARED_BACKBONE else ())}
+        self.components = ([self.text, self.symptom] + ([self.shared] if self.shared else [])
+                           + list(self.models.values()))
+        self.batchers = _make_batchers(self) if BATCHING_ENABLED else {}
+
+    def model_paths(self):
+        return [self.paths[k] for k in ("fundus", "outer", "symptom_model", "components")]
+
+    def shared_backbone(self):
+        """The SharedBackbone in use, or None (disabled, or the models cannot share one)."""
+        return self.shared.get() if self.shared is not None else None
+
+    def predict(self, model_type, batch, phase="live"):
+        # batch is (N, H, W, 3); returns (N, K) predictions
+        backend = self.models[model_type].get()
+        t0 = time.perf_counter()
+        out = backend.predict(batch)
+        self.calls[model_type].record(len(batch), time.perf_counter() - t0, phase)
+        return out
 
-vec = components.get("vectorizer", components.get("tfidf_vectorizer"))
-le = components.get("label_encoder", components.get("le_text"))
-if vec is None or le is None:
-    fatal("Missing vectorizer or label encoder in components.pkl")
+    def features(self, batch, phase="live"):
+        # the shared backbone pass of mixed fundus / outer rows
+        shared = self.shared_backbone()
+        t0 = time.perf_counter()
+        out = shared.features(batch)
+        self.calls["backbone"].record(len(batch), time.perf_counter() - t0, phase)
+        return out
 
-IMG_SIZE = 224
+    def last_call_at(self):
+        """time.monotonic() of the last forward pass of any model, or None."""
+        return max((c.last_call_at for c in self.calls.values() if c.last_call_at is not None), default=None)
+
+    def load(self):
+        for c in self.components:
+            c.load()
+        return self
+
+    def status(self):
+        return {c.name: c.status() for c in self.components}
+
+    def close(self):
+        for b in self.batchers.values():
+            b.close()
+
+# -----------------------------
+# Model registry: POST /api/models/reload or a change under models/ (polled every
+# PREDICT_MODEL_WATCH_S seconds, 0 = off) loads and warms a version next to the
+# active one, then swaps it in; requests keep the set they started with.
+# PREDICT_ADMIN_TOKEN, if set, must be sent as X-Admin-Token to reload
+# -----------------------------
+MODEL_WATCH_S = float(os.environ.get("PREDICT_MODEL_WATCH_S", "5"))
+ADMIN_TOKEN = os.environ.get("PREDICT_ADMIN_TOKEN", "")
+
+def _on_models_swapped(models):
+    if result_cache is not None:
+        result_cache.rescope(models.model_paths())
+
+model_registry = registry.ModelRegistry(MODEL_DIR, ModelSet, on_swap=_on_models_swapped)
+model_registry.install(ModelSet(INITIAL_VERSION, tflite_verified=TFLITE_VERIFIED))
+
+def active_models():
+    return model_registry.active()
+
+# -----------------------------
+# Keep-warm (warmpath.py): after PREDICT_KEEPWARM_S seconds without any forward pass, a
+# batch-1 inference per model, so the first request of the next burst is not a cold call
+# -----------------------------
+def _keep_warm():
+    models = model_registry.acquire()
+    try:
+        if not all(c.ready for c in models.components):
+            return False
+        x = np.zeros((1, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        if models.shared_backbone() is not None:
+            models.features(x, phase="keepwarm")  # the path run_models takes
+        else:
+            for model_type in ("fundus", "outer"):
+                models.predict(model_type, x, phase="keepwarm")
+        return True
+    finally:
+        model_registry.release(models)
+
+def _idle_s():
+    last = active_models().last_call_at()
+    return time.monotonic() - last if last is not None else None
+
+keep_warm = warmpath.KeepWarm(KEEPWARM_S, _keep_warm, _idle_s)
+
+def start_components(mode=None):
+    mode = (mode or STARTUP_MODE).lower()
+    components = active_models().components
+    if mode == "background":
+        for c in components:
+            c.start()
+    elif mode != "lazy":
+        try:
+            for c in components:
+                c.load()
+        except Exception:
+            for c in components:
+                if "traceback" in c.info:
+                    print(f"Error loading {c.name}:\n", c.info["traceback"], file=sys.stderr)
+            sys.stderr.flush()
+            fatal("Model load failed; see logs for traceback.")
+    model_registry.watch(MODEL_WATCH_S)
+    keep_warm.start()
+
+# gunicorn.conf.py serves "server:create_app()" and sets PREDICT_APP_FACTORY=1 so that
+# importing this module does not load anything by itself
+APP_FACTORY = os.environ.get("PREDICT_APP_FACTORY", "0").lower() in ("1", "true", "yes")
+if not APP_FACTORY:
+    start_components()
+
+def class_names(model_type, models=None):
+    labels = (models or active_models()).text.get()
+    return labels["fundus_classes"] if model_type == "fundus" else labels["outer_classes"]
+
+def run_model_batch(model_type, batch, models=None):
+    # batch is (N, H, W, 3); returns (N, K) predictions
+    return (models or active_models()).predict(model_type, batch)
+
+def _run_rows(batchers, batcher_name, predict_fn, stacked, priority, deadline):
+    # through the batcher (one queued item per row, so bulk work is scheduled behind
+    # interactive requests) if there is one, else one forward pass
+    if batcher_name in batchers:
+        batcher = batchers[batcher_name]
+        rank = priority_rank(priority)
+        futures = [batcher.submit(stacked[i:i + 1], rank, deadline.expires_at) for i in range(len(stacked))]
+        profile = profiling.current()
+        with profile.include(batcher.thread_ident) if profile is not None else nullcontext():
+            return np.stack([f.result() for f in futures])
+    deadline.check("inference")
+    return np.asarray(predict_fn(stacked))
+
+def run_models(model_types, stacked, priority="batch", deadline=NO_DEADLINE, models=None):
+    """
+    Row i of stacked (N, H, W, 3) through the model for model_types[i] -> list of
+    prediction rows. With a shared backbone, mixed fundus/outer rows share one pass.
+    models: the ModelSet a request started with (default: the active one).
+    """
+    models = models or active_models()
+    shared = models.shared_backbone()
+    if shared is not None:
+        feats = _run_rows(models.batchers, "backbone", models.features, stacked, priority, deadline)
+        return shared.heads_for(model_types, feats)
+    out = [None] * len(model_types)
+    for model_type in set(model_types):
+        rows = [i for i, t in enumerate(model_types) if t == model_type]
+        preds = _run_rows(models.batchers, model_type, lambda b: models.predict(model_type, b),
+                          stacked[rows], priority, deadline)
+        for j, i in enumerate(rows):
+            out[i] = preds[j]
+    return out
+
+def run_model(model_type, batch, priority="interactive", deadline=NO_DEADLINE, models=None):
+    # batch is (1, H, W, 3); returns the prediction row for that single image
+    return run_models([model_type], batch, priority, deadline, models)[0]
+
+# -----------------------------
+# Result cache: keyed by image bytes + image_type + symptoms, scoped to the model files
+# -----------------------------
+CACHE_ENABLED = os.environ.get("PREDICT_CACHE", "1").lower() in ("1", "true", "yes")
+result_cache = None
+if CACHE_ENABLED:
+    result_cache = ResultCache(
+        active_models().model_paths(),
+        max_bytes=int(os.environ.get("PREDICT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        ttl_s=float(os.environ.get("PREDICT_CACHE_TTL_S", "3600")),
+        disk_dir=os.environ.get("PREDICT_CACHE_DIR") or None,
+        disk_max_bytes=int(os.environ.get("PREDICT_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024))),
+    )
+
+def cache_get(file_bytes, image_type, symptoms):
+    if result_cache is None:
+        return None, None
+    key = ResultCache.key(file_bytes, image_type, symptoms)
+    cached = result_cache.get(key)
+    # a request that started before a reload may have stored a prediction of the previous version
+    if cached is not None and cached.get("model_version", active_models().name) != active_models().name:
+        cached = None
+    return key, cached
+
+def cache_put(key, payload):
+    if result_cache is not None and key is not None:
+        result_cache.put(key, payload)
+
+# -----------------------------
+# Decoding: dimensions are checked from the header before any pixels are allocated;
+# PREDICT_DECODE_DRAFT=1 decodes JPEGs at reduced (DCT-domain) resolution: faster on large
+# photos, but the gate sees slightly different pixels and can flip borderline decisions, so off
+# by default (bench/gate_eval.py measures the effect on a labelled corpus)
+# -----------------------------
+DECODE_OPTIONS = {
+    "draft": os.environ.get("PREDICT_DECODE_DRAFT", "0").lower() in ("1", "true", "yes"),
+    "max_pixels": int(os.environ.get("PREDICT_MAX_IMAGE_PIXELS", "50000000")),
+    "max_side": int(os.environ.get("PREDICT_MAX_IMAGE_SIDE", "16384")),
+}
+
+def decode_image(file_bytes):
+    # DecodedImage or None; raises ImageTooLarge
+    return DecodedImage.from_bytes(file_bytes, **DECODE_OPTIONS)
 
 def preprocess_image_bytes(file_bytes, img_size=IMG_SIZE):
-    bio = io.BytesIO(file_bytes)
-    with Image.open(bio) as im:
-        im = im.convert("RGB")
-        im = im.resize((img_size, img_size), Image.BILINEAR)
-        x = np.asarray(im, dtype=np.float32) / 255.0
-    return np.expand_dims(x, 0)
+    decoded = as_decoded(file_bytes, **DECODE_OPTIONS)
+    if decoded is None:
+        raise ValueError("Could not decode image")
+    return decoded.model_input(img_size)
 
 def decode_bgr_from_bytes(file_bytes, max_side=640):
-    arr = np.frombuffer(file_bytes, np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    if img is None:
+    decoded = as_decoded(file_bytes, **DECODE_OPTIONS)
+    if decoded is None:
         return None
-    h, w = img.shape[:2]
-    scale = min(1.0, float(max_side) / max(h, w))
-    if scale < 1.0:
-        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
-    return img
+    return decoded.gate_bgr(max_side)
 
-def softmax_scores(preds):
-    p = preds.astype(np.float64)
-    s = p.sum()
-    p = (p / s) if s > 0 else np.ones_like(p) / max(1, len(p))
-    order = np.argsort(p)[::-1]
-    top1 = float(p[order[0]])
-    margin = float(p[order[0]] - p[order[1]]) if len(p) > 1 else top1
-    K = len(p)
-    entropy = float(-np.sum(p * np.log(p + 1e-12)) / np.log(K))
+def softmax_scores_batch(preds):
+    # vectorised softmax_scores over an (N, K) array; returns arrays of length N and (N, K) order
+    p = np.asarray(preds, dtype=np.float64)
+    N, K = p.shape
+    s = p.sum(axis=1, keepdims=True)
+    p = np.where(s > 0, p / np.where(s > 0, s, 1.0), 1.0 / max(1, K))
+    order = np.argsort(p, axis=1)[:, ::-1]
+    rows = np.arange(N)
+    top1 = p[rows, order[:, 0]]
+    margin = (top1 - p[rows, order[:, 1]]) if K > 1 else top1
+    entropy = -np.sum(p * np.log(p + 1e-12), axis=1) / np.log(K)
     return top1, margin, entropy, order
 
-haar_base = cv2.data.haarcascades
-face_cascade = cv2.CascadeClassifier(os.path.join(haar_base, "haarcascade_frontalface_default.xml"))
-eye_cascade = cv2.CascadeClassifier(os.path.join(haar_base, "haarcascade_eye_tree_eyeglasses.xml"))
-if eye_cascade.empty():
-    eye_cascade = cv2.CascadeClassifier(os.path.join(haar_base, "haarcascade_eye.xml"))
-
-def detect_fundus_circle_relaxed(img_bgr):
-    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
-    gray = cv2.medianBlur(gray, 5)
-    h, w = gray.shape[:2]
-    min_r = max(8, int(min(h, w) * 0.20))
-    max_r = int(min(h, w) * 0.75)
-    circles = cv2.HoughCircles(
-        gray,
-        cv2.HOUGH_GRADIENT,
-        dp=1.2,
-        minDist=min(h, w) // 2,
-        param1=100,
-        param2=25,
-        minRadius=min_r,
-        maxRadius=max_r,
-    )
-    if circles is None:
-        return None
-    circles = np.round(circles[0, :]).astype("int")
-    circles = sorted(circles, key=lambda c: c[2], reverse=True)
-    x, y, r = circles[0]
-    cx, cy = w // 2, h // 2
-    center_dist = np.sqrt((x - cx) ** 2 + (y - cy) ** 2) / (r + 1e-6)
-    r_ratio = r / float(min(h, w))
-    return dict(x=int(x), y=int(y), r=int(r), r_ratio=float(r_ratio), center_dist=float(center_dist))
-
-def is_probably_eye_image(file_bytes):
-    img_bgr = decode_bgr_from_bytes(file_bytes)
+def softmax_scores(preds):
+    top1, margin, entropy, order = softmax_scores_batch(np.asarray(preds)[None, :])
+    return float(top1[0]), float(margin[0]), float(entropy[0]), order[0]
+
+# -----------------------------
+# Eye gate: relaxed (fundus circle OR eye OR face) or strict (test.py colour/skin/pupil checks)
+# PREDICT_GATE_ENGINE=fast runs checks cheapest-first with early exit; legacy runs every check
+# -----------------------------
+GATE_VARIANT = os.environ.get("PREDICT_GATE", "relaxed").lower()
+GATE_ENGINE = os.environ.get("PREDICT_GATE_ENGINE", "fast").lower()
+eye_gate = make_gate(GATE_VARIANT, GATE_ENGINE)
+
+def is_probably_eye_image(image):
+    # image: raw bytes or an already decoded DecodedImage
+    img_bgr = decode_bgr_from_bytes(image)
     if img_bgr is None:
         return False, {"decoded": False}
-    details = {"decoded": True, "fundus": None, "outer": None}
-    fundus_info = detect_fundus_circle_relaxed(img_bgr)
-    fundus_ok = False
-    if fundus_info:
-        fundus_ok = (0.20 <= fundus_info["r_ratio"] <= 0.75) and (fundus_info["center_dist"] <= 1.2)
-    details["fundus"] = {"ok": fundus_ok, "info": fundus_info}
-    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
-    gray = cv2.equalizeHist(gray)
-    eyes = eye_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(20, 20))
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=3, minSize=(80, 80))
-    outer_ok = (len(eyes) > 0) or (len(faces) > 0)
-    details["outer"] = {"eyes": int(len(eyes)), "faces": int(len(faces)), "ok": outer_ok}
-    eye_like = bool(fundus_ok or outer_ok)
-    return eye_like, details
-
-def predict_symptoms(text):
+    return eye_gate(img_bgr)
+
+def predict_symptoms(text, models=None):
     if not text or not text.strip():
         return None
-    X = vec.transform([text])
-    idx = symptom_model.predict(X)[0]
-    return le.inverse_transform([idx])[0]
+    return (models or active_models()).symptom.get().predict(text)
+
+def normalize_image_type(raw):
+    image_type = (raw or "fundus").lower()
+    if image_type == "outer_eye":
+        image_type = "outer"
+    return image_type
+
+def image_type_label(image_type):
+    # metric label: a fixed set, so clients cannot create new series
+    return image_type if image_type in ("fundus", "outer") else "other"
+
+def rejection_payload(heuristics):
+    return {
+        "ok": False,
+        "rejected": True,
+        "reason": "Not an eye image (neither fundus nor outer-eye).",
+        "heuristics": heuristics
+    }
+
+def prediction_payload(decided_type, preds, scores, symptom_pred, heuristics, models=None):
+    models = models or active_models()
+    top1, margin, entropy, order = scores
+    classes = class_names(decided_type, models)
+    idx = int(order[0])
+    main = classes[idx]
+    conf = float(preds[idx])
+    top3 = [{"label": classes[int(i)], "confidence": float(preds[int(i)])} for i in order[:3]]
+    agreement = bool(symptom_pred == main) if symptom_pred else False
+    return {
+        "ok": True,
+        "rejected": False,
+        "type": decided_type,
+        "prediction": main,
+        "confidence": conf,
+        "top3": top3,
+        "symptom_pred": symptom_pred,
+        "symptom_agrees": agreement,
+        "ood_scores": {"top1": float(top1), "margin": float(margin), "entropy": float(entropy)},
+        "heuristics": heuristics,
+        "model_version": models.name,
+    }
+
+# -----------------------------
+# Speculative inference: run the CNN concurrently with the eye gate (PREDICT_SPECULATIVE=1)
+# -----------------------------
+SPECULATIVE_ENABLED = os.environ.get("PREDICT_SPECULATIVE", "0").lower() in ("1", "true", "yes")
+speculator = None
+if SPECULATIVE_ENABLED:
+    speculator = SpeculativeExecutor(
+        max_workers=int(os.environ.get("PREDICT_SPECULATIVE_WORKERS", "2")),
+        max_pending=int(os.environ.get("PREDICT_SPECULATIVE_MAX_PENDING", "4")),
+    )
+
+def _infer_decoded(decoded, model_type, models):
+    return run_model(model_type, decoded.model_input(IMG_SIZE), models=models)
+
+# -----------------------------
+# Batch prediction: gate in parallel, one forward pass per model type
+# -----------------------------
+BATCH_MAX_FILES = int(os.environ.get("PREDICT_BATCH_MAX_FILES", "64"))
+GATE_WORKERS = int(os.environ.get("PREDICT_GATE_WORKERS", str(THREAD_BUDGET["gate_workers"])))
+gate_pool = ThreadPoolExecutor(max_workers=max(1, GATE_WORKERS), thread_name_prefix="eye-gate")
+
+def _gate_item(file_bytes, deadline=NO_DEADLINE):
+    # OpenCV releases the GIL, so decode + gate run in parallel across the pool
+    if not file_bytes:
+        return None, False, None, "Empty upload"
+    deadline.check("batch_gate")
+    try:
+        decoded = decode_image(file_bytes)
+    except ImageTooLarge as e:
+        return None, False, None, str(e)
+    eye_like, heuristics = is_probably_eye_image(decoded)
+    return decoded, eye_like, heuristics, None
+
+def predict_many(items, symptoms="", timer=None, deadline=NO_DEADLINE, priority="batch"):
+    """
+    items: [(file_bytes, image_type)] -> list of per-item payloads in input order.
+    Raises DeadlineExceeded if the deadline passes between stages.
+    """
+    models = model_registry.acquire()  # one model version for the whole batch
+    try:
+        stage = timer.stage if timer is not None else (lambda name: nullcontext())
+        results = [None] * len(items)
+        keys = [None] * len(items)
+        for i, (file_bytes, image_type) in enumerate(items):
+            if file_bytes:
+                keys[i], results[i] = cache_get(file_bytes, image_type, symptoms)
+        todo = [i for i, r in enumerate(results) if r is None]
+        profile = profiling.current()
+
+        def gate(i):
+            # gate threads are sampled too when the request is being profiled
+            with profile.attach() if profile is not None else nullcontext():
+                return _gate_item(items[i][0], deadline)
+
+        with stage("batch_gate"):
+            gated = dict(zip(todo, gate_pool.map(gate, todo)))
+        profiling.annotate(images=[{"index": i, "image_type": items[i][1], "image_bytes": len(items[i][0]),
+                                    "width": gated[i][0].width, "height": gated[i][0].height}
+                                   for i in todo if gated[i][0] is not None])
+        accepted = {"fundus": [], "outer": []}
+        for i in todo:
+            image_type = items[i][1]
+            decoded, eye_like, heuristics, error = gated[i]
+            if error:
+                results[i] = {"ok": False, "error": error}
+            elif not eye_like:
+                results[i] = rejection_payload(heuristics)
+                cache_put(keys[i], results[i])
+            else:
+                decided_type = image_type if image_type in ("fundus", "outer") else "fundus"
+                accepted[decided_type].append(i)
+        deadline.check("symptoms")
+        with stage("symptoms"):
+            symptom_pred = predict_symptoms(symptoms, models) if symptoms else None
+        # one inference call for every accepted image (mixed types share the backbone pass when shared)
+        rows = [(i, decided_type) for decided_type, idxs in accepted.items() for i in idxs]
+        pred_of = {}
+        if rows:
+            with stage("batch_preprocess"):
+                stacked = np.concatenate([gated[i][0].model_input(IMG_SIZE) for i, _ in rows], axis=0)
+            with stage("batch_inference"):
+                preds = run_models([t for _, t in rows], stacked, priority, deadline, models)
+                pred_of = dict(zip([i for i, _ in rows], preds))
+        for decided_type, idxs in accepted.items():
+            if not idxs:
+                continue
+            preds = np.stack([pred_of[i] for i in idxs])
+            top1, margin, entropy, order = softmax_scores_batch(preds)
+            for j, i in enumerate(idxs):
+                scores = (top1[j], margin[j], entropy[j], order[j])
+                results[i] = prediction_payload(decided_type, preds[j], scores, symptom_pred, gated[i][2], models)
+                cache_put(keys[i], results[i])
+        return results
+    finally:
+        model_registry.release(models)
+
+# -----------------------------
+# Metrics: per-stage latency histograms + request / rejection / error counters
+# -----------------------------
+SERVER_TIMING_ENABLED = os.environ.get("PREDICT_SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+
+metrics = Registry()
+stage_seconds = metrics.histogram("predict_stage_seconds", "Time spent per pipeline stage", ("stage",))
+request_seconds = metrics.histogram("predict_request_seconds", "End-to-end handler time", ("endpoint",))
+requests_total = metrics.counter("predict_requests_total", "Prediction requests", ("endpoint", "image_type"))
+rejections_total = metrics.counter("predict_rejections_total", "Images rejected by the eye gate", ("image_type",))
+errors_total = metrics.counter("predict_errors_total", "Requests that failed with an error", ("endpoint", "image_type"))
+cache_hits_total = metrics.counter("predict_cache_hits_total", "Responses served from the result cache", ("endpoint",))
+deadline_expired_total = metrics.counter("predict_deadline_expired_total",
+                                         "Requests dropped because the caller's deadline passed",
+                                         ("endpoint", "stage"))
+
+def _component_gauges():
+    # refreshed on every scrape from the components' own stats
+    out = []
+    models = active_models()
+    g = Gauge("predict_component_ready", "1 if the component is loaded and warm", ("component",))
+    for c in models.components:
+        g.set(1 if c.ready else 0, component=c.name)
+    out.append(g)
+    g = Gauge("predict_model_version", "1 for the model version being served", ("version",))
+    g.set(1, version=models.name)
+    out.append(g)
+    g = Gauge("predict_model_registry", "Model reload counters", ("field",))
+    g.set(model_registry.reloads, field="reloads")
+    g.set(model_registry.failures, field="failures")
+    last = model_registry.last_report or {}
+    for k in ("load_s", "overlap_mb"):
+        if last.get(k) is not None:
+            g.set(last[k], field="last_" + k)
+    out.append(g)
+    g = Gauge("predict_model_cold_gap_ms",
+              "First live call and calls after idle periods vs steady-state latency per model", ("model", "field"))
+    per_size = Gauge("predict_model_call_ms", "First and steady-state forward pass latency per batch size",
+                     ("model", "batch_size", "field"))
+    for name, calls in models.calls.items():
+        st = calls.stats()
+        for k in ("warmup_first_ms", "first_call_ms", "steady_ms", "first_call_gap_ms", "after_idle_gap_ms"):
+            if st[k] is not None:
+                g.set(st[k], model=name, field=k)
+        for n, b in st["batch_sizes"].items():
+            for k in ("first_ms", "steady_ms"):
+                if b[k] is not None:
+                    per_size.set(b[k], model=name, batch_size=n, field=k)
+    out += [g, per_size]
+    g = Gauge("predict_keepwarm", "Keep-warm inferences run while idle", ("field",))
+    st = keep_warm.stats()
+    for k in ("runs", "errors", "last_run_ms"):
+        if st[k] is not None:
+            g.set(st[k], field=k)
+    out.append(g)
+    if result_cache is not None:
+        st = result_cache.stats()
+        g = Gauge("predict_result_cache", "Result cache counters", ("field",))
+        for k in ("entries", "bytes", "hits", "disk_hits", "misses", "evictions", "invalidations"):
+            g.set(st[k], field=k)
+        out.append(g)
+    if models.batchers:
+        g = Gauge("predict_batcher", "Micro-batcher counters", ("model", "field"))
+        for name, b in models.batchers.items():
+            st = b.stats()
+            for k in ("batches", "items", "errors", "expired", "preempted", "queued", "mean_batch_size"):
+                g.set(st[k], model=name, field=k)
+        out.append(g)
+    if speculator is not None:
+        st = speculator.stats()
+        g = Gauge("predict_speculation", "Speculative inference counters", ("field",))
+        for k in ("submitted", "used", "discarded", "cancelled", "saturated_fallbacks",
+                  "wasted_inference_wall_s", "wasted_inference_cpu_s"):
+            g.set(st[k], field=k)
+        out.append(g)
+    if models.symptom.ready:
+        st = models.symptom.get().stats()
+        g = Gauge("predict_symptom_cache", "Symptom classifier cache counters", ("field",))
+        for k in ("cache_entries", "hits", "misses"):
+            g.set(st[k], field=k)
+        out.append(g)
+    return out
+
+metrics.add_collector(_component_gauges)
+
+def _memory_gauges():
+    mem = prefork.process_memory() or {}
+    g = Gauge("predict_process_memory_mb", "Memory of this worker process (from /proc smaps_rollup)", ("field",))
+    for k, v in mem.items():
+        g.set(v, field=k[:-3])
+    return [g]
+
+metrics.add_collector(_memory_gauges)
+
+def request_deadline(headers, default_priority="interactive"):
+    """(Deadline, priority class) from the X-Request-Deadline / -Timeout-Ms / -Priority headers."""
+    return Deadline.from_headers(headers), parse_priority(headers.get("x-request-priority"), default_priority)
+
+def _wants_server_timing():
+    return SERVER_TIMING_ENABLED or request.headers.get("X-Server-Timing", "").lower() in ("1", "true", "yes")
+
+def _finish(timer, endpoint, response, status):
+    # observe total handler time and optionally attach a Server-Timing header
+    request_seconds.observe(timer.total(), endpoint=endpoint)
+    resp = jsonify(response)
+    resp.headers["X-Model-Version"] = response.get("model_version") or active_models().name
+    if _wants_server_timing():
+        resp.headers["Server-Timing"] = timer.server_timing()
+    profile = profiling.current()
+    if profile is not None:
+        profile.timer, profile.status = timer, status
+        resp.headers["X-Profile-Id"] = profile.id
+    return resp, status
+
+def _record_gate_timings(timer, heuristics):
+    timings = (heuristics or {}).get("timings_ms", {})
+    for name, ms in timings.items():
+        stage_seconds.observe(ms / 1000.0, stage="gate_" + name)
+    profiling.annotate(gate_timings_ms=timings, gate_decided_by=(heuristics or {}).get("decided_by"))
+
+# -----------------------------
+# Request profiling (PREDICT_PROFILE=1, profiling.py): PREDICT_PROFILE_RATE of the requests,
+# plus those sent with X-Debug-Profile: 1 and the X-Admin-Token, are sampled into
+# PREDICT_PROFILE_DIR. Without PREDICT_ADMIN_TOKEN the header is ignored
+# -----------------------------
+PROFILE_ENABLED = os.environ.get("PREDICT_PROFILE", "0").lower() in ("1", "true", "yes")
+profiler = None
+if PROFILE_ENABLED:
+    profiler = profiling.Profiler(
+        os.environ.get("PREDICT_PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "predict-profiles"),
+        rate=float(os.environ.get("PREDICT_PROFILE_RATE", "0.01")),
+        interval_ms=float(os.environ.get("PREDICT_PROFILE_INTERVAL_MS", "5")),
+        max_files=int(os.environ.get("PREDICT_PROFILE_MAX_FILES", "200")),
+        max_bytes=int(os.environ.get("PREDICT_PROFILE_MAX_BYTES", str(64 * 1024 * 1024))),
+    )
+
+def profiled(endpoint):
+    """Route decorator: profile the request when the profiler picks it."""
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            profile = None
+            if profiler is not None:
+                profile = profiler.start(endpoint, request.headers,
+                                         allow_header=debug_profile_allowed(request.headers))
+            if profile is None:
+                return view(*args, **kwargs)
+            try:
+                with profile.attach():
+                    return view(*args, **kwargs)
+            finally:
+                finish_profile(profile)
+        return wrapper
+    return decorate
+
+def finish_profile(profile):
+    # a profile that cannot be written must not replace the response
+    try:
+        profiler.finish(profile)
+    except Exception:
+        print(f"Could not write profile {profile.id}:\n{traceback.format_exc()}", file=sys.stderr)
+        sys.stderr.flush()
+
+def debug_profile_allowed(headers):
+    # X-Debug-Profile starts a sampler thread per request: only with a configured admin token
+    return bool(ADMIN_TOKEN) and admin_allowed(headers)
+
+def admin_allowed(headers):
+    # PREDICT_ADMIN_TOKEN, if set, guards reloads, profiles and X-Debug-Profile
+    return not ADMIN_TOKEN or hmac.compare_digest(headers.get("x-admin-token", ""), ADMIN_TOKEN)
+
+# -----------------------------
+# Single-image pipeline, split in two so the async server (async_server.py) can
+# run each half on its own bounded executor
+# -----------------------------
+def predict_gate_stage(file_bytes, image_type, symptoms, timer, deadline=NO_DEADLINE, image=None):
+    """
+    Cache lookup, decode and eye gate -> (payload, state). payload is the final
+    answer (cache hit or rejection); otherwise state goes to predict_inference_stage()
+    or discard_inference_stage(), which release the model version it pinned.
+    image: the pixels of file_bytes when they need no decoding (RawImage).
+    Raises DeadlineExceeded at a stage boundary once the deadline has passed.
+    """
+    with timer.stage("cache_lookup"):
+        cache_key, cached = cache_get(file_bytes, image_type, symptoms)
+    if cached is not None:
+        cache_hits_total.inc(endpoint="predict")
+        if cached.get("rejected"):
+            rejections_total.inc(image_type=image_type_label(image_type))
+        return cached, None
+    models = model_registry.acquire()
+    speculative = None
+    try:
+        deadline.check("decode")
+        decoded = image
+        if decoded is None:
+            with timer.stage("decode"):
+                decoded = decode_image(file_bytes)
+        if decoded is not None:
+            profiling.annotate(image_type=image_type, image_bytes=len(file_bytes),
+                               image_width=decoded.width, image_height=decoded.height)
+        decided_type = image_type if image_type in ("fundus", "outer") else "fundus"
+        # optionally start inference before the gate has decided; discarded if the gate rejects
+        if speculator is not None and decoded is not None:
+            speculative = speculator.submit(_infer_decoded, decoded, decided_type, models)
+        if decoded is not None:
+            with timer.stage("gate_resize"):
+                decoded.gate_bgr()
+        if deadline.expired() and speculative is not None:
+            speculator.discard(speculative)
+            speculative = None
+        deadline.check("gate")
+        with timer.stage("gate"):
+            eye_like, heuristics = is_probably_eye_image(decoded)
+    except BaseException:
+        # a gate that raised (or an expired deadline) must not leave speculative work running uncounted
+        if speculative is not None:
+            speculator.discard(speculative)
+        model_registry.release(models)
+        raise
+    _record_gate_timings(timer, heuristics)
+    if not eye_like:
+        if speculative is not None:
+            speculator.discard(speculative)
+        model_registry.release(models)
+        rejections_total.inc(image_type=image_type_label(image_type))
+        payload = rejection_payload(heuristics)
+        cache_put(cache_key, payload)
+        return payload, None
+    return None, (cache_key, decoded, decided_type, heuristics, speculative, models)
+
+def predict_inference_stage(state, symptoms, timer, deadline=NO_DEADLINE, priority="interactive"):
+    """CNN (+ symptom model) for an image that passed the gate -> prediction payload."""
+    cache_key, decoded, decided_type, heuristics, speculative, models = state
+    try:
+        if deadline.expired() and speculative is not None:
+            speculator.discard(speculative)
+        deadline.check("inference")
+        if speculative is not None:
+            with timer.stage("inference_wait"):
+                preds = speculator.use(speculative)
+        else:
+            with timer.stage("preprocess"):
+                batch = decoded.model_input(IMG_SIZE)
+            with timer.stage("inference"):
+                preds = run_model(decided_type, batch, priority, deadline, models)
+        scores = softmax_scores(preds)
+        deadline.check("symptoms")
+        with timer.stage("symptoms"):
+            symptom_pred = predict_symptoms(symptoms, models) if symptoms else None
+        payload = prediction_payload(decided_type, preds, scores, symptom_pred, heuristics, models)
+    finally:
+        model_registry.release(models)
+    cache_put(cache_key, payload)
+    return payload
+
+def discard_inference_stage(state):
+    """Drop a gated request that will not reach predict_inference_stage() (cancels speculative work)."""
+    if not state:
+        return
+    speculative, models = state[4], state[5]
+    if speculative is not None:
+        speculator.discard(speculative)
+    model_registry.release(models)
 
 # -----------------------------
 # Routes
@@ -206,61 +994,305 @@ def root():
 def health():
     return {"status": "ok"}, 200
 
+@app.route("/api/metrics", methods=["GET"])
+def api_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/ready", methods=["GET"])
+def ready():
+    # readiness (vs /api/health liveness): 200 only once every component is loaded and warm
+    models = active_models()
+    status = models.status()
+    is_ready = all(c.ready for c in models.components)
+    return ({"ready": is_ready, "startup": STARTUP_MODE, "model_version": models.name, "components": status},
+            (200 if is_ready else 503))
+
+@app.route("/api/memory", methods=["GET"])
+def memory_stats():
+    # this worker, plus the master and sibling workers when forked from a preloading master
+    return prefork.memory_report(), 200
+
+@app.route("/api/threads", methods=["GET"])
+def thread_stats():
+    return {
+        "budget": THREAD_BUDGET,
+        "applied": THREADS_EFFECTIVE,
+        "current": {
+            "tf_intra_op": tf.config.threading.get_intra_op_parallelism_threads(),
+            "tf_inter_op": tf.config.threading.get_inter_op_parallelism_threads(),
+            "opencv": cv2.getNumThreads(),
+            "gate_workers": GATE_WORKERS,
+        },
+    }, 200
+
+@app.route("/api/batching", methods=["GET"])
+def batching_stats():
+    return {
+        "enabled": BATCHING_ENABLED,
+        "models": {name: b.stats() for name, b in active_models().batchers.items()},
+    }, 200
+
+@app.route("/api/warmpath", methods=["GET"])
+def warmpath_stats():
+    models = active_models()
+    return {
+        "warmup_batch_sizes": WARMUP_BATCH_SIZES if WARMUP_RUNS > 0 else [],
+        "warmup_runs": WARMUP_RUNS,
+        "keepwarm": keep_warm.stats(),
+        "model_version": models.name,
+        "models": {name: calls.stats() for name, calls in models.calls.items()},
+    }, 200
+
+@app.route("/api/backend", methods=["GET"])
+def backend_info():
+    models = active_models()
+    return {
+        "requested": INFERENCE_BACKEND,
+        "variant": MODEL_VARIANT,
+        "model_version": models.name,
+        "models": {name: {"state": c.state, "backend": c.info.get("backend"), "parity": c.info.get("parity")}
+                   for name, c in models.models.items()},
+        "shared_backbone": ({"enabled": True, "state": models.shared.state, **models.shared.info}
+                            if models.shared is not None else {"enabled": False}),
+    }, 200
+
+@app.route("/api/models", methods=["GET"])
+def models_info():
+    return model_registry.status(), 200
+
+@app.route("/api/models/reload", methods=["POST"])
+def models_reload():
+    # {"version": "<name>"} (default: the one models/CURRENT points at); a named version is
+    # also written to models/CURRENT so that every worker's watcher follows.
+    # "wait": false returns 202 at once and the report appears in GET /api/models
+    if not admin_allowed(request.headers):
+        return jsonify({"ok": False, "error": "Forbidden"}), 403
+    body = request.get_json(silent=True) or {}
+    name = body.get("version")
+    if name is not None and name not in registry.list_versions(MODEL_DIR):
+        return jsonify({"ok": False, "error": f"Unknown model version {name!r}",
+                        "available": registry.list_versions(MODEL_DIR)}), 404
+    if not body.get("wait", True):
+        if model_registry.loading:
+            error = f"A reload of '{model_registry.loading}' is already in progress"
+            return jsonify({"ok": False, "error": error}), 409
+        threading.Thread(target=_reload_quietly, args=(name,), name="model-reload", daemon=True).start()
+        return jsonify({"ok": True, "status": "reloading", "version": name}), 202
+    try:
+        return jsonify({"ok": True, **model_registry.reload(name)}), 200
+    except registry.ReloadError as e:
+        busy = model_registry.loading is not None
+        return jsonify({"ok": False, "error": str(e), "active": active_models().name}), (409 if busy else 500)
+
+def _reload_quietly(name):
+    try:
+        model_registry.reload(name)
+    except registry.ReloadError:
+        pass  # recorded in the registry history
+
+@app.route("/api/profiles", methods=["GET"])
+def profiles_list():
+    if profiler is None:
+        return {"enabled": False}, 200
+    if not admin_allowed(request.headers):
+        return jsonify({"ok": False, "error": "Forbidden"}), 403
+    limit = request.args.get("limit", 100, type=int)
+    return {"enabled": True, **profiler.stats(), "profiles": profiler.list(limit)}, 200
+
+@app.route("/api/profiles/<profile_id>", methods=["GET"])
+def profiles_get(profile_id):
+    # ?format=folded: "frame;frame;... count" lines for flamegraph.pl / speedscope
+    if profiler is None:
+        return jsonify({"ok": False, "error": "Profiling is disabled (PREDICT_PROFILE=1)"}), 404
+    if not admin_allowed(request.headers):
+        return jsonify({"ok": False, "error": "Forbidden"}), 403
+    report = profiler.load(profile_id)
+    if report is None:
+        return jsonify({"ok": False, "error": f"No profile {profile_id!r}"}), 404
+    if request.args.get("format") == "folded":
+        text = "".join(f"{stack} {n}\n" for stack, n in report["folded"].items())
+        return Response(text, mimetype="text/plain",
+                        headers={"Content-Disposition": f"attachment; filename={profile_id}.folded"})
+    return jsonify(report), 200
+
+@app.route("/api/speculation", methods=["GET"])
+def speculation_stats():
+    if speculator is None:
+        return {"enabled": False}, 200
+    return {"enabled": True, **speculator.stats()}, 200
+
+@app.route("/api/cache", methods=["GET", "DELETE"])
+def cache_stats():
+    if result_cache is None:
+        return {"enabled": False}, 200
+    if request.method == "DELETE":
+        result_cache.clear()
+    return {"enabled": True, **result_cache.stats()}, 200
+
 @app.route("/api/predict", methods=["POST"])
+@profiled("predict")
 def api_predict():
+    timer = StageTimer(stage_seconds)
+    image_type = "unknown"
+    deadline, priority = request_deadline(request.headers)
     try:
         if "file" not in request.files:
-            return jsonify({"ok": False, "error": "No file uploaded"}), 400
+            return _finish(timer, "predict", {"ok": False, "error": "No file uploaded"}, 400)
         fs = request.files["file"]
-        image_type = (request.form.get("image_type", "fundus") or "fundus").lower()
-        if image_type == "outer_eye":
-            image_type = "outer"
+        image_type = normalize_image_type(request.form.get("image_type", "fundus"))
+        requests_total.inc(endpoint="predict", image_type=image_type_label(image_type))
         symptoms = (request.form.get("symptoms", "") or "").strip()
-        fs.stream.seek(0)
-        file_bytes = fs.read()
+        with timer.stage("upload_read"):
+            fs.stream.seek(0)
+            file_bytes = fs.read()
         if not file_bytes:
-            return jsonify({"ok": False, "error": "Empty upload"}), 400
-        eye_like, heuristics = is_probably_eye_image(file_bytes)
-        if not eye_like:
-            return jsonify({
-                "ok": False,
-                "rejected": True,
-                "reason": "Not an eye image (neither fundus nor outer-eye).",
-                "heuristics": heuristics
-            }), 200
-        decided_type = image_type if image_type in ("fundus", "outer") else "fundus"
-        batch = preprocess_image_bytes(file_bytes)
-        if decided_type == "fundus":
-            preds = fundus_model.predict(batch, verbose=0)[0]
-            classes = fundus_classes
-        else:
-            preds = outer_model.predict(batch, verbose=0)[0]
-            classes = outer_classes
-        top1, margin, entropy, order = softmax_scores(preds)
-        idx = int(order[0])
-        main = classes[idx]
-        conf = float(preds[idx])
-        top3 = [{"label": classes[int(i)], "confidence": float(preds[int(i)])} for i in order[:3]]
-        symptom_pred = predict_symptoms(symptoms) if symptoms else None
-        agreement = bool(symptom_pred == main) if symptom_pred else False
-        return jsonify({
-            "ok": True,
-            "rejected": False,
-            "type": decided_type,
-            "prediction": main,
-            "confidence": conf,
-            "top3": top3,
-            "symptom_pred": symptom_pred,
-            "symptom_agrees": agreement,
-            "ood_scores": {"top1": top1, "margin": margin, "entropy": entropy},
-            "heuristics": heuristics
-        }), 200
+            return _finish(timer, "predict", {"ok": False, "error": "Empty upload"}, 400)
+        payload, state = predict_gate_stage(file_bytes, image_type, symptoms, timer, deadline)
+        if payload is None:
+            payload = predict_inference_stage(state, symptoms, timer, deadline, priority)
+        return _finish(timer, "predict", payload, 200)
+    except ImageTooLarge as e:
+        return _finish(timer, "predict", {"ok": False, "error": str(e)}, 413)
+    except DeadlineExceeded as e:
+        deadline_expired_total.inc(endpoint="predict", stage=e.stage)
+        return _finish(timer, "predict", {"ok": False, "error": str(e)}, 504)
+    except Exception as e:
+        errors_total.inc(endpoint="predict", image_type=image_type_label(image_type))
+        tb = traceback.format_exc()
+        print(tb, file=sys.stderr)
+        sys.stderr.flush()
+        return _finish(timer, "predict", {"ok": False, "error": str(e)}, 500)
+
+def _read_at_most(stream, limit):
+    # up to limit bytes of a WSGI input stream (fewer only where the body ends)
+    chunks, n = [], 0
+    while n < limit:
+        chunk = stream.read(limit - n)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        n += len(chunk)
+    return b"".join(chunks)
+
+# Pre-resized pixels from the Node backend, no image codec on either side. Body: the model
+# input as raw uint8 RGB, row-major (X-Tensor-Shape: 224,224,3, X-Tensor-Dtype: uint8),
+# optionally followed by a gate thumbnail (X-Gate-Shape: H,W,3, longest side <= 640; without
+# one the gate runs on the model input). image_type is a query parameter; the symptom text
+# comes URL-encoded in X-Symptoms, so it stays out of URLs and access logs.
+# Same response as /api/predict.
+@app.route("/api/predict/tensor", methods=["POST"])
+@profiled("predict_tensor")
+def api_predict_tensor():
+    timer = StageTimer(stage_seconds)
+    image_type = normalize_image_type(request.args.get("image_type", "fundus"))
+    deadline, priority = request_deadline(request.headers)
+    try:
+        requests_total.inc(endpoint="predict_tensor", image_type=image_type_label(image_type))
+        symptoms = unquote(request.headers.get("X-Symptoms", "") or "").strip()
+        shape = parse_shape(request.headers.get("X-Tensor-Shape"))
+        dtype = request.headers.get("X-Tensor-Dtype", "uint8")
+        gate_header = request.headers.get("X-Gate-Shape")
+        gate_shape = parse_shape(gate_header, "X-Gate-Shape") if gate_header else None
+        expected = RawImage.expected_bytes(shape, dtype, gate_shape)
+        # refuse a mismatched body before reading it
+        if request.content_length is not None and request.content_length != expected:
+            raise TensorFormatError(f"Content-Length is {request.content_length}; "
+                                    f"the shape headers describe {expected} bytes")
+        with timer.stage("upload_read"):
+            # without Content-Length (chunked) read one byte past the expected size, never the whole body
+            body = _read_at_most(request.stream, expected + 1)
+        if len(body) > expected:
+            raise TensorFormatError(f"Body is longer than the {expected} bytes the shape headers describe")
+        image = RawImage.from_buffer(body, shape, dtype, gate_shape)
+        payload, state = predict_gate_stage(body, image_type, symptoms, timer, deadline, image=image)
+        if payload is None:
+            payload = predict_inference_stage(state, symptoms, timer, deadline, priority)
+        return _finish(timer, "predict_tensor", payload, 200)
+    except TensorFormatError as e:
+        return _finish(timer, "predict_tensor", {"ok": False, "error": str(e)}, 400)
+    except DeadlineExceeded as e:
+        deadline_expired_total.inc(endpoint="predict_tensor", stage=e.stage)
+        return _finish(timer, "predict_tensor", {"ok": False, "error": str(e)}, 504)
+    except Exception as e:
+        errors_total.inc(endpoint="predict_tensor", image_type=image_type_label(image_type))
+        tb = traceback.format_exc()
+        print(tb, file=sys.stderr)
+        sys.stderr.flush()
+        return _finish(timer, "predict_tensor", {"ok": False, "error": str(e)}, 500)
+
+@app.route("/api/symptoms", methods=["POST"])
+def api_symptoms():
+    # bulk symptom classification: {"texts": [...], "top_k": 3}
+    try:
+        body = request.get_json(silent=True) or {}
+        texts = body.get("texts")
+        if texts is None and "text" in body:
+            texts = [body["text"]]
+        if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+            return jsonify({"ok": False, "error": "Expected JSON body with a 'texts' list of strings"}), 400
+        k = body.get("top_k", 3)
+        if isinstance(k, bool) or not isinstance(k, int) or k < 1:
+            return jsonify({"ok": False, "error": "'top_k' must be a positive integer"}), 400
+        clf = active_models().symptom.get()
+        tops = clf.top_k(texts, k=k)
+        results = [{"text": t, "prediction": p, "top_k": top}
+                   for t, p, top in zip(texts, clf.predict_many(texts), tops)]
+        return jsonify({"ok": True, "results": results, "cache": clf.stats()}), 200
     except Exception as e:
         tb = traceback.format_exc()
         print(tb, file=sys.stderr)
         sys.stderr.flush()
         return jsonify({"ok": False, "error": str(e)}), 500
 
+@app.route("/api/predict/batch", methods=["POST"])
+@profiled("predict_batch")
+def api_predict_batch():
+    timer = StageTimer(stage_seconds)
+    deadline, priority = request_deadline(request.headers, default_priority="batch")
+    try:
+        files = request.files.getlist("files") or request.files.getlist("file")
+        if not files:
+            return _finish(timer, "predict_batch", {"ok": False, "error": "No files uploaded"}, 400)
+        if len(files) > BATCH_MAX_FILES:
+            return _finish(timer, "predict_batch", {"ok": False, "error": f"Too many files (max {BATCH_MAX_FILES})"}, 400)
+        # image_type may be sent once for the whole batch or once per file
+        types = [normalize_image_type(t) for t in request.form.getlist("image_type")]
+        if len(types) != len(files):
+            types = [types[0] if types else "fundus"] * len(files)
+        symptoms = (request.form.get("symptoms", "") or "").strip()
+        items = []
+        with timer.stage("upload_read"):
+            for fs, t in zip(files, types):
+                fs.stream.seek(0)
+                items.append((fs.read(), t))
+        results = predict_many(items, symptoms, timer=timer, deadline=deadline, priority=priority)
+        for i, (fs, r, t) in enumerate(zip(files, results, types)):
+            requests_total.inc(endpoint="predict_batch", image_type=image_type_label(t))
+            if r.get("rejected"):
+                rejections_total.inc(image_type=image_type_label(t))
+            elif not r.get("ok"):
+                errors_total.inc(endpoint="predict_batch", image_type=image_type_label(t))
+            r["index"] = i
+            r["filename"] = fs.filename
+        return _finish(timer, "predict_batch", {"ok": True, "count": len(results), "results": results}, 200)
+    except DeadlineExceeded as e:
+        deadline_expired_total.inc(endpoint="predict_batch", stage=e.stage)
+        return _finish(timer, "predict_batch", {"ok": False, "error": str(e)}, 504)
+    except Exception as e:
+        errors_total.inc(endpoint="predict_batch", image_type="unknown")
+        tb = traceback.format_exc()
+        print(tb, file=sys.stderr)
+        sys.stderr.flush()
+        return _finish(timer, "predict_batch", {"ok": False, "error": str(e)}, 500)
+
+# -----------------------------
+# App factory
+# -----------------------------
+def create_app(startup=None):
+    """Start (or load) the model components per PREDICT_STARTUP and return the WSGI app."""
+    start_components(startup)
+    return app
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "5000"))
     app.run(host="0.0.0.0", port=port, debug=False)
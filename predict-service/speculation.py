@@ -0,0 +1,95 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SpeculativeExecutor:
+    """
+    Run work (model inference) speculatively while the caller does something else
+    (the eye gate). The pool and the number of in-flight tasks are bounded: when
+    saturated, submit() returns None and the caller falls back to running the
+    work itself after the gate. Work whose result is thrown away is accounted
+    for as waste (wall time and calling-thread CPU time of the task).
+    """
+
+    def __init__(self, max_workers=2, max_pending=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(self.max_workers, int(max_pending or self.max_workers * 2))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="speculative")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.used = 0
+        self.discarded = 0
+        self.cancelled = 0
+        self.saturated = 0
+        self.wasted_wall_s = 0.0
+        self.wasted_cpu_s = 0.0
+        self.used_wall_s = 0.0
+
+    def _run(self, fn, args):
+        t0 = time.perf_counter()
+        c0 = time.thread_time()
+        try:
+            return fn(*args), time.perf_counter() - t0, time.thread_time() - c0
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.saturated += 1
+                return None
+            self._pending += 1
+            self.submitted += 1
+        try:
+            return self._pool.submit(self._run, fn, args)
+        except RuntimeError:
+            with self._lock:
+                self._pending -= 1
+                self.submitted -= 1
+            return None
+
+    def use(self, fut, timeout=None):
+        """Block for a speculative result that is needed."""
+        result, wall_s, _ = fut.result(timeout=timeout)
+        with self._lock:
+            self.used += 1
+            self.used_wall_s += wall_s
+        return result
+
+    def discard(self, fut):
+        """Throw a speculative result away without waiting; cancels it if it has not started."""
+        if fut.cancel():
+            with self._lock:
+                self._pending -= 1
+                self.cancelled += 1
+            return
+        fut.add_done_callback(self._record_waste)
+
+    def _record_waste(self, fut):
+        with self._lock:
+            self.discarded += 1
+            if fut.exception() is None:
+                _, wall_s, cpu_s = fut.result()
+                self.wasted_wall_s += wall_s
+                self.wasted_cpu_s += cpu_s
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._pending,
+                "submitted": self.submitted,
+                "used": self.used,
+                "discarded": self.discarded,
+                "cancelled": self.cancelled,
+                "saturated_fallbacks": self.saturated,
+                "wasted_inference_wall_s": self.wasted_wall_s,
+                "wasted_inference_cpu_s": self.wasted_cpu_s,
+                "used_inference_wall_s": self.used_wall_s,
+                "waste_ratio": (self.wasted_wall_s / (self.wasted_wall_s + self.used_wall_s))
+                if (self.wasted_wall_s + self.used_wall_s) > 0 else 0.0,
+            }
@@ -0,0 +1,344 @@
+"""
+Pickle-free export of the symptom model (TF-IDF vectorizer + RandomForest + label encoder).
+
+    python symptom_export.py [--out models/symptom_export] [--check texts.txt]
+
+Export (needs scikit-learn once, to unpickle) writes a directory of plain .npy
+arrays plus meta.json:
+
+  vocab_terms.npy / vocab_columns.npy   sorted vocabulary and its column indices
+  idf.npy                               idf weights
+  tree_*.npy                            all trees' nodes concatenated (children,
+                                        feature, threshold, normalised leaf values)
+  meta.json                             vectorizer settings, classes, source fingerprint
+
+load_exported() memory-maps the arrays (workers share the pages) and returns
+duck-typed vectorizer / model / label-encoder objects for SymptomClassifier,
+without importing scikit-learn. Scoring reproduces sklearn's arithmetic
+(float32 features, trees summed in order) so predictions are identical;
+--check verifies that against the pickles.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, "models")
+EXPORT_DIR = os.path.join(MODEL_DIR, "symptom_export")
+SYMPTOM_MODEL_PATH = os.path.join(MODEL_DIR, "symptom_model.pkl")
+COMPONENTS_PATH = os.path.join(MODEL_DIR, "components.pkl")
+FORMAT_VERSION = 1
+
+
+def source_fingerprint(paths):
+    # content hashes, not mtimes: checkouts and copies must not make an export look stale
+    out = []
+    for p in paths:
+        h = hashlib.sha256()
+        with open(p, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        out.append({"name": os.path.basename(p), "size": os.path.getsize(p), "sha256": h.hexdigest()})
+    return out
+
+
+def is_fresh(export_dir=EXPORT_DIR, sources=(SYMPTOM_MODEL_PATH, COMPONENTS_PATH)):
+    """True if export_dir holds an export of exactly these pickles."""
+    try:
+        with open(os.path.join(export_dir, "meta.json")) as f:
+            meta = json.load(f)
+        return meta.get("format_version") == FORMAT_VERSION and meta.get("sources") == source_fingerprint(sources)
+    except (OSError, ValueError):
+        return False
+
+
+# -----------------------------
+# Export (scikit-learn needed here only)
+# -----------------------------
+def _class_list(components, list_key, dict_key):
+    if list_key in components:
+        return [str(c) for c in components[list_key]]
+    d = components.get(dict_key)
+    if isinstance(d, dict):
+        try:
+            keys = sorted(d.keys(), key=lambda k: int(k))
+        except Exception:
+            keys = sorted(d.keys())
+        return [str(d[k]) for k in keys]
+    return None
+
+
+def export(out_dir=EXPORT_DIR, symptom_model_path=SYMPTOM_MODEL_PATH, components_path=COMPONENTS_PATH):
+    import pickle
+
+    with open(components_path, "rb") as f:
+        components = pickle.load(f)
+    with open(symptom_model_path, "rb") as f:
+        forest = pickle.load(f)
+    vec = components.get("vectorizer", components.get("tfidf_vectorizer"))
+    le = components.get("label_encoder", components.get("le_text"))
+    if vec is None or le is None:
+        raise KeyError("Missing vectorizer or label encoder in components.pkl")
+    if vec.analyzer != "word" or vec.tokenizer is not None or vec.preprocessor is not None \
+            or vec.strip_accents is not None or vec.stop_words is not None:
+        raise ValueError("Only word analyzers with the default tokenizer/preprocessor can be exported")
+    if not hasattr(forest, "estimators_"):
+        raise ValueError(f"Unsupported symptom model {type(forest).__name__}; expected a tree ensemble classifier")
+
+    terms = sorted(vec.vocabulary_)
+    arrays = {
+        "vocab_terms": np.array(terms, dtype=str),
+        "vocab_columns": np.array([vec.vocabulary_[t] for t in terms], dtype=np.int32),
+        "idf": np.asarray(vec.idf_, dtype=np.float64) if vec.use_idf else np.ones(len(terms)),
+    }
+    roots, left, right, feature, threshold, values = [], [], [], [], [], []
+    offset = 0
+    n_classes = len(forest.classes_)
+    for est in forest.estimators_:
+        t = est.tree_
+        roots.append(offset)
+        # leaves keep -1; internal children become global node indices
+        left.append(np.where(t.children_left >= 0, t.children_left + offset, -1))
+        right.append(np.where(t.children_right >= 0, t.children_right + offset, -1))
+        feature.append(t.feature)
+        threshold.append(t.threshold)
+        # DecisionTreeClassifier.predict_proba: value rows normalised to sum to 1
+        v = np.array(t.value[:, 0, :n_classes], dtype=np.float64)
+        norm = v.sum(axis=1)[:, np.newaxis]
+        norm[norm == 0.0] = 1.0
+        values.append(v / norm)
+        offset += t.node_count
+    arrays.update({
+        "tree_roots": np.array(roots, dtype=np.int64),
+        "tree_left": np.concatenate(left).astype(np.int64),
+        "tree_right": np.concatenate(right).astype(np.int64),
+        "tree_feature": np.concatenate(feature).astype(np.int64),
+        "tree_threshold": np.concatenate(threshold).astype(np.float64),
+        "tree_value": np.concatenate(values),
+        "forest_classes": np.asarray(forest.classes_),
+    })
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "vectorizer": {
+            "lowercase": bool(vec.lowercase),
+            "token_pattern": vec.token_pattern,
+            "ngram_range": list(vec.ngram_range),
+            "binary": bool(vec.binary),
+            "norm": vec.norm,
+            "sublinear_tf": bool(vec.sublinear_tf),
+            "n_features": len(terms),
+        },
+        "label_classes": [str(c) for c in le.classes_],
+        "fundus_classes": _class_list(components, "fundus_classes", "fundus_class_dict"),
+        "outer_classes": _class_list(components, "outer_eye_classes", "outer_eye_class_dict"),
+        "n_trees": len(roots),
+        "sources": source_fingerprint([symptom_model_path, components_path]),
+    }
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in arrays.items():
+        tmp = os.path.join(out_dir, name + ".tmp.npy")
+        np.save(tmp, arr, allow_pickle=False)
+        os.replace(tmp, os.path.join(out_dir, name + ".npy"))
+    # meta.json last: it is what marks the export as complete and fresh
+    tmp = os.path.join(out_dir, "meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(out_dir, "meta.json"))
+    return meta
+
+
+# -----------------------------
+# Loader / scorer (numpy only)
+# -----------------------------
+class ExportedVectorizer:
+    """TfidfVectorizer.transform for word analyzers; returns a dense (n, n_features) float64 array."""
+
+    analyzer = "word"
+
+    def __init__(self, config, terms, columns, idf):
+        self.lowercase = config["lowercase"]
+        self.ngram_range = tuple(config["ngram_range"])
+        self.binary = config["binary"]
+        self.norm = config["norm"]
+        self.sublinear_tf = config["sublinear_tf"]
+        self.n_features = config["n_features"]
+        self._token_re = re.compile(config["token_pattern"])
+        self.terms = terms
+        self.columns = columns
+        self.idf = idf
+
+    def _analyze(self, doc):
+        if self.lowercase:
+            doc = doc.lower()
+        tokens = self._token_re.findall(doc)
+        lo, hi = self.ngram_range
+        grams = list(tokens) if lo == 1 else []
+        for n in range(max(2, lo), hi + 1):
+            grams.extend(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return grams
+
+    def _counts(self, doc):
+        grams = self._analyze(doc)
+        counts = {}
+        if not grams:
+            return counts
+        pos = np.searchsorted(self.terms, grams)
+        for g, p in zip(grams, pos):
+            if p < len(self.terms) and self.terms[p] == g:
+                col = int(self.columns[p])
+                counts[col] = counts.get(col, 0) + 1
+        return counts
+
+    def transform(self, docs):
+        X = np.zeros((len(docs), self.n_features), dtype=np.float64)
+        for i, doc in enumerate(docs):
+            counts = self._counts(doc)
+            if not counts:
+                continue
+            cols = sorted(counts)
+            vals = [1.0 if self.binary else float(counts[c]) for c in cols]
+            if self.sublinear_tf:
+                vals = [float(np.log(v)) + 1.0 for v in vals]
+            vals = [v * float(self.idf[c]) for v, c in zip(vals, cols)]
+            # same accumulation order as sklearn's in-place CSR row normalisation
+            if self.norm == "l2":
+                s = 0.0
+                for v in vals:
+                    s += v * v
+                s = math.sqrt(s)
+            elif self.norm == "l1":
+                s = 0.0
+                for v in vals:
+                    s += abs(v)
+            else:
+                s = 0.0
+            if s != 0.0:
+                vals = [v / s for v in vals]
+            X[i, cols] = vals
+        return X
+
+
+class ExportedForest:
+    """RandomForestClassifier.predict / predict_proba over the exported node arrays."""
+
+    def __init__(self, roots, left, right, feature, threshold, value, classes):
+        self.roots = roots
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.classes_ = classes
+
+    def apply(self, X):
+        # trees read float32 features, as sklearn's tree code does
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, np.newaxis]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        while True:
+            left = self.left[node]
+            internal = left >= 0
+            if not internal.any():
+                return node
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(internal, np.where(go_left, left, self.right[node]), node)
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        # trees are summed one after another, like the forest's accumulator
+        proba = np.cumsum(self.value[leaves], axis=1)[:, -1, :]
+        return proba / len(self.roots)
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+
+class ExportedLabelEncoder:
+    def __init__(self, classes):
+        self.classes_ = np.array(classes)
+
+    def inverse_transform(self, y):
+        return self.classes_[np.asarray(y, dtype=np.int64)]
+
+
+def load_exported(export_dir=EXPORT_DIR, mmap=True):
+    """(vectorizer, model, label_encoder, meta) from an export directory, without scikit-learn."""
+    with open(os.path.join(export_dir, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported symptom export format {meta.get('format_version')}")
+    mode = "r" if mmap else None
+
+    def arr(name):
+        return np.load(os.path.join(export_dir, name + ".npy"), mmap_mode=mode, allow_pickle=False)
+
+    vec = ExportedVectorizer(meta["vectorizer"], arr("vocab_terms"), arr("vocab_columns"), arr("idf"))
+    forest = ExportedForest(arr("tree_roots"), arr("tree_left"), arr("tree_right"), arr("tree_feature"),
+                            arr("tree_threshold"), arr("tree_value"), arr("forest_classes"))
+    return vec, forest, ExportedLabelEncoder(meta["label_classes"]), meta
+
+
+def check_against_pickles(texts, export_dir=EXPORT_DIR, symptom_model_path=SYMPTOM_MODEL_PATH,
+                          components_path=COMPONENTS_PATH):
+    """Compare labels and probabilities of the export with the pickled sklearn objects."""
+    import pickle
+
+    with open(components_path, "rb") as f:
+        components = pickle.load(f)
+    with open(symptom_model_path, "rb") as f:
+        forest = pickle.load(f)
+    vec = components.get("vectorizer", components.get("tfidf_vectorizer"))
+    le = components.get("label_encoder", components.get("le_text"))
+    evec, eforest, ele, _ = load_exported(export_dir)
+    X = vec.transform(texts)
+    ref_labels = le.inverse_transform(forest.predict(X))
+    ref_proba = forest.predict_proba(X)
+    E = evec.transform(texts)
+    labels = ele.inverse_transform(eforest.predict(E))
+    proba = eforest.predict_proba(E)
+    mismatches = [t for t, a, b in zip(texts, ref_labels, labels) if a != b]
+    return {
+        "texts": len(texts),
+        "label_mismatches": len(mismatches),
+        "examples": mismatches[:5],
+        "max_tfidf_abs_diff": float(np.abs(X.toarray() - E).max()) if len(texts) else 0.0,
+        "max_proba_abs_diff": float(np.abs(ref_proba - proba).max()) if len(texts) else 0.0,
+        "ok": not mismatches,
+    }
+
+
+def default_check_texts(export_dir=EXPORT_DIR, n_random=500, seed=0):
+    """Every vocabulary term, common phrasings, and random term mixes."""
+    terms = [str(t) for t in np.load(os.path.join(export_dir, "vocab_terms.npy"))]
+    texts = list(terms) + ["", "blurred vision", "red itchy eyes with discharge", "EYE PAIN  and halos",
+                           "gritty dry eyes worse in the evening", "cloudy vision, glare at night!"]
+    rng = np.random.default_rng(seed)
+    for _ in range(n_random):
+        k = int(rng.integers(1, 8))
+        texts.append(" ".join(rng.choice(terms, size=k)))
+    return texts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--out", default=EXPORT_DIR)
+    ap.add_argument("--check", help="file with one symptom text per line (default: generated texts)")
+    args = ap.parse_args()
+    meta = export(args.out)
+    print(f"Exported {meta['n_trees']} trees, {meta['vectorizer']['n_features']} terms -> {args.out}")
+    if args.check:
+        with open(args.check) as f:
+            texts = [line.rstrip("\n") for line in f]
+    else:
+        texts = default_check_texts(args.out)
+    result = check_against_pickles(texts, args.out)
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result["ok"] else 1)
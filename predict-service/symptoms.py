@@ -0,0 +1,145 @@
+"""
+Symptom-text classification (TF-IDF vectorizer + classifier + label encoder).
+
+Usable without TensorFlow:
+
+    python symptoms.py "blurred vision" "red itchy eyes" [--top-k 3] [--exported]
+"""
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SymptomClassifier:
+    """
+    Wraps the pickled vectorizer / model / label encoder with:
+      - a normalised-text LRU cache (the form sends the same phrases over and over),
+      - predict_many(): one sparse transform + one predict for all cache misses,
+      - top_k(): label probabilities when the model has predict_proba.
+    Normalisation only removes differences the vectorizer ignores anyway
+    (case when lowercase=True, runs of whitespace for word analyzers).
+    """
+
+    def __init__(self, vectorizer, model, label_encoder, cache_size=4096):
+        self.vec = vectorizer
+        self.model = model
+        self.le = label_encoder
+        self.cache_size = int(cache_size)
+        self._lowercase = bool(getattr(vectorizer, "lowercase", False))
+        self._collapse_ws = getattr(vectorizer, "analyzer", None) == "word"
+        self._labels = None
+        if hasattr(model, "predict_proba") and hasattr(model, "classes_"):
+            self._labels = list(label_encoder.inverse_transform(model.classes_))
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # normalised text -> (label, proba row or None)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, symptom_model_path, components_path, cache_size=4096):
+        with open(components_path, "rb") as f:
+            components = pickle.load(f)
+        with open(symptom_model_path, "rb") as f:
+            model = pickle.load(f)
+        vec = components.get("vectorizer", components.get("tfidf_vectorizer"))
+        le = components.get("label_encoder", components.get("le_text"))
+        if vec is None or le is None:
+            raise KeyError("Missing vectorizer or label encoder in components.pkl")
+        return cls(vec, model, le, cache_size=cache_size)
+
+    @classmethod
+    def load_exported(cls, export_dir, cache_size=4096):
+        """From a symptom_export.py directory: no pickle, no scikit-learn import."""
+        from symptom_export import load_exported
+
+        vec, model, le, _ = load_exported(export_dir)
+        return cls(vec, model, le, cache_size=cache_size)
+
+    def normalize(self, text):
+        text = (text or "").strip()
+        if self._collapse_ws:
+            text = " ".join(text.split())
+        if self._lowercase:
+            text = text.lower()
+        return text
+
+    def _classify(self, norm_texts, with_proba):
+        # one sparse transform for the whole batch; labels always come from model.predict
+        X = self.vec.transform(norm_texts)
+        labels = self.le.inverse_transform(self.model.predict(X))
+        proba = self.model.predict_proba(X) if (with_proba and self._labels is not None) else None
+        return [(labels[i], proba[i] if proba is not None else None) for i in range(len(norm_texts))]
+
+    def _lookup_many(self, texts, with_proba=False):
+        norms = [self.normalize(t) for t in texts]
+        results = {}
+        with self._lock:
+            for n in norms:
+                if not n or n in results or n not in self._cache:
+                    continue
+                entry = self._cache[n]
+                if with_proba and self._labels is not None and entry[1] is None:
+                    continue
+                self._cache.move_to_end(n)
+                results[n] = entry
+                self.hits += 1
+        missing = sorted({n for n in norms if n and n not in results})
+        if missing:
+            fresh = dict(zip(missing, self._classify(missing, with_proba)))
+            results.update(fresh)
+            with self._lock:
+                self.misses += len(missing)
+                for n, v in fresh.items():
+                    self._cache[n] = v
+                    self._cache.move_to_end(n)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return [results.get(n) if n else None for n in norms]
+
+    def predict(self, text):
+        """Label for one text (None for empty text)."""
+        r = self._lookup_many([text])[0]
+        return r[0] if r else None
+
+    def predict_many(self, texts):
+        return [r[0] if r else None for r in self._lookup_many(texts)]
+
+    def top_k(self, texts, k=3):
+        """[[{"label", "probability"}, ...] per text]; probability is None if the model has no predict_proba."""
+        out = []
+        for r in self._lookup_many(texts, with_proba=True):
+            if r is None:
+                out.append([])
+            elif r[1] is None:
+                out.append([{"label": r[0], "probability": None}])
+            else:
+                order = np.argsort(r[1])[::-1][:k]
+                out.append([{"label": str(self._labels[i]), "probability": float(r[1][i])} for i in order])
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {"cache_entries": len(self._cache), "cache_size": self.cache_size,
+                    "hits": self.hits, "misses": self.misses,
+                    "has_proba": self._labels is not None}
+
+
+if __name__ == "__main__":
+    base = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+    k = 3
+    args = sys.argv[1:]
+    if "--top-k" in args:
+        i = args.index("--top-k")
+        k = int(args[i + 1])
+        del args[i:i + 2]
+    if "--exported" in args:
+        args.remove("--exported")
+        clf = SymptomClassifier.load_exported(os.path.join(base, "symptom_export"))
+    else:
+        clf = SymptomClassifier.load(os.path.join(base, "symptom_model.pkl"), os.path.join(base, "components.pkl"))
+    for text, top in zip(args, clf.top_k(args, k=k)):
+        print(text, "->", top)
@@ -0,0 +1,30 @@
+"""
+Tests for the predict service: python -m pytest predict-service/tests
+
+None of them need the model files. server.py is imported in app-factory mode
+(nothing loads at import) against a models directory of empty placeholders,
+and the endpoint tests only exercise requests that are rejected before
+inference.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import registry  # noqa: E402
+
+# server.py checks at import that the model files exist
+_PLACEHOLDER_MODELS = tempfile.mkdtemp(prefix="predict-test-models-")
+atexit.register(shutil.rmtree, _PLACEHOLDER_MODELS, True)
+for _name in registry.MODEL_FILES:
+    open(os.path.join(_PLACEHOLDER_MODELS, _name), "wb").close()
+
+# importing server.py must not load models or start background threads
+os.environ.setdefault("PREDICT_MODEL_DIR", _PLACEHOLDER_MODELS)
+os.environ.setdefault("PREDICT_APP_FACTORY", "1")
+os.environ.setdefault("PREDICT_MODEL_WATCH_S", "0")
+os.environ.setdefault("PREDICT_KEEPWARM_S", "0")
+os.environ.setdefault("PREDICT_CACHE", "0")
@@ -0,0 +1,157 @@
+"""async_server under uvicorn, over raw sockets: framing edge cases, body limits and shedding."""
+import json
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+
+import async_server
+
+
+@pytest.fixture(scope="module")
+def port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        free = s.getsockname()[1]
+    config = uvicorn.Config(async_server.app, host="127.0.0.1", port=free, http="h11", lifespan="off",
+                            timeout_keep_alive=30, h11_max_incomplete_event_size=async_server.MAX_HEADER_BYTES,
+                            log_level="error")
+    srv = uvicorn.Server(config)
+    thread = threading.Thread(target=srv.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not srv.started and time.time() < deadline:
+        time.sleep(0.01)
+    assert srv.started
+    yield free
+    srv.should_exit = True
+    thread.join(5)
+
+
+def _read_response(f):
+    status_line = f.readline()
+    if not status_line:
+        return None
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = f.readline().rstrip(b"\r\n")
+        if not line:
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = f.read(int(headers.get("content-length", 0)))
+    return status, headers, body
+
+
+def _send(port, *requests):
+    """Send raw requests on one connection; returns one (status, headers, body) per response read."""
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+        f = sock.makefile("rb")
+        out = []
+        for raw in requests:
+            sock.sendall(raw)
+            r = _read_response(f)
+            if r is None:
+                break
+            out.append(r)
+        return out
+
+
+def _post(path, body=b"", headers=()):
+    head = [f"POST {path} HTTP/1.1", "Host: test"] + list(headers)
+    return ("\r\n".join(head) + "\r\n\r\n").encode() + body
+
+
+def _chunked(*parts):
+    return b"".join(b"%x\r\n%s\r\n" % (len(p), p) for p in parts) + b"0\r\n\r\n"
+
+
+SYMPTOMS_BAD = b'{"texts": 5}'
+
+
+def test_content_length_body(port):
+    [(status, _, body)] = _send(port, _post("/api/symptoms", SYMPTOMS_BAD, [
+        "Content-Type: application/json", f"Content-Length: {len(SYMPTOMS_BAD)}"]))
+    # the route saw the whole JSON body
+    assert status == 400
+    assert "'texts' list" in json.loads(body)["error"]
+
+
+def test_chunked_body_is_reassembled(port):
+    [(status, _, body)] = _send(port, _post("/api/symptoms", _chunked(SYMPTOMS_BAD[:5], SYMPTOMS_BAD[5:]), [
+        "Content-Type: application/json", "Transfer-Encoding: chunked"]))
+    assert status == 400
+    assert "'texts' list" in json.loads(body)["error"]
+
+
+def test_chunked_tensor_length_checked(port):
+    body = _chunked(b"\0" * 1000, b"\0" * 24)
+    [(status, _, resp)] = _send(port, _post("/api/predict/tensor", body, [
+        "X-Tensor-Shape: 224,224,3", "Transfer-Encoding: chunked"]))
+    assert status == 400
+    assert "is 1024" in json.loads(resp)["error"]
+
+
+@pytest.mark.parametrize("headers,body", [
+    (["Transfer-Encoding: chunked"], b"zz\r\nhello\r\n0\r\n\r\n"),              # bad chunk size
+    (["Transfer-Encoding: chunked"], b"5\r\nhello world\r\n0\r\n\r\n"),         # chunk longer than its size
+    (["Content-Length: -1"], b""),
+    (["Content-Length: 12abc"], b""),
+    (["Content-Length: 5", "Content-Length: 6"], b"hello!"),
+    (["Content-Length: 5", "Transfer-Encoding: chunked"], _chunked(b"hello")),  # request smuggling
+    (["Transfer-Encoding: chunked", "Content-Length: 5"], _chunked(b"hello")),
+    (["Transfer-Encoding: gzip"], b"hello"),
+    (["Transfer-Encoding: gzip, chunked"], _chunked(b"hello")),
+    (["Transfer-Encoding: chunked", "Transfer-Encoding: chunked"], _chunked(b"hello")),
+])
+def test_malformed_framing_rejected(port, headers, body):
+    # symptoms payload that the route itself would also answer with 400
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+        sock.sendall(_post("/api/symptoms", body, ["Content-Type: application/json"] + headers))
+        sock.settimeout(2)  # well under the keep-alive timeout
+        data = b""
+        while True:
+            chunk = sock.recv(65536)  # socket.timeout here: the connection was left open
+            if not chunk:
+                break
+            data += chunk
+    assert data.startswith(b"HTTP/1.1 400 ")
+    assert b"'texts' list" not in data, "reached the route"
+    assert data.count(b"HTTP/1.1") == 1
+
+
+def test_body_over_limit(port, monkeypatch):
+    monkeypatch.setattr(async_server, "MAX_BODY_BYTES", 100)
+    [(status, headers, body)] = _send(port, _post("/api/symptoms", b"x" * 200, ["Content-Length: 200"]))
+    assert status == 413
+    assert headers["connection"] == "close"
+    assert "over 100 bytes" in json.loads(body)["error"]
+
+
+def test_keep_alive(port):
+    get = b"GET /api/admission HTTP/1.1\r\nHost: test\r\n\r\n"
+    responses = _send(port, get, get, get)
+    assert [r[0] for r in responses] == [200, 200, 200]
+    assert json.loads(responses[-1][2])["limit"] == async_server.admission.limit
+
+
+def test_shed_request_body_is_skipped(port, monkeypatch):
+    monkeypatch.setattr(async_server.admission, "draining", True)
+    post = _post("/api/symptoms", SYMPTOMS_BAD, [f"Content-Length: {len(SYMPTOMS_BAD)}"])
+    get = b"GET /api/admission HTTP/1.1\r\nHost: test\r\n\r\n"
+    responses = _send(port, post, get)
+    assert responses[0][0] == 503
+    assert int(responses[0][1]["retry-after"]) >= 1
+    # the unread body did not corrupt the next request on the connection
+    assert responses[1][0] == 200
+
+
+def test_shed_with_100_continue_never_asks_for_the_body(port, monkeypatch):
+    monkeypatch.setattr(async_server.admission, "draining", True)
+    head = _post("/api/symptoms", b"", ["Content-Length: 1000000", "Expect: 100-continue"])
+    [(status, headers, _)] = _send(port, head)  # the body is never sent
+    assert status == 503
+    assert "retry-after" in headers
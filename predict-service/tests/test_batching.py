@@ -0,0 +1,131 @@
+"""MicroBatcher with a fake model: one output row per input, recording the batches it saw."""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from batching import MicroBatcher
+from deadlines import DeadlineExceeded
+
+
+class FakeModel:
+    def __init__(self, block_first=False):
+        self.batches = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        if not block_first:
+            self.release.set()
+
+    def __call__(self, batch):
+        self.batches.append([int(v) for v in batch[:, 0, 0, 0]])
+        self.entered.set()
+        self.release.wait(5)
+        return batch.reshape(len(batch), -1) * 10
+
+
+def _x(value):
+    return np.full((1, 1, 1), value, dtype=np.float32)
+
+
+@pytest.fixture
+def make_batcher():
+    batchers = []
+
+    def make(model, **kwargs):
+        b = MicroBatcher("test", model, **kwargs)
+        batchers.append(b)
+        return b
+
+    yield make
+    for b in batchers:
+        b.close()
+
+
+def test_concurrent_items_share_one_batch(make_batcher):
+    model = FakeModel()
+    b = make_batcher(model, max_batch_size=4, max_wait_ms=1000)
+    futures = [b.submit(_x(i)) for i in range(4)]
+    assert [float(f.result(5)[0]) for f in futures] == [0, 10, 20, 30]
+    assert model.batches == [[0, 1, 2, 3]]
+    assert b.stats()["batch_size_histogram"] == {"4": 1}
+
+
+def test_dispatches_after_max_wait(make_batcher):
+    model = FakeModel()
+    b = make_batcher(model, max_batch_size=16, max_wait_ms=5)
+    assert float(b.predict(_x(7), timeout=5)[0]) == 70
+    assert model.batches == [[7]]
+
+
+def test_model_error_reaches_every_item(make_batcher):
+    def broken(batch):
+        raise ValueError("boom")
+
+    b = make_batcher(broken, max_batch_size=2, max_wait_ms=1000)
+    futures = [b.submit(_x(i)) for i in range(2)]
+    for f in futures:
+        with pytest.raises(ValueError):
+            f.result(5)
+    assert b.stats()["errors"] == 1
+
+
+def test_thread_starts_with_first_item(make_batcher):
+    b = make_batcher(FakeModel())
+    assert b.thread_ident is None
+    assert not any(t.name == "batcher-test" for t in threading.enumerate())
+    b.predict(_x(1), timeout=5)
+    assert b.thread_ident is not None
+
+
+def test_closed_batcher_refuses_work():
+    b = MicroBatcher("test", FakeModel())
+    b.close()
+    assert not b._thread.is_alive()
+    with pytest.raises(RuntimeError):
+        b.submit(_x(0))
+
+
+def _blocked(make_batcher):
+    # the first item occupies the model so the rest queue up behind it
+    model = FakeModel(block_first=True)
+    b = make_batcher(model, max_batch_size=1, max_wait_ms=0)
+    first = b.submit(_x(99))
+    assert model.entered.wait(5)
+    return model, b, first
+
+
+def test_most_urgent_first_then_arrival_order(make_batcher):
+    model, b, first = _blocked(make_batcher)
+    futures = [b.submit(_x(i), priority=p) for i, p in enumerate([2, 0, 1, 0, 2])]
+    model.release.set()
+    for f in [first] + futures:
+        f.result(5)
+    assert model.batches == [[99], [1], [3], [2], [0], [4]]
+    # 0 (arrived before 1) and 2 (before 3) were passed over
+    assert b.stats()["preempted"] == 2
+
+
+def test_expired_items_are_dropped_not_run(make_batcher):
+    model, b, first = _blocked(make_batcher)
+    late = b.submit(_x(1), expires_at=time.perf_counter() + 0.05)
+    kept = b.submit(_x(2), expires_at=time.perf_counter() + 60)
+    no_deadline = b.submit(_x(3))
+    time.sleep(0.1)
+    model.release.set()
+    with pytest.raises(DeadlineExceeded) as info:
+        late.result(5)
+    assert info.value.stage == "inference_queue"
+    assert float(kept.result(5)[0]) == 20
+    assert float(no_deadline.result(5)[0]) == 30
+    assert [1] not in model.batches
+    assert b.stats()["expired"] == 1
+
+
+def test_already_expired_item_never_runs(make_batcher):
+    model = FakeModel()
+    b = make_batcher(model, max_batch_size=16, max_wait_ms=5)
+    fut = b.submit(_x(1), expires_at=time.perf_counter() - 1)
+    with pytest.raises(DeadlineExceeded):
+        fut.result(5)
+    assert model.batches == []
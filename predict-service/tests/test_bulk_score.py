@@ -0,0 +1,38 @@
+"""bulk_score's ResultWriter: records, batches written in one go, and --resume."""
+import pytest
+
+from bulk_score import ResultWriter
+
+RECORDS = [("a/b.jpg", {"ok": True, "prediction": "normal", "confidence": 0.9, "top3": [{"c": "normal"}]}),
+           ("c,d.png", {"ok": False, "error": 'ValueError: "bad"'})]
+
+
+@pytest.mark.parametrize("ext", [".jsonl", ".csv"])
+def test_encoded_batch_matches_single_writes(tmp_path, ext):
+    one, batch = tmp_path / f"one{ext}", tmp_path / f"batch{ext}"
+    w = ResultWriter(str(one))
+    for key, payload in RECORDS:
+        w.write(key, payload)
+    w.close()
+    w = ResultWriter(str(batch))
+    w.write_encoded([w.encode(key, payload) for key, payload in RECORDS])
+    w.close()
+    assert one.read_bytes() == batch.read_bytes()
+    resumed = ResultWriter(str(batch), resume=True)
+    assert resumed.done == {"a/b.jpg", "c,d.png"}
+    resumed.close()
+
+
+def test_encode_writes_nothing(tmp_path):
+    out = tmp_path / "out.jsonl"
+    w = ResultWriter(str(out))
+    w.encode(*RECORDS[0])
+    w.close()
+    assert out.read_bytes() == b""
+
+
+def test_existing_output_needs_resume(tmp_path):
+    out = tmp_path / "out.jsonl"
+    out.write_text('{"path": "x"}\n')
+    with pytest.raises(SystemExit):
+        ResultWriter(str(out))
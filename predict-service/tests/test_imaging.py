@@ -0,0 +1,140 @@
+"""DecodedImage against the per-stage decoders it replaced (cv2.imdecode for the gate, PIL for the model)."""
+import io
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+import imaging
+
+
+def _cv2_gate(data, max_side=imaging.GATE_MAX_SIDE):
+    # the eye gate's original decoder
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    h, w = img.shape[:2]
+    scale = min(1.0, float(max_side) / max(h, w))
+    if scale < 1.0:
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def _pil_model_input(data, img_size=imaging.IMG_SIZE):
+    # the CNN's original preprocessing
+    with Image.open(io.BytesIO(data)) as im:
+        im = im.convert("RGB").resize((img_size, img_size), Image.BILINEAR)
+        return np.asarray(im, dtype=np.float32)[None] / 255.0
+
+
+def _pixels(h, w, seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:h, 0:w]
+    base = np.stack([xx * 255 // w, yy * 255 // h, (xx + yy) * 255 // (h + w)], axis=-1)
+    return np.clip(base + rng.integers(-20, 20, (h, w, 3)), 0, 255).astype(np.uint8)
+
+
+def _encode(arr, fmt, **params):
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, fmt, **params)
+    return buf.getvalue()
+
+
+def _jpeg(h, w, orientation=None):
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[imaging.EXIF_ORIENTATION] = orientation
+    return _encode(_pixels(h, w), "JPEG", quality=90, exif=exif.tobytes())
+
+
+@pytest.mark.parametrize("size", [(480, 600), (1200, 1600)])
+def test_jpeg_matches_cv2_and_pil(size):
+    data = _jpeg(*size)
+    d = imaging.DecodedImage.from_bytes(data)
+    assert (d.width, d.height) == (size[1], size[0])
+    np.testing.assert_array_equal(d.gate_bgr(), _cv2_gate(data))
+    np.testing.assert_allclose(d.model_input(), _pil_model_input(data), atol=1e-6)
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_exif_orientation_matches_cv2(orientation):
+    data = _jpeg(900, 1300, orientation)
+    d = imaging.DecodedImage.from_bytes(data)
+    assert d.orientation == orientation
+    np.testing.assert_array_equal(d.gate_bgr(), _cv2_gate(data))
+
+
+def test_png_matches_cv2():
+    data = _encode(_pixels(700, 900), "PNG")
+    d = imaging.DecodedImage.from_bytes(data)
+    np.testing.assert_array_equal(d.gate_bgr(), _cv2_gate(data))
+    np.testing.assert_allclose(d.model_input(), _pil_model_input(data), atol=1e-6)
+
+
+def test_16bit_gray_png_matches_cv2():
+    rng = np.random.default_rng(1)
+    gray16 = rng.integers(0, 65536, (500, 700), dtype=np.uint16)
+    data = _encode(gray16, "PNG")
+    with Image.open(io.BytesIO(data)) as im:
+        assert im.mode in imaging.HIGH_BIT_DEPTH_MODES
+    d = imaging.DecodedImage.from_bytes(data)
+    np.testing.assert_array_equal(d.gate_bgr(), _cv2_gate(data))
+    # the model sees the high byte too, not PIL's clipped 0..255
+    high_byte = _encode((gray16 >> 8).astype(np.uint8), "PNG")
+    np.testing.assert_allclose(d.model_input(), _pil_model_input(high_byte), atol=1e-6)
+    assert d.model_input().max() > 0.5
+
+
+def test_16bit_png_from_cv2_matches_cv2():
+    # 16-bit RGB PNGs are written with cv2 (PIL cannot), and decoded by both sides
+    rng = np.random.default_rng(2)
+    bgr16 = rng.integers(0, 65536, (400, 800, 3), dtype=np.uint16)
+    ok, enc = cv2.imencode(".png", bgr16)
+    assert ok
+    data = enc.tobytes()
+    d = imaging.DecodedImage.from_bytes(data)
+    assert d is not None
+    gate = d.gate_bgr()
+    ref = _cv2_gate(data)
+    assert gate.shape == ref.shape
+    assert np.abs(gate.astype(np.int16) - ref.astype(np.int16)).max() <= 1
+
+
+def test_not_an_image():
+    assert imaging.DecodedImage.from_bytes(b"definitely not an image") is None
+
+
+def test_oversized_header_rejected_before_decode():
+    data = _encode(_pixels(64, 64), "PNG")
+    with pytest.raises(imaging.ImageTooLarge):
+        imaging.DecodedImage.from_bytes(data, max_pixels=64 * 63)
+
+
+def test_draft_is_off_by_default():
+    data = _jpeg(2400, 3200)
+    d = imaging.DecodedImage.from_bytes(data)
+    assert d.draft_scale == 1.0
+    np.testing.assert_array_equal(d.gate_bgr(), _cv2_gate(data))
+
+
+def test_draft_decodes_reduced_but_keeps_gate_size():
+    data = _jpeg(2400, 3200)
+    full = imaging.DecodedImage.from_bytes(data, draft=False)
+    d = imaging.DecodedImage.from_bytes(data, draft=True)
+    assert d.draft_scale < 1.0
+    assert (d.width, d.height) == (full.width, full.height)
+    # still at least as large as the gate and the model need
+    assert min(d.im.size) >= imaging.IMG_SIZE
+    assert max(d.im.size) >= imaging.GATE_MAX_SIDE
+    assert d.gate_bgr().shape == full.gate_bgr().shape
+    assert d.model_input().shape == full.model_input().shape
+    diff = np.abs(d.gate_bgr().astype(np.int16) - full.gate_bgr().astype(np.int16))
+    assert diff.mean() < 2.0
+
+
+def test_draft_ignored_for_small_jpegs_and_pngs():
+    small = _jpeg(480, 600)
+    assert imaging.DecodedImage.from_bytes(small, draft=True).draft_scale == 1.0
+    png = _encode(_pixels(2400, 3200), "PNG")
+    d = imaging.DecodedImage.from_bytes(png, draft=True)
+    assert d.draft_scale == 1.0
+    np.testing.assert_array_equal(d.gate_bgr(), _cv2_gate(png))
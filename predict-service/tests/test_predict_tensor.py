@@ -0,0 +1,131 @@
+"""/api/predict/tensor header and body validation (all rejected before the gate or the models run)."""
+import io
+import json
+
+import cv2
+import numpy as np
+import pytest
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import imaging
+from imaging import RawImage, TensorFormatError, parse_shape
+
+MODEL_BYTES = imaging.IMG_SIZE * imaging.IMG_SIZE * 3
+
+
+@pytest.fixture(scope="module")
+def client():
+    import server
+    return server.app.test_client()
+
+
+def _post(client, body, shape="224,224,3", **headers):
+    if shape is not None:
+        headers["X-Tensor-Shape"] = shape
+    return client.post("/api/predict/tensor?image_type=fundus", data=body,
+                       headers={k.replace("_", "-"): v for k, v in headers.items()})
+
+
+@pytest.mark.parametrize("shape", ["", "224,224", "224,224,3,1", "a,b,c", "0,224,3", "224,-1,3"])
+def test_malformed_shape_header(client, shape):
+    r = _post(client, b"\0" * MODEL_BYTES, shape=shape)
+    assert r.status_code == 400
+    assert "X-Tensor-Shape" in r.get_json()["error"]
+
+
+def test_missing_shape_header(client):
+    assert _post(client, b"\0" * MODEL_BYTES, shape=None).status_code == 400
+
+
+@pytest.mark.parametrize("shape", ["112,112,3", "224,224,1", "224,224,4", "256,256,3"])
+def test_shape_must_be_the_model_input(client, shape):
+    h, w, c = (int(v) for v in shape.split(","))
+    r = _post(client, b"\0" * (h * w * c), shape=shape)
+    assert r.status_code == 400
+    assert "224,224,3" in r.get_json()["error"]
+
+
+def test_only_uint8(client):
+    r = _post(client, b"\0" * MODEL_BYTES * 4, X_Tensor_Dtype="float32")
+    assert r.status_code == 400
+    assert "uint8" in r.get_json()["error"]
+
+
+@pytest.mark.parametrize("gate", ["641,480,3", "480,641,3", "480,640,1", "oops"])
+def test_bad_gate_shape(client, gate):
+    r = _post(client, b"\0" * MODEL_BYTES, X_Gate_Shape=gate)
+    assert r.status_code == 400
+    assert "X-Gate-Shape" in r.get_json()["error"] or "gate thumbnail" in r.get_json()["error"]
+
+
+@pytest.mark.parametrize("size", [0, MODEL_BYTES - 1, MODEL_BYTES + 1])
+def test_body_length_must_match_headers(client, size):
+    r = _post(client, b"\0" * size)
+    assert r.status_code == 400
+    assert f"describe {MODEL_BYTES}" in r.get_json()["error"]
+
+
+def test_body_length_includes_gate_thumbnail(client):
+    r = _post(client, b"\0" * MODEL_BYTES, X_Gate_Shape="480,640,3")
+    assert r.status_code == 400
+    assert f"describe {MODEL_BYTES + 480 * 640 * 3}" in r.get_json()["error"]
+
+
+class CountingStream(io.RawIOBase):
+    """An endless request body that records how much of it was read."""
+
+    def __init__(self):
+        self.read_bytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        self.read_bytes += len(b)
+        b[:] = b"\0" * len(b)
+        return len(b)
+
+
+def test_chunked_body_read_is_bounded():
+    import server
+    # no Content-Length (chunked) and wsgi.input_terminated, as gunicorn passes such a request
+    environ = EnvironBuilder("/api/predict/tensor", method="POST",
+                             headers={"X-Tensor-Shape": "224,224,3"}).get_environ()
+    environ.pop("CONTENT_LENGTH", None)
+    stream = CountingStream()
+    environ.update({"wsgi.input": stream, "wsgi.input_terminated": True})
+    body, status, _ = run_wsgi_app(server.app, environ, buffered=True)
+    assert status.startswith("400")
+    assert f"longer than the {MODEL_BYTES} bytes" in json.loads(b"".join(body))["error"]
+    assert stream.read_bytes <= MODEL_BYTES + 1
+
+
+def test_parse_shape():
+    assert parse_shape("224,224,3") == (224, 224, 3)
+    assert parse_shape("224x224x3") == (224, 224, 3)
+    with pytest.raises(TensorFormatError):
+        parse_shape(None)
+
+
+def test_raw_image_views_the_body():
+    rng = np.random.default_rng(0)
+    model = rng.integers(0, 256, (224, 224, 3), dtype=np.uint8)
+    gate = rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    body = model.tobytes() + gate.tobytes()
+    image = RawImage.from_buffer(body, (224, 224, 3), "uint8", (480, 640, 3))
+    assert (image.width, image.height) == (640, 480)
+    np.testing.assert_array_equal(image.gate_bgr(), cv2.cvtColor(gate, cv2.COLOR_RGB2BGR))
+    np.testing.assert_allclose(image.model_input()[0], model / np.float32(255.0), atol=1e-6)
+    # without a thumbnail the gate runs on the model image
+    alone = RawImage.from_buffer(model.tobytes(), (224, 224, 3))
+    np.testing.assert_array_equal(alone.gate_bgr(), cv2.cvtColor(model, cv2.COLOR_RGB2BGR))
+
+
+def test_image_type_label_is_bounded(client):
+    import server
+    before = server.requests_total.value(endpoint="predict_tensor", image_type="other")
+    for i in range(5):
+        client.post(f"/api/predict/tensor?image_type=made-up-{i}", data=b"",
+                    headers={"X-Tensor-Shape": "1,1,1"})
+    assert server.requests_total.value(endpoint="predict_tensor", image_type="other") == before + 5
+    assert not any("made-up" in line for line in server.requests_total.render())
@@ -0,0 +1,47 @@
+"""Who may ask for a request profile, and a profile that cannot be written."""
+import pytest
+
+import profiling
+
+
+@pytest.fixture
+def srv(tmp_path, monkeypatch):
+    import server
+    monkeypatch.setattr(server, "profiler", profiling.Profiler(str(tmp_path), rate=0))
+    return server
+
+
+def _post(srv, **headers):
+    # rejected by the tensor route before any model runs; the route is profiled
+    headers = {"X-Tensor-Shape": "1,1,1", **{k.replace("_", "-"): v for k, v in headers.items()}}
+    return srv.app.test_client().post("/api/predict/tensor", data=b"", headers=headers)
+
+
+def test_debug_header_ignored_without_admin_token(srv, monkeypatch):
+    monkeypatch.setattr(srv, "ADMIN_TOKEN", "")
+    assert _post(srv, X_Debug_Profile="1").status_code == 400
+    assert srv.profiler.started == 0
+
+
+def test_debug_header_needs_the_token(srv, monkeypatch):
+    monkeypatch.setattr(srv, "ADMIN_TOKEN", "secret")
+    _post(srv, X_Debug_Profile="1", X_Admin_Token="wrong")
+    assert srv.profiler.started == 0
+    _post(srv, X_Debug_Profile="1", X_Admin_Token="secret")
+    assert (srv.profiler.started, srv.profiler.written) == (1, 1)
+    [entry] = srv.profiler.list()
+    assert entry["endpoint"] == "predict_tensor" and entry["reason"] == "header"
+
+
+def test_failed_profile_write_keeps_the_response(srv, monkeypatch, capsys):
+    monkeypatch.setattr(srv, "ADMIN_TOKEN", "secret")
+
+    def broken(profile):
+        profile.stop()
+        raise OSError("disk full")
+
+    monkeypatch.setattr(srv.profiler, "finish", broken)
+    r = _post(srv, X_Debug_Profile="1", X_Admin_Token="secret")
+    assert r.status_code == 400
+    assert "224,224,3" in r.get_json()["error"]
+    assert "disk full" in capsys.readouterr().err
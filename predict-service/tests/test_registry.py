@@ -0,0 +1,167 @@
+"""ModelRegistry reloads: failed ones leave nothing running, successful ones retire the old set."""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import registry
+from batching import MicroBatcher
+
+
+class FakeSet:
+    """A model set whose warm-up runs through its batcher (starting its thread), then optionally fails."""
+
+    def __init__(self, version, fail=False):
+        self.version = version
+        self.leases = 0
+        self.fail = fail
+        self.closed = 0
+        self.batcher = MicroBatcher(f"fake-{version.name}", lambda batch: batch)
+
+    def load(self):
+        self.batcher.predict(np.zeros((1, 1, 1)), timeout=5)
+        if self.fail:
+            raise RuntimeError(f"cannot load {self.version.name}")
+        return self
+
+    def status(self):
+        return {"fake": "ready"}
+
+    def close(self):
+        self.batcher.close()
+        self.closed += 1
+
+
+def _batcher_threads(version_name):
+    return [t for t in threading.enumerate() if t.name == f"batcher-fake-{version_name}" and t.is_alive()]
+
+
+def _make_version(model_dir, name):
+    d = model_dir / "versions" / name
+    d.mkdir(parents=True)
+    for f in registry.MODEL_FILES:
+        (d / f).write_bytes(name.encode())
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    for name in ("v1", "v2", "broken"):
+        _make_version(tmp_path, name)
+    registry.set_current(str(tmp_path), "v1")
+    return tmp_path
+
+
+@pytest.fixture
+def setup(model_dir):
+    built, swapped = [], []
+
+    def build(version):
+        s = FakeSet(version, fail=version.name == "broken")
+        built.append(s)
+        return s
+
+    reg = registry.ModelRegistry(str(model_dir), build, on_swap=swapped.append)
+    reg.reload()
+    yield reg, built, swapped
+    for s in built:
+        if not s.closed:
+            s.close()
+
+
+def test_failed_reload_closes_the_new_set(setup, model_dir):
+    reg, built, swapped = setup
+    v1 = reg.active()
+    for _ in range(3):
+        with pytest.raises(registry.ReloadError, match="cannot load broken"):
+            reg.reload("broken")
+    failed = built[1:]
+    assert len(failed) == 3
+    assert all(s.closed == 1 for s in failed)
+    assert _batcher_threads("broken") == []
+    # the old set keeps serving, untouched
+    assert reg.active() is v1 and v1.closed == 0
+    assert len(_batcher_threads("v1")) == 1
+    assert swapped == [v1]
+    assert registry.read_current(str(model_dir)) == "v1"
+    status = reg.status()
+    assert status["failures"] == 3
+    assert status["last_reload"]["ok"] is False
+    assert "RuntimeError" in status["last_reload"]["error"]
+
+
+def test_reload_with_missing_files_builds_nothing(setup, model_dir):
+    reg, built, _ = setup
+    (model_dir / "versions" / "v2" / "components.pkl").unlink()
+    with pytest.raises(registry.ReloadError, match="components.pkl"):
+        reg.reload("v2")
+    assert len(built) == 1
+
+
+def test_successful_reload_retires_idle_set(setup, model_dir):
+    reg, built, swapped = setup
+    v1 = reg.active()
+    report = reg.reload("v2")
+    v2 = reg.active()
+    assert report["ok"] and report["version"] == "v2" and report["previous"] == "v1"
+    assert v2 is not v1 and v2.version.name == "v2"
+    assert swapped == [v1, v2]
+    assert registry.read_current(str(model_dir)) == "v2"
+    # nothing was in flight: the old set is closed during the reload
+    assert v1.closed == 1
+    assert _batcher_threads("v1") == []
+    assert len(_batcher_threads("v2")) == 1
+
+
+def test_old_set_waits_for_its_leases(setup):
+    reg, built, _ = setup
+    v1 = reg.acquire()
+    report = reg.reload("v2")
+    assert report["in_flight_on_previous"] == 1
+    assert v1.closed == 0
+    assert reg.status()["retiring"] == [{"version": "v1", "in_flight": 1}]
+    # new requests get the new set; the old lease is released on the old one
+    v2 = reg.acquire()
+    assert v2.version.name == "v2"
+    reg.release(v2)
+    reg.release(v1)
+    deadline = time.time() + 5
+    while "released_after_s" not in reg.last_report and time.time() < deadline:
+        time.sleep(0.01)
+    assert v1.closed == 1
+    assert _batcher_threads("v1") == []
+    assert reg.status()["retiring"] == []
+
+
+def test_concurrent_reload_refused(setup):
+    reg, _, _ = setup
+    assert reg._reload_lock.acquire(blocking=False)
+    try:
+        with pytest.raises(registry.ReloadError, match="already in progress"):
+            reg.reload("v2")
+    finally:
+        reg._reload_lock.release()
+
+
+def test_server_model_set_failing_to_load_stops_its_batchers(model_dir, monkeypatch):
+    # the real ModelSet: corrupt model files fail the load after its batchers have started
+    import server
+
+    monkeypatch.setattr(server, "BATCHING_ENABLED", True)
+
+    def batcher_threads():
+        return [t for t in threading.enumerate() if t.name.startswith("batcher-") and t.is_alive()
+                and not t.name.startswith("batcher-fake-")]
+
+    before = len(batcher_threads())
+    # building a set starts nothing; its batchers start with their first item
+    built = server.ModelSet(registry.get_version(str(model_dir), "v1"))
+    assert built.batchers and all(b.thread_ident is None for b in built.batchers.values())
+    assert len(batcher_threads()) == before
+    built.close()
+    reg = registry.ModelRegistry(str(model_dir), server.ModelSet)
+    for _ in range(2):
+        with pytest.raises(registry.ReloadError):
+            reg.reload("broken")
+    assert len(batcher_threads()) == before
+    assert reg.active() is None
@@ -0,0 +1,131 @@
+"""ResultCache: lookups, bounds and invalidation when the model files change."""
+import os
+
+import pytest
+
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def model_files(tmp_path):
+    paths = []
+    for name in ("fundus.keras", "outer.keras"):
+        p = tmp_path / name
+        p.write_bytes(b"weights v1")
+        paths.append(str(p))
+    return paths
+
+
+def _replace(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+def test_key_covers_image_type_and_normalised_symptoms():
+    k = ResultCache.key(b"img", "fundus", "Blurred  Vision")
+    assert k == ResultCache.key(b"img", "fundus", "blurred vision")
+    assert k != ResultCache.key(b"img", "outer", "blurred vision")
+    assert k != ResultCache.key(b"img2", "fundus", "blurred vision")
+
+
+def test_put_get_and_miss(model_files):
+    cache = ResultCache(model_files)
+    cache.put("a", {"prediction": "normal"})
+    assert cache.get("a") == {"prediction": "normal"}
+    assert cache.get("b") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_replacing_a_model_file_invalidates(model_files):
+    cache = ResultCache(model_files, check_interval_s=0)
+    cache.put("a", {"prediction": "normal"})
+    before = cache.fingerprint
+    _replace(model_files[0], b"weights v2, retrained")
+    assert cache.get("a") is None
+    assert cache.fingerprint != before
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_change_noticed_only_after_check_interval(model_files):
+    cache = ResultCache(model_files, check_interval_s=3600)
+    cache.put("a", {"prediction": "normal"})
+    _replace(model_files[0], b"weights v2, retrained")
+    assert cache.get("a") == {"prediction": "normal"}
+    # a reload rescopes explicitly instead of waiting for the next check
+    cache.rescope(model_files)
+    assert cache.get("a") is None
+
+
+def test_rescope_to_other_files_invalidates(model_files, tmp_path):
+    cache = ResultCache(model_files, check_interval_s=3600)
+    cache.put("a", {"prediction": "normal"})
+    other = tmp_path / "v2.keras"
+    other.write_bytes(b"weights v2")
+    cache.rescope([str(other)])
+    assert cache.get("a") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_rescope_to_same_files_keeps_entries(model_files):
+    cache = ResultCache(model_files, check_interval_s=3600)
+    cache.put("a", {"prediction": "normal"})
+    cache.rescope(list(model_files))
+    assert cache.get("a") == {"prediction": "normal"}
+    assert cache.stats()["invalidations"] == 0
+
+
+def test_disk_layer_survives_restart_until_models_change(model_files, tmp_path):
+    disk = str(tmp_path / "cache")
+    ResultCache(model_files, disk_dir=disk).put("a", {"prediction": "normal"})
+    restarted = ResultCache(model_files, disk_dir=disk)
+    assert restarted.get("a") == {"prediction": "normal"}
+    assert restarted.stats()["disk_hits"] == 1
+    _replace(model_files[1], b"weights v2, retrained")
+    after_swap = ResultCache(model_files, disk_dir=disk)
+    assert after_swap.get("a") is None
+
+
+def test_other_versions_kept_while_in_use(model_files, tmp_path):
+    disk = tmp_path / "cache"
+    old = ResultCache(model_files, disk_dir=str(disk))
+    old.put("a", {"prediction": "normal"})
+    _replace(model_files[1], b"weights v2, retrained")
+    # a worker on the new version starts while one on the old version still serves
+    new = ResultCache(model_files, disk_dir=str(disk))
+    assert sorted(os.listdir(disk)) == sorted([old.fingerprint, new.fingerprint])
+    # once the old version's directory has gone unwritten for the TTL, it is removed
+    stale = disk / old.fingerprint
+    os.utime(stale, (0, 0))
+    ResultCache(model_files, disk_dir=str(disk))
+    assert os.listdir(disk) == [new.fingerprint]
+
+
+def test_unrelated_files_in_disk_dir_untouched(model_files, tmp_path):
+    disk = tmp_path / "shared"
+    for name in ("notes", "0123456789abcdef0"):
+        (disk / name).mkdir(parents=True)
+        os.utime(disk / name, (0, 0))
+    (disk / "report.txt").write_text("keep me")
+    cache = ResultCache(model_files, disk_dir=str(disk))
+    cache.clear()
+    assert sorted(os.listdir(disk)) == sorted(["notes", "0123456789abcdef0", "report.txt", cache.fingerprint])
+
+
+def test_expired_entries_are_misses(model_files):
+    cache = ResultCache(model_files, ttl_s=-1)
+    cache.put("a", {"prediction": "normal"})
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction_by_bytes(model_files):
+    cache = ResultCache(model_files, max_bytes=40)
+    for k in ("a", "b", "c"):
+        cache.put(k, {"p": k * 10})
+    assert cache.get("a") is None
+    assert cache.get("c") == {"p": "c" * 10}
+    assert cache.stats()["bytes"] <= 40
+    assert cache.stats()["evictions"] >= 1
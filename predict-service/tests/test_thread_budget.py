@@ -0,0 +1,30 @@
+"""compute_budget: the gate pool and inference share a worker's CPUs without oversubscribing them."""
+import pytest
+
+from thread_budget import compute_budget
+
+
+def _threads(b):
+    return b["gate_workers"] * b["opencv"] + b["tf_inter_op"] * b["tf_intra_op"]
+
+
+@pytest.mark.parametrize("profile", ["latency", "throughput"])
+@pytest.mark.parametrize("cpus,workers", [(2, 1), (3, 1), (4, 1), (8, 1), (16, 1), (16, 4), (64, 3)])
+def test_share_not_oversubscribed(cpus, workers, profile):
+    b = compute_budget(cpus, workers, profile)
+    assert b["cpus_per_worker"] == cpus // workers
+    assert _threads(b) <= b["cpus_per_worker"]
+    assert min(b["gate_workers"], b["tf_inter_op"], b["tf_intra_op"], b["opencv"]) >= 1
+
+
+@pytest.mark.parametrize("cpus,workers", [(1, 1), (4, 4), (2, 8)])
+def test_one_cpu_share_is_one_thread_over(cpus, workers):
+    b = compute_budget(cpus, workers)
+    assert (b["gate_workers"], b["tf_inter_op"], b["tf_intra_op"]) == (1, 1, 1)
+    assert _threads(b) == 2
+
+
+def test_profiles():
+    assert compute_budget(8, profile="latency")["tf_inter_op"] == 1
+    assert compute_budget(8, profile="throughput")["tf_inter_op"] == 2
+    assert compute_budget(8, profile="unknown")["profile"] == "latency"
@@ -0,0 +1,142 @@
+"""
+Thread budget for TensorFlow, TFLite and OpenCV.
+
+The CPUs a worker may use are the ones it can actually run on (affinity,
+cgroup v2 cpu.max / v1 CFS quota) divided by the number of workers sharing
+them. Within a worker the eye-gate pool (gate_workers threads, each running
+OpenCV with `opencv` threads) and model inference run at the same time, so the
+share is split between them: gate_workers * opencv + tf_inter_op * tf_intra_op
+never exceeds a share of two or more CPUs. A one-CPU share still needs one gate
+worker and one inference thread (1/1/1), so it is oversubscribed by one thread.
+The profile decides how the inference part is spent:
+
+  latency     one request at a time should finish fast: a single inter-op
+              thread and every remaining CPU for intra-op / TFLite
+  throughput  many requests in flight: parallelism comes from concurrent
+              requests / batches, so up to two ops run side by side with
+              smaller intra-op pools
+
+    python thread_budget.py [--profile throughput] [--workers 4]
+"""
+import math
+import os
+
+PROFILES = ("latency", "throughput")
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit():
+    """CPU limit from the cgroup quota (fractional), or None if unlimited / unknown."""
+    v2 = _read("/sys/fs/cgroup/cpu.max")
+    if v2:
+        quota, _, period = v2.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    quota = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") or _read("/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us")
+    period = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us") or _read("/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def available_cpus():
+    """(cpus, details): usable CPUs for this process, honouring affinity and cgroup quotas."""
+    try:
+        affinity = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        affinity = os.cpu_count() or 1
+    quota = cgroup_cpu_limit()
+    cpus = affinity if quota is None else max(1, min(affinity, math.ceil(quota)))
+    return cpus, {"cpu_count": os.cpu_count(), "affinity": affinity, "cgroup_quota": quota}
+
+
+def compute_budget(cpus, workers=1, profile="latency"):
+    profile = profile if profile in PROFILES else "latency"
+    share = max(1, cpus // max(1, workers))
+    gate_workers, opencv = max(1, share // 2), 1
+    inference = max(1, share - gate_workers)
+    inter = min(2, inference) if profile == "throughput" else 1
+    intra = max(1, inference // inter)
+    return {
+        "profile": profile,
+        "cpus": cpus,
+        "workers": workers,
+        "cpus_per_worker": share,
+        "tf_intra_op": intra,
+        "tf_inter_op": inter,
+        "tflite": intra,
+        "opencv": opencv,
+        "gate_workers": gate_workers,
+    }
+
+
+def _env_int(name):
+    v = os.environ.get(name)
+    return int(v) if v not in (None, "") else None
+
+
+def budget_from_env():
+    """
+    PREDICT_THREAD_PROFILE (latency | throughput), PREDICT_CPUS, PREDICT_WORKERS
+    (else WEB_CONCURRENCY, else 1); PREDICT_TF_INTRA_THREADS, PREDICT_TF_INTER_THREADS,
+    PREDICT_TFLITE_THREADS and PREDICT_OPENCV_THREADS override single values.
+    """
+    cpus, details = available_cpus()
+    cpus = _env_int("PREDICT_CPUS") or cpus
+    workers = _env_int("PREDICT_WORKERS") or _env_int("WEB_CONCURRENCY") or 1
+    budget = compute_budget(cpus, workers, os.environ.get("PREDICT_THREAD_PROFILE", "latency").lower())
+    overrides = {}
+    for key, env in (("tf_intra_op", "PREDICT_TF_INTRA_THREADS"), ("tf_inter_op", "PREDICT_TF_INTER_THREADS"),
+                     ("tflite", "PREDICT_TFLITE_THREADS"), ("opencv", "PREDICT_OPENCV_THREADS")):
+        v = _env_int(env)
+        if v is not None:
+            budget[key] = overrides[key] = v
+    budget["detected"] = details
+    budget["overrides"] = overrides
+    return budget
+
+
+def apply(budget):
+    """Apply to TensorFlow (must run before the TF runtime starts) and OpenCV; returns the effective values."""
+    import cv2
+    import tensorflow as tf
+
+    errors = {}
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(budget["tf_intra_op"])
+        tf.config.threading.set_inter_op_parallelism_threads(budget["tf_inter_op"])
+    except RuntimeError as e:  # TF already initialised
+        errors["tensorflow"] = str(e)
+    cv2.setNumThreads(budget["opencv"])
+    effective = {
+        "tf_intra_op": tf.config.threading.get_intra_op_parallelism_threads(),
+        "tf_inter_op": tf.config.threading.get_inter_op_parallelism_threads(),
+        "opencv": cv2.getNumThreads(),
+    }
+    if errors:
+        effective["errors"] = errors
+    return effective
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--profile", choices=PROFILES)
+    ap.add_argument("--workers", type=int)
+    ap.add_argument("--cpus", type=int)
+    args = ap.parse_args()
+    for env, value in (("PREDICT_THREAD_PROFILE", args.profile), ("PREDICT_WORKERS", args.workers),
+                       ("PREDICT_CPUS", args.cpus)):
+        if value is not None:
+            os.environ[env] = str(value)
+    print(json.dumps(budget_from_env(), indent=2))
@@ -0,0 +1,152 @@
+"""
+Warm-path inference: first-call vs steady-state latency per model, and keep-warm.
+
+The first forward pass of a model (and, with Keras, the first at each new batch
+size) traces graphs and allocates buffers; after a quiet period the next call is
+slow again (thread pools parked, caches cold). server.py warms every batch size
+the micro-batchers can emit when a model loads (PREDICT_WARMUP_BATCH_SIZES), and
+KeepWarm runs a small inference whenever the models have been idle for
+PREDICT_KEEPWARM_S seconds. CallStats records every model call, so the gap
+between a model's first live call (or a call after an idle period) and its
+steady-state latency at the same batch size is visible in /api/warmpath and
+/api/metrics: it should be close to 0 once the cold path is gone.
+"""
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import numpy as np
+
+STEADY_MIN_CALLS = 3  # steady-state latency is reported once a batch size has this many warm calls
+
+
+def parse_batch_sizes(text, max_batch_size):
+    """PREDICT_WARMUP_BATCH_SIZES: "1,2,4" -> [1, 2, 4]; "all" (or empty) -> 1..max_batch_size."""
+    text = (text or "all").strip().lower()
+    if text == "all":
+        return list(range(1, max(1, max_batch_size) + 1))
+    return sorted({int(s) for s in text.split(",") if s.strip() and int(s) > 0})
+
+
+class CallStats:
+    """
+    Latency of one model's calls, per batch size and phase (warmup | keepwarm |
+    live). A live call is "after idle" when no call of any phase ran in the
+    idle_s seconds before it; those and each size's first live call are kept out
+    of the steady-state window they are compared against.
+    """
+
+    def __init__(self, name, idle_s=30.0, window=64):
+        self.name = name
+        self.idle_s = idle_s
+        self.window = window
+        self.last_call_at = None  # time.monotonic() of the last call, any phase
+        self.calls = {"warmup": 0, "keepwarm": 0, "live": 0}
+        self.warmup_first_ms = None
+        self.first_call = None  # (batch size, ms) of the first live call
+        self._first = {}  # batch size -> first live call ms
+        self._steady = {}  # batch size -> deque of warm live call ms
+        self._after_idle = deque(maxlen=window)  # (batch size, ms)
+        self._lock = threading.Lock()
+
+    def record(self, batch_size, seconds, phase="live", started_at=None):
+        ms = seconds * 1000.0
+        started_at = time.monotonic() - seconds if started_at is None else started_at
+        with self._lock:
+            idle = self.last_call_at is not None and started_at - self.last_call_at >= self.idle_s
+            self.last_call_at = started_at + seconds
+            self.calls[phase] = self.calls.get(phase, 0) + 1
+            if phase == "warmup":
+                if self.warmup_first_ms is None:
+                    self.warmup_first_ms = ms
+                return
+            if phase != "live":
+                return
+            if self.first_call is None:
+                self.first_call = (batch_size, ms)
+            if batch_size not in self._first:
+                self._first[batch_size] = ms
+            elif idle:
+                self._after_idle.append((batch_size, ms))
+            else:
+                self._steady.setdefault(batch_size, deque(maxlen=self.window)).append(ms)
+
+    def _steady_ms(self, batch_size):
+        samples = self._steady.get(batch_size)
+        if not samples or len(samples) < STEADY_MIN_CALLS:
+            return None
+        return float(np.median(samples))
+
+    def stats(self):
+        with self._lock:
+            out = {"calls": dict(self.calls), "idle_s": self.idle_s,
+                   "warmup_first_ms": _round(self.warmup_first_ms),
+                   "first_call_ms": None, "first_call_batch_size": None, "steady_ms": None,
+                   "first_call_gap_ms": None, "after_idle_calls": len(self._after_idle),
+                   "after_idle_gap_ms": None, "batch_sizes": {}}
+            for n in sorted(self._first):
+                steady = self._steady_ms(n)
+                out["batch_sizes"][n] = {"first_ms": _round(self._first[n]), "steady_ms": _round(steady),
+                                         "calls": 1 + len(self._steady.get(n, ()))}
+            if self.first_call is not None:
+                n, ms = self.first_call
+                steady = self._steady_ms(n)
+                out.update(first_call_ms=_round(ms), first_call_batch_size=n, steady_ms=_round(steady),
+                           first_call_gap_ms=_round(ms - steady) if steady is not None else None)
+            gaps = [ms - self._steady_ms(n) for n, ms in self._after_idle if self._steady_ms(n) is not None]
+            if gaps:
+                out["after_idle_gap_ms"] = _round(float(np.mean(gaps)))
+            return out
+
+
+def _round(v):
+    return round(v, 3) if v is not None else None
+
+
+class KeepWarm:
+    """
+    Calls warm_fn() whenever idle_fn() (seconds since the last model call) reaches
+    interval_s; checked a few times per interval, on a daemon thread. warm_fn
+    returns False if there was nothing to warm (models still loading).
+    """
+
+    def __init__(self, interval_s, warm_fn, idle_fn):
+        self.interval_s = interval_s
+        self.warm_fn = warm_fn
+        self.idle_fn = idle_fn
+        self.runs = 0
+        self.errors = 0
+        self.last_run_ms = None
+        self.last_run_at = None
+        self._thread = None
+
+    def start(self):
+        if self.interval_s <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="keep-warm", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(max(0.5, self.interval_s / 4.0))
+            idle = self.idle_fn()
+            if idle is None or idle < self.interval_s:
+                continue
+            t0 = time.perf_counter()
+            try:
+                if self.warm_fn() is False:
+                    continue
+            except Exception:
+                self.errors += 1
+                print(f"Keep-warm inference failed:\n{traceback.format_exc()}", file=sys.stderr)
+                sys.stderr.flush()
+                continue
+            self.runs += 1
+            self.last_run_ms = round((time.perf_counter() - t0) * 1000.0, 3)
+            self.last_run_at = time.time()
+
+    def stats(self):
+        return {"enabled": self._thread is not None, "interval_s": self.interval_s, "runs": self.runs,
+                "errors": self.errors, "last_run_ms": self.last_run_ms, "last_run_at": self.last_run_at}